@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MetricsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api.metrics'
+
+    def ready(self):
+        import api.metrics.signals  # noqa: F401
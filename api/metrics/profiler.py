@@ -0,0 +1,98 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+With METRICS_PROFILE_THRESHOLD_MS set, a daemon thread samples the stacks of
+every thread working on an in-flight request each
+METRICS_PROFILE_INTERVAL_MS. When a request takes longer than the threshold
+its samples are written to METRICS_PROFILE_DIR in the folded format that
+flamegraph.pl, speedscope and inferno read: one `frame;frame;frame count`
+line per distinct stack, outermost frame first.
+
+Async views share the event loop thread with every other request in
+flight, so their stacks include whatever else the loop ran meanwhile.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_active = {}
+_sampler = None
+
+
+def threshold():
+    """The latency in seconds above which requests are dumped, or None when profiling is off."""
+    value = getattr(settings, 'METRICS_PROFILE_THRESHOLD_MS', None)
+    return None if value is None else value / 1000
+
+
+def _interval():
+    return getattr(settings, 'METRICS_PROFILE_INTERVAL_MS', 5) / 1000
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _sample_forever():
+    own = threading.get_ident()
+    while True:
+        time.sleep(_interval())
+        with _lock:
+            active = list(_active.values())
+        if not active:
+            continue
+        frames = sys._current_frames()
+        for metrics, samples in active:
+            for ident in list(metrics.threads):
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    samples[fold(frame)] += 1
+
+
+def start(metrics):
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_forever, name='metrics-profiler', daemon=True)
+            _sampler.start()
+        _active[id(metrics)] = (metrics, Counter())
+
+
+def finish(metrics):
+    """Stop sampling `metrics`' request; dumps its stacks if it was slow. Returns the file written, if any."""
+    with _lock:
+        _, samples = _active.pop(id(metrics), (None, None))
+    limit = threshold()
+    elapsed = metrics.elapsed()
+    if samples is None or limit is None or elapsed < limit:
+        return None
+    directory = getattr(settings, 'METRICS_PROFILE_DIR', 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+    route = (metrics.route or 'unmatched').replace(os.sep, '_')
+    path = os.path.join(directory, f"{stamp}-{route}-{elapsed * 1000:.0f}ms.folded")
+    with open(path, 'w') as output:
+        for stack, count in samples.most_common():
+            output.write(f"{stack} {count}\n")
+    logger.info("%s %s took %.0f ms; %d samples written to %s",
+                metrics.method, route, elapsed * 1000, sum(samples.values()), path)
+    return path
@@ -0,0 +1,83 @@
+"""
+What a request spent its time on: database queries, serialization,
+storage I/O and waiting in the transfer queue or for bandwidth.
+
+The middleware puts a RequestMetrics into a context variable for the
+duration of the request (and of a streamed body). Code doing the work adds
+to it through timed() and add_storage_bytes(); queries are counted by a
+wrapper installed on every database connection. Context variables follow
+the request into sync_to_async and async_to_sync threads, so work done on
+executor threads is counted too. Outside a request all of this is a no-op.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, method):
+        self.method = method
+        self.route = None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = {'db': 0.0, 'serialize': 0.0, 'storage': 0.0, 'queue': 0.0}
+        self.storage_bytes = 0
+        # Threads that did work for this request, for the sampling profiler.
+        self.threads = {threading.get_ident()}
+        self._active = set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def bind(metrics):
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(kind):
+    """Add the time spent in the block to `kind` ('serialize', 'storage' or 'queue'). Nested blocks count once."""
+    metrics = _current.get()
+    if metrics is None or kind in metrics._active:
+        yield
+        return
+    metrics._active.add(kind)
+    metrics.threads.add(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.seconds[kind] += time.perf_counter() - started
+        metrics._active.discard(kind)
+
+
+def add_storage_bytes(count):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.storage_bytes += count
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    metrics.threads.add(threading.get_ident())
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.seconds['db'] += time.perf_counter() - started
@@ -0,0 +1,137 @@
+"""
+Per-route Prometheus histograms, rendered in the text exposition format.
+
+Everything is kept in memory per process: with several uvicorn workers each
+one exports its own numbers and Prometheus sums them across instances.
+"""
+import threading
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+BYTE_BUCKETS = (0, 1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3)
+
+LABELS = ('route', 'method')
+
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _le(bound):
+    return 'le="' + _number(bound) + '"'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=LABELS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, values, amount):
+        with _lock:
+            series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    series[0][index] += 1
+            series[1] += amount
+            series[2] += 1
+
+    def samples(self):
+        for values, (counts, total, count) in sorted(self.series.items()):
+            for bound, bucket in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{_labels(self.labels, values, _le(bound))} {bucket}"
+            yield f"{self.name}_bucket{_labels(self.labels, values, _le('+Inf'))} {count}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {count}"
+
+    def clear(self):
+        self.series = {}
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=LABELS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values, amount=1):
+        with _lock:
+            self.series[values] = self.series.get(values, 0) + amount
+
+    def samples(self):
+        for values, total in sorted(self.series.items()):
+            yield f"{self.name}{_labels(self.labels, values)} {_number(total)}"
+
+    def clear(self):
+        self.series = {}
+
+
+requests_total = Counter(
+    'http_requests_total', "Requests by route, method and status code.", labels=('route', 'method', 'status'),
+)
+duration = Histogram('http_request_duration_seconds', "Time until the response was complete.", DURATION_BUCKETS)
+db_queries = Histogram('http_request_db_queries', "Database queries per request.", QUERY_BUCKETS)
+db_seconds = Histogram('http_request_db_seconds', "Time spent in database queries.", DURATION_BUCKETS)
+serialize_seconds = Histogram(
+    'http_request_serialize_seconds', "Time spent building and rendering response data.", DURATION_BUCKETS,
+)
+storage_seconds = Histogram('http_request_storage_seconds', "Time spent reading and writing storage.", DURATION_BUCKETS)
+storage_bytes = Histogram('http_request_storage_bytes', "Bytes read from and written to storage.", BYTE_BUCKETS)
+queue_seconds = Histogram(
+    'http_request_queue_seconds', "Time spent waiting for a transfer slot or for bandwidth.", DURATION_BUCKETS,
+)
+
+METRICS = (
+    requests_total, duration, db_queries, db_seconds, serialize_seconds, storage_seconds, storage_bytes, queue_seconds,
+)
+
+
+def observe(metrics, status):
+    values = (metrics.route or 'unmatched', metrics.method)
+    requests_total.inc((*values, str(status)))
+    duration.observe(values, metrics.elapsed())
+    db_queries.observe(values, metrics.queries)
+    db_seconds.observe(values, metrics.seconds['db'])
+    serialize_seconds.observe(values, metrics.seconds['serialize'])
+    storage_seconds.observe(values, metrics.seconds['storage'])
+    storage_bytes.observe(values, metrics.storage_bytes)
+    queue_seconds.observe(values, metrics.seconds['queue'])
+
+
+def render():
+    lines = []
+    with _lock:
+        for metric in METRICS:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    with _lock:
+        for metric in METRICS:
+            metric.clear()
@@ -0,0 +1,13 @@
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from api.metrics import recorder
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    # Connections are per thread, and the ORM of async views runs on
+    # executor threads, so every connection gets the wrapper; it finds the
+    # request through the context, which those threads inherit.
+    if recorder.execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(recorder.execute_wrapper)
@@ -0,0 +1,16 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from api.metrics import registry
+
+
+def metrics(request):
+    """Prometheus scrape endpoint. With METRICS_TOKEN set, scrapers must send it as a bearer token."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,40 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from api.replicas import routing
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+def _writer(request):
+    # DRF authenticates in the view, and sets the user on the request there.
+    if request.method in SAFE_METHODS or not routing.replicas():
+        return None
+    return routing.request_user_id(request)
+
+
+class StickyPrimaryMiddleware:
+    """
+    Sends a user's reads to the primary for a while after any request of
+    theirs that may have written, so they never read from a replica that has
+    not caught up with their own changes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        routing.stick_to_primary([_writer(request)])
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        await routing.astick_to_primary([_writer(request)])
+        return response
@@ -0,0 +1,181 @@
+"""
+Read replicas.
+
+Replicas are extra DATABASES whose aliases are listed in DATABASE_REPLICAS.
+Writes always go to the primary ('default'), and so do reads unless a view
+opts in with `replica_reads`: for the duration of the view its reads go to
+a replica, except
+
+- for a user who wrote in the last DATABASE_REPLICA_STICKY_SECONDS, so they
+  always read their own writes. Writes are remembered in the cache, by
+  StickyPrimaryMiddleware for the user's own requests and by listing
+  invalidation for changes made on their behalf (trash purges, workers);
+- when every replica is more than DATABASE_REPLICA_MAX_LAG_SECONDS behind
+  the primary or cannot be reached.
+
+Each process measures replica lag at most every
+DATABASE_REPLICA_LAG_CHECK_SECONDS and picks among the replicas under the
+limit at random.
+"""
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+_reads = ContextVar('replica_reads', default=None)
+
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    ),
+}
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _sticky_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 10)
+
+
+def _max_lag():
+    return getattr(settings, 'DATABASE_REPLICA_MAX_LAG_SECONDS', 5)
+
+
+def _check_interval():
+    return getattr(settings, 'DATABASE_REPLICA_LAG_CHECK_SECONDS', 5)
+
+
+def _sticky_key(user_id):
+    return f"replicas:primary:{user_id}"
+
+
+def _sticky_keys(user_ids):
+    if not replicas() or not _sticky_seconds():
+        return {}
+    return {_sticky_key(user_id): 1 for user_id in user_ids if user_id}
+
+
+def stick_to_primary(user_ids):
+    """Send the reads of these users to the primary for the sticky window."""
+    keys = _sticky_keys(user_ids)
+    if keys:
+        cache.set_many(keys, _sticky_seconds())
+
+
+async def astick_to_primary(user_ids):
+    keys = _sticky_keys(user_ids)
+    if keys:
+        await cache.aset_many(keys, _sticky_seconds())
+
+
+def measure_lag(alias):
+    """Seconds the replica is behind the primary, or None when it cannot be reached."""
+    connection = connections[alias]
+    query = LAG_QUERIES.get(connection.vendor)
+    try:
+        if query is None:
+            connection.ensure_connection()
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            return float(cursor.fetchone()[0] or 0)
+    except DatabaseError:
+        return None
+
+
+class LagMonitor:
+    """The replicas' lag as last measured by this process."""
+
+    def __init__(self):
+        self.lags = {}
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def stale(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= _check_interval()
+
+    def refresh(self):
+        with self._lock:
+            if self.stale():
+                self.lags = {alias: measure_lag(alias) for alias in replicas()}
+                self.checked_at = time.monotonic()
+
+    def usable(self):
+        limit = _max_lag()
+        return [alias for alias, lag in self.lags.items() if lag is not None and lag <= limit]
+
+    def reset(self):
+        self.lags, self.checked_at = {}, None
+
+
+monitor = LagMonitor()
+
+
+def _pick():
+    usable = [alias for alias in monitor.usable() if alias in replicas()]
+    return random.choice(usable) if usable else DEFAULT_DB_ALIAS
+
+
+def choose(user_id):
+    """The database a read-only view for `user_id` reads from."""
+    if not replicas() or (user_id and cache.get(_sticky_key(user_id))):
+        return DEFAULT_DB_ALIAS
+    monitor.refresh()
+    return _pick()
+
+
+async def achoose(user_id):
+    if not replicas() or (user_id and await cache.aget(_sticky_key(user_id))):
+        return DEFAULT_DB_ALIAS
+    if monitor.stale():
+        await sync_to_async(monitor.refresh, thread_sensitive=False)()
+    return _pick()
+
+
+@contextmanager
+def reading_from(alias):
+    token = _reads.set(alias)
+    try:
+        yield alias
+    finally:
+        _reads.reset(token)
+
+
+def request_user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def replica_reads(view):
+    """Decorate a read-only view method so its reads may go to a replica."""
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        with reading_from(choose(request_user_id(request))):
+            return view(self, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _reads.get()
+
+    def db_for_write(self, model, **hints):
+        # Never the database an instance was read from: that may be a replica.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
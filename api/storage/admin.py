@@ -1,5 +1,10 @@
 from django.contrib import admin
 
-from api.storage.models import File, Folder
+from api.storage.models import Blob, Change, Derivative, File, Folder, TrashEntry, UploadSession
+admin.site.register(Blob)
+admin.site.register(Change)
+admin.site.register(Derivative)
 admin.site.register(File)
-admin.site.register(Folder)
\ No newline at end of file
+admin.site.register(Folder)
+admin.site.register(UploadSession)
+admin.site.register(TrashEntry)
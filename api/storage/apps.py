@@ -7,5 +7,4 @@ class StorageConfig(AppConfig):
 
     def ready(self):
         # Import your signal handlers or other initialization code here.
-        # import api.storage.signals
-        pass
+        import api.storage.signals  # noqa: F401
@@ -0,0 +1,117 @@
+"""
+Streaming ZIP archives of folder trees.
+
+zipfile writes into a small in-memory sink that refuses to seek, so it
+emits data descriptors instead of going back to patch headers. Whatever it
+has written is handed to the client after every block, which keeps memory
+flat and puts the first bytes on the wire as soon as the first block of the
+first file is read. Nothing touches the local disk.
+"""
+import io
+import zipfile
+
+from django.utils import timezone
+
+from api.storage import downloads, tree
+
+
+COMPRESSION = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+}
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes the archive into."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _clean(name):
+    return name.replace('/', '_').replace('\\', '_') or '_'
+
+
+def _unique(name, taken):
+    if name not in taken:
+        taken.add(name)
+        return name
+    stem, dot, suffix = name.rpartition('.')
+    if not stem:
+        stem, dot, suffix = name, '', ''
+    counter = 2
+    while True:
+        candidate = f"{stem} ({counter}){dot}{suffix}"
+        if candidate not in taken:
+            taken.add(candidate)
+            return candidate
+        counter += 1
+
+
+def folder_entries(folder):
+    """
+    Yield `(archive path, File or None)` for `folder`'s subtree: a directory
+    entry for every folder, then every file below its folder's path.
+    """
+    taken = set()
+    paths = {folder.pk: _unique(_clean(folder.name), taken)}
+    yield paths[folder.pk] + '/', None
+    for subfolder in tree.subtree_folders(folder).only('pk', 'name', 'path', 'depth').iterator():
+        parent_path = paths.get(subfolder.ancestor_ids[-1])
+        if parent_path is None:
+            continue
+        paths[subfolder.pk] = _unique(f"{parent_path}/{_clean(subfolder.name)}", taken)
+        yield paths[subfolder.pk] + '/', None
+    for file in tree.subtree_files(folder).select_related('blob').iterator():
+        if file.folder_id in paths:
+            yield _unique(f"{paths[file.folder_id]}/{_clean(file.name)}", taken), file
+
+
+def _zip_info(name, modified, compression):
+    modified = max(timezone.localtime(modified).timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+    info = zipfile.ZipInfo(name, date_time=modified)
+    info.compress_type = compression
+    return info
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED, block_size=None):
+    """Yield the bytes of a ZIP holding `entries`, as produced by folder_entries()."""
+    return (data for data in _write_zip(entries, compression, block_size) if data)
+
+
+def _write_zip(entries, compression, block_size):
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, mode='w', compression=compression, allowZip64=True) as archive:
+        for name, file in entries:
+            if file is None:
+                archive.writestr(_zip_info(name, timezone.now(), zipfile.ZIP_STORED), b'')
+                yield sink.drain()
+                continue
+            size = downloads.content_size(file)
+            info = _zip_info(name, file.updated_at, compression)
+            info.file_size = size
+            # Sizes go into a data descriptor, so zipfile must know up front
+            # whether they may need 64 bits; deflate can grow data slightly.
+            with archive.open(info, mode='w', force_zip64=size * 101 // 100 >= zipfile.ZIP64_LIMIT) as target:
+                for data in downloads.iter_content(file, block_size=block_size):
+                    target.write(data)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
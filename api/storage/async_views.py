@@ -0,0 +1,147 @@
+"""
+Native async versions of the hot read and transfer endpoints.
+
+Under ASGI Django runs every sync view, and every sync iterator of a
+streaming response, through the sync-to-async bridge, and it holds a worker
+thread while it does. The views here answer GET folder and file details,
+file downloads and upload chunk PUTs without one. Each is mounted in front
+of the DRF route for the same URL: other methods, and every request that
+did not come in over ASGI (runserver, the test client), are handed to the
+DRF view unchanged.
+
+Details use the async ORM and the async cache API. Downloads look the file
+up on the shared executor instead: the async ORM runs on the request's own
+thread-sensitive executor, and that thread stays reserved until the
+response is fully sent, which for a slow client is the whole download.
+Content is then read block by block on the executor and sent from the event
+loop (see downloads.stream_body).
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+
+from api.replicas import routing
+from api.storage import downloads, listing_cache, rows, uploads, versions
+from api.storage.models import File, Folder, UploadSession
+from api.storage.pagination import KeysetPagination
+from api.storage.renderers import JSONRenderer
+from api.storage.serializers import FileSerializer, FolderSerializer
+from api.throttling import throttles, transfers
+from api.user.authentication import CachedJWTAuthentication
+
+
+authentication = CachedJWTAuthentication()
+
+
+def _json(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json', headers=headers)
+
+
+def _error(exc):
+    headers = None
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers = {'WWW-Authenticate': 'Bearer realm="api"'}
+    if getattr(exc, 'wait', None):
+        headers = {'Retry-After': str(exc.wait)}
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _json(detail, status=exc.status_code, headers=headers)
+
+
+def hybrid(handlers, fallback, scope=throttles.DEFAULT_SCOPE):
+    """
+    A view answering the methods in `handlers` natively under ASGI, as
+    `await handler(request, user, **kwargs)`, and anything else through the
+    sync DRF view `fallback`. Native requests draw from the `scope` bucket,
+    like the DRF action they stand in for.
+    """
+    async def view(request, **kwargs):
+        handler = handlers.get(request.method)
+        if handler is None or not downloads.is_asgi(request):
+            return await sync_to_async(fallback)(request, **kwargs)
+        try:
+            result = await authentication.aauthenticate(request)
+            if result is None:
+                raise exceptions.NotAuthenticated()
+            request.user = result[0]
+            await throttles.athrottle(request.user, scope)
+            return await handler(request, request.user, **kwargs)
+        except exceptions.APIException as exc:
+            return _error(exc)
+        except (Http404, ObjectDoesNotExist):
+            return _error(exceptions.NotFound())
+    return csrf_exempt(view)
+
+
+def off_request_thread(func):
+    """sync_to_async on the shared executor, with the connection handling of a request around it."""
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+async def folder_detail(request, user, uuid):
+    folder_uuid = user.root_folder_uuid if uuid == 'default' else uuid
+    layout = rows.get_layout(request)
+
+    async def build():
+        with routing.reading_from(await routing.achoose(user.pk)):
+            folder = await Folder.objects.select_related('parent').aget(owner=user, uuid=folder_uuid)
+            serializer = FolderSerializer(folder, context={'request': request, 'layout': layout})
+            paginator = KeysetPagination()
+            subfolders, subfolders_next = await paginator.apaginate(serializer.subfolder_rows(folder), 'name', paginator.page_size)
+            files, files_next = await paginator.apaginate(serializer.file_rows(folder), 'name', paginator.page_size)
+            serializer.prime_listing(folder, serializer.listing(
+                subfolders, subfolders_next, await folder.subfolders.acount(),
+                files, files_next, await folder.files.acount(),
+            ))
+            return serializer.data
+
+    return await listing_cache.acached_response(
+        request, f"folder:{folder_uuid}", await listing_cache.afolder_version(folder_uuid), build,
+    )
+
+
+async def file_detail(request, user, uuid):
+    with routing.reading_from(await routing.achoose(user.pk)):
+        file = await File.objects.aget(owner=user, uuid=uuid)
+    return _json(FileSerializer(file, context={'request': request}).data)
+
+
+@off_request_thread
+def _downloadable(user, uuid, number=None):
+    file = File.objects.select_related('blob').get(owner=user, uuid=uuid)
+    return file if number is None else versions.as_of(file, number)
+
+
+async def file_download(request, user, uuid):
+    number = request.GET.get('version')
+    if number is not None and not number.isdigit():
+        raise exceptions.ValidationError({'version': ["Expected a version number."]})
+    file = await _downloadable(user, uuid, None if number is None else int(number))
+    if not downloads.has_content(file):
+        raise Http404("File has no content.")
+    as_attachment = request.GET.get('inline') not in ('1', 'true')
+    transfer = transfers.Transfer(user, 'download')
+    return await transfer.aadmit(request, downloads.build_download_response(
+        request, file, as_attachment=as_attachment, transfer=transfer,
+    ))
+
+
+async def upload_chunk(request, user, uuid, index):
+    # ASGI has already spooled the body by the time the view runs, so a slow
+    # uploader never holds a thread; only writing the chunk out does. That is
+    # also why the body is paced as a whole, on the event loop, before it is.
+    session = await UploadSession.objects.aget(owner=user, uuid=uuid)
+    transfer = transfers.Transfer(user, 'upload')
+    size = transfers.content_length(request)
+    async with transfer.aslot(size):
+        await transfer.apace(size)
+        chunk = await sync_to_async(uploads.write_chunk)(session, int(index), request)
+    return _json({'index': chunk.index, 'size': chunk.size})
@@ -0,0 +1,49 @@
+"""
+Storage backends. Each one reports the bytes it reads and writes, and the
+time that takes, to the request metrics (api.metrics).
+"""
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage as DjangoFileSystemStorage
+
+from api.metrics import recorder
+from api.storage.gcs import GoogleCloudStorage as BaseGoogleCloudStorage
+from api.storage.sharded import ShardedFileSystemStorage as BaseShardedFileSystemStorage
+
+
+class MeteredFile(File):
+    def read(self, *args):
+        with recorder.timed('storage'):
+            data = self.file.read(*args)
+        recorder.add_storage_bytes(len(data))
+        return data
+
+
+class MeteredStorageMixin:
+    def _open(self, name, mode='rb'):
+        with recorder.timed('storage'):
+            opened = super()._open(name, mode)
+        return MeteredFile(opened.file, opened.name)
+
+    def _save(self, name, content):
+        with recorder.timed('storage'):
+            name = super()._save(name, content)
+        if recorder.current() is not None:
+            try:
+                size = content.size
+            except AttributeError:
+                # Streams of unknown length, such as upload chunks read off the request.
+                size = self.size(name)
+            recorder.add_storage_bytes(size)
+        return name
+
+
+class FileSystemStorage(MeteredStorageMixin, DjangoFileSystemStorage):
+    pass
+
+
+class ShardedFileSystemStorage(MeteredStorageMixin, BaseShardedFileSystemStorage):
+    pass
+
+
+class GoogleCloudStorage(MeteredStorageMixin, BaseGoogleCloudStorage):
+    pass
@@ -0,0 +1,204 @@
+"""
+Batch move, copy and delete of many files and folders per request.
+
+Ownership of the requested items is checked with one query per model and
+each batch runs in a single transaction. Files are moved and copied with
+set-based SQL while the per-object signal handlers are muted; blob
+references, rollups and listing caches are then updated in aggregate.
+Copies share the original blobs, so no file content is read or written.
+Deleting moves the items to the trash (see api.storage.trash).
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.storage import blobs, journal, listing_cache, rollups, signals, trash, tree
+from api.storage.models import Change, File, Folder
+
+
+OK = 'ok'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+class Results:
+    """Per-item outcomes, reported in request order. Items never touched are not found."""
+
+    def __init__(self, file_uuids, folder_uuids):
+        self.order = list(dict.fromkeys(
+            [('file', item_uuid) for item_uuid in file_uuids] + [('folder', item_uuid) for item_uuid in folder_uuids]
+        ))
+        self.outcomes = {}
+
+    def set(self, kind, item_uuid, status=OK, **extra):
+        self.outcomes[(kind, item_uuid)] = {'status': status, **extra}
+
+    def as_list(self):
+        return [
+            {'type': kind, 'uuid': str(item_uuid), **self.outcomes.get((kind, item_uuid), {'status': NOT_FOUND})}
+            for kind, item_uuid in self.order
+        ]
+
+
+def _owned(model, user, uuids):
+    if not uuids:
+        return {}
+    return {obj.uuid: obj for obj in model.objects.filter(owner=user, uuid__in=uuids)}
+
+
+def _folder_rows(folder_ids):
+    """`{pk: (uuid, path)}` for the given folders, in one query."""
+    folder_ids = {pk for pk in folder_ids if pk}
+    if not folder_ids:
+        return {}
+    return {pk: (folder_uuid, path) for pk, folder_uuid, path in
+            Folder.objects.filter(pk__in=folder_ids).values_list('pk', 'uuid', 'path')}
+
+
+def _lock(folder):
+    return Folder.objects.select_for_update().get(pk=folder.pk)
+
+
+def move(user, file_uuids, folder_uuids, target):
+    results = Results(file_uuids, folder_uuids)
+    with transaction.atomic():
+        target = _lock(target)
+        files = _owned(File, user, file_uuids)
+        folders = _owned(Folder, user, folder_uuids)
+
+        # Folders first: moving one may change the target's own path.
+        for folder in sorted(folders.values(), key=lambda folder: folder.depth):
+            if folder.parent_id is None:
+                results.set('folder', folder.uuid, INVALID, detail="The root folder cannot be moved.")
+                continue
+            if folder.parent_id != target.uuid:
+                folder.parent = target
+                try:
+                    folder.save()
+                except ValueError as exc:
+                    results.set('folder', folder.uuid, INVALID, detail=str(exc))
+                    continue
+            results.set('folder', folder.uuid)
+
+        target.refresh_from_db(fields=['path', 'depth'])
+        with signals.muted():
+            _move_files(user, list(files.values()), target)
+        for file in files.values():
+            results.set('file', file.uuid)
+    return results.as_list()
+
+
+def _move_files(user, files, target):
+    moving = [file for file in files if file.folder_id != target.pk]
+    if not moving:
+        return
+    sources = _folder_rows(file.folder_id for file in moving)
+    deltas = rollups.new_deltas()
+    for file in moving:
+        if file.folder_id in sources:
+            rollups.add_to_chain(deltas, rollups.chain(sources[file.folder_id][1], file.folder_id), size=-file.size, files=-1)
+    rollups.add_to_chain(
+        deltas, rollups.chain(target.path, target.pk), size=sum(file.size for file in moving), files=len(moving)
+    )
+    File.objects.filter(pk__in=[file.pk for file in moving]).update(folder=target, updated_at=timezone.now())
+    rollups.apply_deltas(deltas)
+    journal.record_files(moving, Change.ACTION_MOVED, parent_uuid=target.uuid)
+    listing_cache.invalidate([target.uuid, *(folder_uuid for folder_uuid, path in sources.values())], [user.pk])
+
+
+def _clone_file(file, folder):
+    return File(name=file.name, file=file.file.name, blob_id=file.blob_id, size=file.size, folder=folder, owner_id=file.owner_id)
+
+
+def _copy_folder(source, target):
+    """Copy `source` and everything below it into `target`, one INSERT per tree level."""
+    subtree = [source, *tree.subtree_folders(source)]
+    files = list(tree.subtree_files(source))
+    levels = defaultdict(list)
+    for folder in subtree:
+        levels[folder.depth].append(folder)
+
+    clones = {}
+    for depth in sorted(levels):
+        level = []
+        for folder in levels[depth]:
+            parent = target if folder.pk == source.pk else clones[folder.ancestor_ids[-1]]
+            clone = Folder(
+                name=folder.name, owner_id=folder.owner_id, parent_id=parent.uuid,
+                path=parent.subtree_prefix, depth=parent.depth + 1,
+                total_bytes=folder.total_bytes, file_count=folder.file_count, folder_count=folder.folder_count,
+            )
+            clones[folder.pk] = clone
+            level.append(clone)
+        Folder.objects.bulk_create(level)
+    file_clones = [_clone_file(file, clones[file.folder_id]) for file in files]
+    File.objects.bulk_create(file_clones, batch_size=1000)
+    journal.record(
+        [journal.folder_change(clones[folder.pk], Change.ACTION_CREATED) for depth in sorted(levels) for folder in levels[depth]]
+        + [journal.file_change(clone, Change.ACTION_CREATED, clone.folder.uuid) for clone in file_clones]
+    )
+    return clones[source.pk], files, len(subtree)
+
+
+def copy(user, file_uuids, folder_uuids, target):
+    results = Results(file_uuids, folder_uuids)
+    with transaction.atomic(), signals.muted():
+        target = _lock(target)
+        files = _owned(File, user, file_uuids)
+        folders = {}
+        for folder in _owned(Folder, user, folder_uuids).values():
+            if target.is_in_subtree_of(folder):
+                results.set('folder', folder.uuid, INVALID,
+                            detail="A folder cannot be copied into itself or one of its subfolders.")
+            else:
+                folders[folder.uuid] = folder
+        rollups.check_quota(
+            user.pk, sum(file.size for file in files.values()) + sum(folder.total_bytes for folder in folders.values())
+        )
+
+        copied = []
+        clones = [_clone_file(file, target) for file in files.values()]
+        File.objects.bulk_create(clones, batch_size=1000)
+        journal.record_files(clones, Change.ACTION_CREATED, parent_uuid=target.uuid)
+        for file, clone in zip(files.values(), clones):
+            results.set('file', file.uuid, copy=str(clone.uuid))
+        copied += files.values()
+
+        folder_count = 0
+        for folder in folders.values():
+            clone, subtree_files, subtree_size = _copy_folder(folder, target)
+            results.set('folder', folder.uuid, copy=str(clone.uuid))
+            copied += subtree_files
+            folder_count += subtree_size
+
+        blobs.add_references(Counter(file.blob_id for file in copied))
+        rollups.apply(
+            rollups.chain(target.path, target.pk), user.pk,
+            size=sum(file.size for file in copied), files=len(copied), folders=folder_count,
+        )
+        listing_cache.invalidate([target.uuid], [user.pk])
+    return results.as_list()
+
+
+def delete(user, file_uuids, folder_uuids):
+    """Move the items to the trash, reporting the trash entry each one ended up in."""
+    results = Results(file_uuids, folder_uuids)
+    with transaction.atomic():
+        files = _owned(File, user, file_uuids)
+        for entry in trash.trash_files(list(files.values())):
+            results.set('file', entry.item_uuid, trash=str(entry.uuid))
+
+        folders = _owned(Folder, user, folder_uuids)
+        entries = {}
+        for folder in sorted(folders.values(), key=lambda folder: folder.depth):
+            if folder.parent_id is None:
+                results.set('folder', folder.uuid, INVALID, detail="The root folder cannot be deleted.")
+                continue
+            # Folders below another selected folder go to the trash with it.
+            entry = next((entries[pk] for pk in folder.ancestor_ids if pk in entries), None)
+            if entry is None:
+                entry = trash.trash_folder(folder)
+            entries[folder.pk] = entry
+            results.set('folder', folder.uuid, trash=str(entry.uuid))
+    return results.as_list()
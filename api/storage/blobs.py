@@ -0,0 +1,245 @@
+import bisect
+import hashlib
+
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+
+from api.storage import compression
+from api.storage.models import Blob, BlobChunk, File, FileVersion
+
+
+# What open_stored() needs to know about a chunk's blob.
+STORED_FIELDS = ('file', 'size', 'codec', 'frame_size', 'frames', 'stored_size')
+
+
+def blob_name(sha256):
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def get_storage():
+    return Blob._meta.get_field('file').storage
+
+
+def hash_content(content):
+    digest = hashlib.sha256()
+    size = 0
+    for data in content.chunks():
+        digest.update(data)
+        size += len(data)
+    return digest.hexdigest(), size
+
+
+def referenced_by(user):
+    """Blobs that the user's files, trashed ones included, or their versions hold a reference on."""
+    return Blob.objects.filter(
+        Exists(File.all_objects.filter(owner=user, blob=OuterRef('pk')))
+        | Exists(FileVersion.objects.filter(file__owner=user, blob=OuterRef('pk')))
+    )
+
+
+def find_blob(sha256, size=None, owner=None):
+    """
+    The stored blob with this hash, and size when given. With `owner`, only
+    one the owner already references: matching a hash alone proves nothing
+    about having the content, so no one gets another user's that way.
+    """
+    queryset = Blob.objects if owner is None else referenced_by(owner)
+    blob = queryset.filter(sha256=sha256.lower(), chunked=False).first()
+    if blob is None or (size is not None and blob.size != size):
+        return None
+    return blob
+
+
+def store_content(content, sha256=None, size=None):
+    """
+    Return the Blob holding `content`, writing it to storage only when no
+    blob with the same SHA-256 exists yet. `content` must be re-iterable via
+    `chunks()`; it is read once to hash it and once more to store it.
+    Compressible content is stored compressed (api.storage.compression).
+    """
+    if sha256 is None or size is None:
+        sha256, size = hash_content(content)
+    blob = find_blob(sha256)
+    if blob is not None:
+        return blob
+
+    storage = get_storage()
+    fields = {}
+    if compression.choose(content, size):
+        framed = compression.FramedGzip(content)
+        name = storage.save(blob_name(sha256), framed)
+        if framed.stored_size < size:
+            fields = {
+                'codec': compression.GZIP, 'stored_size': framed.stored_size,
+                'frame_size': framed.frame_size, 'frames': framed.offsets,
+            }
+        else:
+            # The sample promised more than the content delivered.
+            storage.delete(name)
+    if not fields:
+        name = storage.save(blob_name(sha256), content)
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=sha256, size=size, file=name, **fields)
+    except IntegrityError:
+        # Someone stored the same content concurrently; keep theirs.
+        storage.delete(name)
+        return Blob.objects.get(sha256=sha256)
+
+
+def attach(file, blob):
+    file.blob = blob
+    file.size = blob.size
+    file.file.name = blob.file.name
+    return file
+
+
+class ChunkedFile:
+    """
+    The content of a chunked blob, read from its chunks' objects in turn.
+    Seeking only moves the position, so a range opens the chunks it covers.
+    """
+
+    def __init__(self, blob):
+        self.size = blob.size
+        self.chunks = list(blob.chunks.values_list('offset', *(f'chunk__{field}' for field in STORED_FIELDS)))
+        self.offsets = [offset for offset, *_ in self.chunks]
+        self.position = 0
+        self._index = None
+        self._handle = None
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def _open(self, index):
+        if self._index != index:
+            self.close()
+            self._handle = open_stored(*self.chunks[index][1:])
+            self._index = index
+        return self._handle
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        parts = []
+        while size > 0 and self.position < self.size:
+            index = bisect.bisect_right(self.offsets, self.position) - 1
+            offset, _, length, *_ = self.chunks[index]
+            handle = self._open(index)
+            handle.seek(self.position - offset)
+            data = handle.read(min(size, offset + length - self.position))
+            if not data:
+                break
+            parts.append(data)
+            self.position += len(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+        self._handle = self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_stored(name, size, codec, frame_size, frames, stored_size):
+    """A readable, seekable file of the content of a stored object, decompressed when it is compressed."""
+    handle = get_storage().open(name, 'rb')
+    if codec:
+        return compression.FramedFile(handle, size, frame_size, frames, stored_size)
+    return handle
+
+
+def open_blob(blob):
+    """A readable, seekable file of the blob's content."""
+    if blob.chunked:
+        return ChunkedFile(blob)
+    return open_stored(blob.file.name, blob.size, blob.codec, blob.frame_size, blob.frames, blob.stored_size)
+
+
+def add_reference(blob_id, count=1):
+    Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + count)
+
+
+def release_reference(blob_id, count=1):
+    Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - count)
+    transaction.on_commit(lambda: collect(blob_id))
+
+
+def delete_objects(names):
+    """Delete stored objects, in batches where the storage supports them (GCS)."""
+    storage = get_storage()
+    delete_many = getattr(storage, 'delete_many', None)
+    if delete_many is not None:
+        delete_many(names)
+        return
+    for name in names:
+        storage.delete(name)
+
+
+def _reclaim(blob_id):
+    """Delete an unreferenced blob and its derivatives; returns the names of their stored objects."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count__lte=0).first()
+        if blob is None or File.all_objects.filter(blob=blob).exists() or blob.versions.exists():
+            return None
+        if BlobChunk.objects.filter(chunk=blob).exists():
+            return None
+        if blob.chunked:
+            release_references(Counter(blob.chunks.values_list('chunk_id', flat=True)))
+        names = [blob.file.name, *blob.derivatives.values_list('file', flat=True)]
+        names = [name for name in names if name]
+        blob.delete()
+    return names
+
+
+def collect(blob_id):
+    """Delete a blob, its derivatives and their stored objects once nothing references it."""
+    with transaction.atomic():
+        names = _reclaim(blob_id)
+        if names is None:
+            return False
+        transaction.on_commit(lambda: delete_objects(names))
+    return True
+
+
+def _by_count(counts):
+    groups = defaultdict(list)
+    for blob_id, count in counts.items():
+        if blob_id:
+            groups[count].append(blob_id)
+    return groups.items()
+
+
+def add_references(counts):
+    """Add `{blob_id: count}` references with one UPDATE per distinct count."""
+    for count, blob_ids in _by_count(counts):
+        Blob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') + count)
+
+
+def release_references(counts):
+    for count, blob_ids in _by_count(counts):
+        Blob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') - count)
+    blob_ids = [blob_id for blob_id in counts if blob_id]
+
+    def collect_all():
+        names = [name for blob_id in blob_ids for name in _reclaim(blob_id) or []]
+        if names:
+            transaction.on_commit(lambda: delete_objects(names))
+
+    transaction.on_commit(collect_all)
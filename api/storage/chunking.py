@@ -0,0 +1,83 @@
+"""
+Content-defined chunking for versioned uploads.
+
+Clients cut a file into chunks where a gear rolling hash of the bytes hits
+a boundary, so an edit only changes the chunks around it and every other
+chunk keeps its SHA-256, whatever shifted. Server and clients must cut the
+same way; the parameters are published in the version diff response:
+
+- table[b] is the first 8 bytes, big-endian, of SHA-256(b"gear" + bytes([b]));
+- a chunk starting at `start` hashes bytes from start + min_size on with
+  h = ((h << 1) + table[byte]) mod 2**64, starting from h = 0;
+- it ends after the first byte where the top `mask_bits` bits of h are all
+  zero, after max_size bytes, or at the end of the file.
+
+mask_bits = log2(avg_size - min_size), so chunks average about avg_size.
+This module is the reference implementation; it is pure Python, fine for
+tests and tools but slow for large files.
+"""
+import hashlib
+
+
+MIN_SIZE = 256 * 1024
+AVG_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+TABLE = tuple(int.from_bytes(hashlib.sha256(b'gear' + bytes([value])).digest()[:8], 'big') for value in range(256))
+MASK64 = (1 << 64) - 1
+
+
+class Params:
+    def __init__(self, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+        if not 0 < min_size < avg_size < max_size:
+            raise ValueError("Chunk sizes must satisfy 0 < min_size < avg_size < max_size.")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self.mask_bits = max(1, (avg_size - min_size).bit_length() - 1)
+        self.mask = ((1 << self.mask_bits) - 1) << (64 - self.mask_bits)
+
+    def describe(self):
+        return {
+            'algorithm': 'gear', 'min_size': self.min_size, 'avg_size': self.avg_size,
+            'max_size': self.max_size, 'mask_bits': self.mask_bits,
+        }
+
+
+def cut(data, params):
+    """The length of the first chunk of `data`; all of it when no boundary is found."""
+    end = min(len(data), params.max_size)
+    if end <= params.min_size:
+        return end
+    h, mask, table = 0, params.mask, TABLE
+    for position in range(params.min_size, end):
+        h = ((h << 1) + table[data[position]]) & MASK64
+        if not h & mask:
+            return position + 1
+    return end
+
+
+def split(stream, params=None, read_size=None):
+    """Yield the chunks of a binary stream as bytes."""
+    params = params or Params()
+    read_size = read_size or params.max_size
+    buffer = b''
+    eof = False
+    while True:
+        while not eof and len(buffer) < params.max_size:
+            data = stream.read(read_size)
+            eof = not data
+            buffer += data
+        if not buffer:
+            return
+        length = cut(buffer, params)
+        yield buffer[:length]
+        buffer = buffer[length:]
+
+
+def manifest(stream, params=None):
+    """The [{'sha256', 'size'}] list a client sends for the version diff and commit."""
+    return [
+        {'sha256': hashlib.sha256(chunk).hexdigest(), 'size': len(chunk)}
+        for chunk in split(stream, params)
+    ]
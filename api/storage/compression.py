@@ -0,0 +1,203 @@
+"""
+At-rest compression of blob content.
+
+store_content() asks choose() whether new content is worth compressing. It
+is not when it is small, when its name or first bytes show a format that is
+compressed already (images, audio and video, archives, office documents),
+or when a sample of it carries more than COMPRESSION_MAX_ENTROPY bits of
+entropy per byte.
+
+Compressible content is stored as one gzip stream cut into frames of
+COMPRESSION_FRAME_SIZE bytes by full flushes. A full flush ends the deflate
+data on a byte boundary and drops the history, so every frame can be
+inflated on its own from its offset in the stored object. The blob keeps
+those offsets, and FramedFile serves reads, and ranges, by decoding only
+the frames they cover. The object as a whole stays a valid gzip body, which
+downloads pass through unchanged to clients accepting that encoding.
+"""
+import math
+import mimetypes
+import struct
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+
+
+GZIP = 'gzip'
+SAMPLE_SIZE = 64 * 1024
+# No name and no mtime: the same content always makes the same object.
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+TRAILER_SIZE = 8
+
+COMPRESSED_TYPES = {
+    'application/gzip', 'application/x-bzip2', 'application/x-xz', 'application/zip', 'application/zstd',
+    'application/x-7z-compressed', 'application/vnd.rar', 'application/x-rar-compressed',
+    'image/avif', 'image/gif', 'image/heic', 'image/jpeg', 'image/png', 'image/webp',
+}
+COMPRESSED_MAGIC = (
+    b'\x1f\x8b', b'PK\x03\x04', b'BZh', b'\xfd7zXZ\x00', b'7z\xbc\xaf', b'Rar!', b'\x28\xb5\x2f\xfd',
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'OggS', b'fLaC', b'ID3', b'%PDF',
+)
+
+
+def enabled():
+    return getattr(settings, 'COMPRESSION_ENABLED', True)
+
+
+def frame_size():
+    return getattr(settings, 'COMPRESSION_FRAME_SIZE', 256 * 1024)
+
+
+def _compressed_type(name):
+    guessed, encoding = mimetypes.guess_type(name)
+    if encoding is not None:
+        return True
+    return guessed is not None and (guessed in COMPRESSED_TYPES or guessed.startswith(('audio/', 'video/')))
+
+
+def _compressed_magic(sample):
+    # RIFF....WEBP/AVI and ISO media (....ftyp: MP4, MOV, HEIC, AVIF) carry their tag past the start.
+    return sample.startswith(COMPRESSED_MAGIC) or sample[8:12] == b'WEBP' or sample[4:8] == b'ftyp'
+
+
+def entropy(sample):
+    """Shannon entropy of `sample` in bits per byte: about 4-5 for text, 8 for compressed data."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+
+def _sample(content):
+    parts, size = [], 0
+    chunks = content.chunks()
+    try:
+        for data in chunks:
+            parts.append(data)
+            size += len(data)
+            if size >= SAMPLE_SIZE:
+                break
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    return b''.join(parts)[:SAMPLE_SIZE]
+
+
+def choose(content, size):
+    """The codec to store `content` with, or '' to store it as is."""
+    if not enabled() or size < getattr(settings, 'COMPRESSION_MIN_SIZE', 4096):
+        return ''
+    name = getattr(content, 'name', None)
+    if name and _compressed_type(name):
+        return ''
+    sample = _sample(content)
+    if _compressed_magic(sample) or entropy(sample) > getattr(settings, 'COMPRESSION_MAX_ENTROPY', 7.0):
+        return ''
+    return GZIP
+
+
+class FramedGzip(DjangoFile):
+    """
+    `content` as a framed gzip stream, for storage.save(). Once chunks() has
+    run, `offsets` holds where each frame starts and `stored_size` the
+    length of the whole object.
+    """
+
+    def __init__(self, content, size=None):
+        super().__init__(None, name=getattr(content, 'name', None))
+        self.content = content
+        self.frame_size = size or frame_size()
+        self.offsets = []
+        self.stored_size = 0
+
+    def _frames(self):
+        pending = bytearray()
+        for data in self.content.chunks():
+            pending += data
+            while len(pending) >= self.frame_size:
+                yield bytes(pending[:self.frame_size])
+                del pending[:self.frame_size]
+        if pending:
+            yield bytes(pending)
+
+    def chunks(self, chunk_size=None):
+        compressor = zlib.compressobj(getattr(settings, 'COMPRESSION_LEVEL', 6), zlib.DEFLATED, -zlib.MAX_WBITS)
+        offsets, position, crc, length = [], len(GZIP_HEADER), 0, 0
+        yield GZIP_HEADER
+        for frame in self._frames():
+            offsets.append(position)
+            data = compressor.compress(frame) + compressor.flush(zlib.Z_FULL_FLUSH)
+            crc = zlib.crc32(frame, crc)
+            length += len(frame)
+            position += len(data)
+            yield data
+        tail = compressor.flush(zlib.Z_FINISH) + struct.pack('<II', crc, length & 0xffffffff)
+        yield tail
+        self.offsets, self.stored_size = offsets, position + len(tail)
+
+    def close(self):
+        pass
+
+
+class FramedFile:
+    """
+    A readable, seekable file of the content of a framed gzip object. Reads
+    decode only the frames they cover; the last one decoded is kept for the
+    reads that follow.
+    """
+
+    def __init__(self, handle, size, frame_size, offsets, stored_size):
+        self.handle = handle
+        self.size = size
+        self.frame_size = frame_size
+        self.offsets = offsets
+        self.stored_size = stored_size
+        self.position = 0
+        self._index = None
+        self._frame = b''
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def _decode(self, index):
+        if self._index != index:
+            start = self.offsets[index]
+            end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.stored_size - TRAILER_SIZE
+            self.handle.seek(start)
+            self._frame = zlib.decompressobj(-zlib.MAX_WBITS).decompress(self.handle.read(end - start))
+            self._index = index
+        return self._frame
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        parts = []
+        while size > 0 and self.position < self.size:
+            index, start = divmod(self.position, self.frame_size)
+            data = self._decode(index)[start:start + size]
+            if not data:
+                break
+            parts.append(data)
+            self.position += len(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
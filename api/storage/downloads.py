@@ -0,0 +1,386 @@
+import hashlib
+import mimetypes
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_etags, parse_http_date_safe, quote_etag
+
+from api.metrics import recorder
+from api.storage import blobs
+
+
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def chunk_size():
+    return getattr(settings, 'DOWNLOAD_CHUNK_SIZE', 256 * 1024)
+
+
+def content_size(file):
+    if file.blob_id:
+        return file.blob.size
+    return file.file.size
+
+
+def stored_codec(file):
+    """The encoding the content is stored in ('' when stored as is)."""
+    return file.blob.codec if file.blob_id else ''
+
+
+def content_etag(file, encoding=''):
+    """Strong validator: the content hash, or a digest of the stored object's identity."""
+    if file.blob_id:
+        return quote_etag(f"{file.blob_id}-{encoding}" if encoding else file.blob_id)
+    raw = f"{file.uuid}:{file.file.name}:{content_size(file)}:{file.updated_at.isoformat()}"
+    return quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32])
+
+
+def content_type(file):
+    guessed, _ = mimetypes.guess_type(file.name)
+    return guessed or 'application/octet-stream'
+
+
+def has_content(file):
+    return bool(file.blob_id or file.file)
+
+
+def open_content(file):
+    if file.blob_id:
+        return blobs.open_blob(file.blob)
+    return file.file.storage.open(file.file.name, 'rb')
+
+
+def iter_content(file, start=0, end=None, block_size=None, encoded=False):
+    """Yield bytes [start, end] (inclusive) of a file's content, or with `encoded` of its stored object, in bounded blocks."""
+    block_size = block_size or chunk_size()
+    size = file.blob.stored_size if encoded else content_size(file)
+    end = size - 1 if end is None else end
+    remaining = end - start + 1
+    handle = blobs.get_storage().open(file.blob.file.name, 'rb') if encoded else open_content(file)
+    try:
+        if start:
+            handle.seek(start)
+        while remaining > 0:
+            data = handle.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        handle.close()
+
+
+class FileRange:
+    """
+    Bytes [start, end] of a local file for FileResponse. WSGI servers with a
+    sendfile() file wrapper (gunicorn, uWSGI) send Content-Length bytes from
+    the descriptor's offset without copying them through Python; others read().
+    """
+
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb', buffering=0)
+        self.file.seek(start)
+        self.remaining = end - start + 1
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def local_path(file):
+    """The stored object's path on this machine, or None when the storage has none (GCS) or it is chunked."""
+    if not file.file.name:
+        return None
+    try:
+        return file.file.storage.path(file.file.name)
+    except NotImplementedError:
+        return None
+
+
+def is_asgi(request):
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def aiterate(iterator, thread_sensitive=False):
+    """
+    Drive a blocking iterator from async code, one item per executor call.
+    No thread is held between items, so a slow client only holds a coroutine.
+    Iterators that use the database must pass thread_sensitive=True.
+    """
+    step = sync_to_async(next, thread_sensitive=thread_sensitive)
+    done = object()
+    try:
+        while (item := await step(iterator, done)) is not done:
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=thread_sensitive)()
+
+
+def stream_body(request, iterator, thread_sensitive=False, transfer=None):
+    """
+    The body for a StreamingHttpResponse. Under ASGI Django would collect a
+    plain iterator into a list before sending any of it; hand it an async
+    iterator instead. A `transfer` paces the body to the user's bandwidth.
+    """
+    if is_asgi(request):
+        body = aiterate(iter(iterator), thread_sensitive=thread_sensitive)
+        return body if transfer is None else transfer.aiterate(body)
+    return iterator if transfer is None else transfer.iterate(iterator)
+
+
+def parse_range_header(header, size):
+    """
+    Parse a `Range: bytes=...` header into a sorted list of inclusive
+    (start, end) pairs with overlapping ranges merged. Returns None when the
+    header should be ignored and raises RangeNotSatisfiable when no range fits.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        try:
+            if first == '':
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        if end is None:
+            end = size - 1
+        ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _last_modified(file):
+    return int(file.updated_at.timestamp())
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        # Weak comparison, as required for If-None-Match.
+        return '*' in etags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in etags]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def accepts_encoding(request, coding):
+    """Whether the request's Accept-Encoding allows `coding`, by name or through '*'."""
+    qualities = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        token, *params = part.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[token.strip().lower()] = quality
+    return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+
+def range_applies(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Strong comparison only: a weak validator never matches If-Range.
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def _set_validators(response, file, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if stored_codec(file):
+        # Whether the stored encoding is passed through depends on Accept-Encoding.
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def _set_common_headers(response, file, etag, last_modified, as_attachment=True):
+    _set_validators(response, file, etag, last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(as_attachment, file.name)
+    return response
+
+
+def _sendfile_response(file, mode, transfer=None):
+    response = HttpResponse(content_type=content_type(file))
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + file.file.name
+        if transfer is not None and transfer.shaped:
+            response['X-Accel-Limit-Rate'] = str(int(transfer.rate))
+    else:
+        response['X-Sendfile'] = file.file.storage.path(file.file.name)
+    return response
+
+
+def _signed_url_response(file, as_attachment):
+    """Redirect to a short-lived URL the storage serves the bytes and ranges from, if it has one."""
+    signed_url = getattr(file.file.storage, 'signed_url', None)
+    if signed_url is None:
+        return None
+    url = signed_url(
+        file.file.name,
+        response_type=content_type(file),
+        response_disposition=content_disposition_header(as_attachment, file.name),
+    )
+    return None if url is None else HttpResponseRedirect(url)
+
+
+def _multipart_body(file, ranges, size, boundary, ctype):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\nContent-Type: {ctype}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield from iter_content(file, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def _multipart_length(ranges, size, boundary, ctype):
+    length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(f"--{boundary}\r\nContent-Type: {ctype}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n")
+        length += end - start + 1 + 2
+    return length
+
+
+def _encoded_response(request, file, ctype, codec, transfer=None):
+    """The whole content as stored, compressed, for a client that accepts the encoding."""
+    head = request.method == 'HEAD'
+    size = file.blob.stored_size
+    shaped = transfer is not None and transfer.shaped
+    path = None if head or shaped or is_asgi(request) else local_path(file)
+    if path is not None:
+        response = FileResponse(FileRange(path, 0, size - 1), content_type=ctype)
+        response.block_size = chunk_size()
+        recorder.add_storage_bytes(size)
+    else:
+        body = stream_body(request, [] if head else iter_content(file, encoded=True), transfer=transfer)
+        response = StreamingHttpResponse(body, content_type=ctype)
+    response['Content-Length'] = str(size)
+    response['Content-Encoding'] = codec
+    return response
+
+
+def build_download_response(request, file, as_attachment=True, transfer=None):
+    codec = stored_codec(file)
+    # Ranges are of the decoded content, so only whole downloads go out encoded.
+    encoded = bool(codec) and 'HTTP_RANGE' not in request.META and accepts_encoding(request, codec)
+    etag = content_etag(file, codec if encoded else '')
+    last_modified = _last_modified(file)
+    size = content_size(file)
+    ctype = content_type(file)
+
+    if is_not_modified(request, etag, last_modified):
+        return _set_validators(HttpResponseNotModified(), file, etag, last_modified)
+
+    if encoded:
+        response = _encoded_response(request, file, ctype, codec, transfer)
+        return _set_common_headers(response, file, etag, last_modified, as_attachment)
+
+    # Chunked and compressed content have no stored object to hand off as is, so they are always streamed.
+    mode = getattr(settings, 'DOWNLOAD_SENDFILE_MODE', None) if file.file.name and not codec else None
+    if mode in ('x-accel-redirect', 'x-sendfile'):
+        return _set_common_headers(_sendfile_response(file, mode, transfer), file, etag, last_modified, as_attachment)
+    if mode == 'signed-url':
+        response = _signed_url_response(file, as_attachment)
+        if response is not None:
+            return _set_validators(response, file, etag, last_modified)
+
+    ranges = None
+    if range_applies(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _set_common_headers(response, file, etag, last_modified, as_attachment)
+
+    head = request.method == 'HEAD'
+    # sendfile() cannot be paced, so shaped downloads are streamed.
+    shaped = transfer is not None and transfer.shaped
+    path = None if head or shaped or codec or is_asgi(request) or (ranges and len(ranges) > 1) else local_path(file)
+    if path is not None:
+        start, end = ranges[0] if ranges else (0, size - 1)
+        response = FileResponse(FileRange(path, start, end), status=206 if ranges else 200, content_type=ctype)
+        response.block_size = chunk_size()
+        response['Content-Length'] = str(end - start + 1)
+        if ranges:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        # Counted up front: with sendfile() the bytes never pass through Python.
+        recorder.add_storage_bytes(end - start + 1)
+    elif not ranges:
+        body = stream_body(request, [] if head else iter_content(file), transfer=transfer)
+        response = StreamingHttpResponse(body, content_type=ctype)
+        response['Content-Length'] = str(size)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        body = stream_body(request, [] if head else iter_content(file, start, end), transfer=transfer)
+        response = StreamingHttpResponse(body, status=206, content_type=ctype)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = secrets.token_hex(16)
+        body = stream_body(request, [] if head else _multipart_body(file, ranges, size, boundary, ctype), transfer=transfer)
+        response = StreamingHttpResponse(
+            body, status=206, content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(_multipart_length(ranges, size, boundary, ctype))
+    return _set_common_headers(response, file, etag, last_modified, as_attachment)
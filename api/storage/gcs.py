@@ -0,0 +1,526 @@
+"""
+Google Cloud Storage over its JSON API, with nothing but the standard library.
+
+All requests of a process share one pool of keep-alive connections per
+endpoint, so uploads, ranged reads and metadata lookups skip the TCP and TLS
+handshakes, and at most GCS_POOL_SIZE of them are in flight at once. Requests
+answered with 408/429/5xx or a dropped connection are retried with
+exponential backoff.
+
+Objects larger than GCS_UPLOAD_PART_SIZE are uploaded as parallel composite
+uploads: parts go up on GCS_UPLOAD_WORKERS threads as temporary objects under
+`tmp/composite/`, are composed into the destination (32 sources per compose
+call, in several rounds when there are more) and then deleted. A process
+killed halfway leaves its parts behind, so give the bucket a lifecycle rule
+deleting `tmp/` objects after a day. Composite objects carry a CRC32C but no
+MD5 hash. Upload sessions are composed from their stored chunks without
+moving their bytes through Django at all (see uploads.SessionContent).
+
+Credentials: GCS_ACCESS_TOKEN if set, else the GCE/GKE metadata server for
+storage.googleapis.com, else none (fake-gcs-server). Signed URLs use V4
+signing with a service account HMAC key (GCS_HMAC_ACCESS_ID and
+GCS_HMAC_SECRET); without one, downloads are streamed through Django.
+"""
+import hashlib
+import hmac
+import http.client
+import itertools
+import json
+import mimetypes
+import random
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from urllib.parse import quote, urlencode, urlsplit
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+
+DEFAULT_ENDPOINT = 'https://storage.googleapis.com'
+METADATA_TOKEN_URL = 'http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/token'
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+COMPOSE_MAX_SOURCES = 32
+BATCH_MAX_CALLS = 100
+
+
+class GCSError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class NotFound(GCSError):
+    pass
+
+
+def _quote(value):
+    return quote(value, safe='-_.~')
+
+
+class ConnectionPool:
+    """Keep-alive connections to one host, at most `size` of them in use at a time."""
+
+    def __init__(self, endpoint, size=16, timeout=60):
+        parts = urlsplit(endpoint)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request on a pooled connection; returns (status, headers, body)."""
+        with self._slots:
+            while True:
+                connection, reused = self._checkout()
+                try:
+                    connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                    response = connection.getresponse()
+                    data = response.read()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    if reused:
+                        # The server closed a connection that sat idle; retry on a new one.
+                        continue
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    with self._lock:
+                        self._idle.append(connection)
+                return response.status, response.headers, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(endpoint, size, timeout):
+    """The process-wide pool for `endpoint`; every storage instance shares it."""
+    with _pools_lock:
+        pool = _pools.get(endpoint)
+        if pool is None:
+            pool = _pools[endpoint] = ConnectionPool(endpoint, size, timeout)
+        return pool
+
+
+class MetadataToken:
+    """Access tokens of the instance's service account, refreshed a minute before they expire."""
+
+    def __init__(self, url=METADATA_TOKEN_URL):
+        self.url = url
+        self._token = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._token is None or time.monotonic() > self._expires:
+                parts = urlsplit(self.url)
+                pool = get_pool(f"{parts.scheme}://{parts.netloc}", 2, 10)
+                status, _, data = pool.request('GET', parts.path, headers={'Metadata-Flavor': 'Google'})
+                if status != 200:
+                    raise GCSError(status, "Could not get an access token from the metadata server.")
+                payload = json.loads(data)
+                self._token = payload['access_token']
+                self._expires = time.monotonic() + payload['expires_in'] - 60
+            return self._token
+
+
+class Client:
+    """The JSON API calls the storage backend makes, against one bucket."""
+
+    def __init__(self, bucket, endpoint=DEFAULT_ENDPOINT, token=None, pool_size=16, timeout=60, retries=5):
+        self.bucket = bucket
+        self.pool = get_pool(endpoint.rstrip('/'), pool_size, timeout)
+        self.token = token
+        self.retries = retries
+
+    def _headers(self, headers):
+        headers = dict(headers or {})
+        token = self.token() if callable(self.token) else self.token
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        return headers
+
+    def request(self, method, path, params=None, body=None, headers=None, ok=(200, 204, 206)):
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        for attempt in range(self.retries + 1):
+            try:
+                status, response_headers, data = self.pool.request(method, path, body, self._headers(headers))
+            except (http.client.HTTPException, OSError):
+                if attempt == self.retries:
+                    raise
+            else:
+                if status in ok:
+                    return status, response_headers, data
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    message = data.decode(errors='replace')[:500]
+                    raise (NotFound if status == 404 else GCSError)(status, message)
+            time.sleep(random.uniform(0, min(8.0, 0.1 * 2 ** attempt)))
+
+    def object_path(self, name):
+        return f"/storage/v1/b/{_quote(self.bucket)}/o/{_quote(name)}"
+
+    def metadata(self, name, fields=None):
+        params = {'fields': fields} if fields else None
+        return json.loads(self.request('GET', self.object_path(name), params)[2])
+
+    def download(self, name, start=0, end=None):
+        """Bytes [start, end] of an object, plus its total size; an empty read past the end."""
+        headers = {'Range': f"bytes={start}-{'' if end is None else end}"}
+        status, response_headers, data = self.request(
+            'GET', self.object_path(name), {'alt': 'media'}, headers=headers, ok=(200, 206, 416),
+        )
+        total = response_headers.get('Content-Range', '').rpartition('/')[2]
+        if status == 416:
+            return b'', int(total) if total.isdigit() else None
+        if status == 200:
+            # Whole object: a server ignoring Range, or one asked from 0 to the end.
+            return data[start:None if end is None else end + 1], len(data)
+        return data, int(total) if total.isdigit() else None
+
+    def upload(self, name, data, content_type):
+        path = f"/upload/storage/v1/b/{_quote(self.bucket)}/o"
+        params = {'uploadType': 'media', 'name': name}
+        return json.loads(self.request('POST', path, params, data, {'Content-Type': content_type})[2])
+
+    def compose(self, sources, destination, content_type):
+        body = json.dumps({
+            'sourceObjects': [{'name': source} for source in sources],
+            'destination': {'contentType': content_type},
+        })
+        path = f"{self.object_path(destination)}/compose"
+        return json.loads(self.request('POST', path, body=body, headers={'Content-Type': 'application/json'})[2])
+
+    def delete(self, name):
+        try:
+            self.request('DELETE', self.object_path(name))
+        except NotFound:
+            return False
+        return True
+
+    def list(self, prefix='', delimiter=None):
+        """Yield each page of a listing as (prefixes, objects)."""
+        params = {'prefix': prefix, 'fields': 'nextPageToken,prefixes,items(name)'}
+        if delimiter:
+            params['delimiter'] = delimiter
+        while True:
+            page = json.loads(self.request('GET', f"/storage/v1/b/{_quote(self.bucket)}/o", params)[2])
+            yield page.get('prefixes', []), page.get('items', [])
+            if not page.get('nextPageToken'):
+                return
+            params['pageToken'] = page['nextPageToken']
+
+    def create_bucket(self, project):
+        body = json.dumps({'name': self.bucket})
+        self.request('POST', '/storage/v1/b', {'project': project}, body, {'Content-Type': 'application/json'})
+
+    def _delete_batch(self, names):
+        """One batch request deleting up to 100 objects; returns the names to retry one by one."""
+        boundary = f"batch_{secrets.token_hex(12)}"
+        parts = [
+            f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <{index}>\r\n\r\n"
+            f"DELETE {self.pool.base_path}{self.object_path(name)} HTTP/1.1\r\n\r\n"
+            for index, name in enumerate(names)
+        ]
+        body = (''.join(parts) + f"--{boundary}--\r\n").encode()
+        headers = {'Content-Type': f"multipart/mixed; boundary={boundary}"}
+        try:
+            _, response_headers, data = self.request('POST', '/batch/storage/v1', body=body, headers=headers)
+        except GCSError:
+            return names
+        match = re.search(r'boundary="?([^";]+)"?', response_headers.get('Content-Type', ''))
+        if match is None:
+            return names
+        done = set()
+        for part in data.decode(errors='replace').split(f"--{match.group(1)}"):
+            content_id = re.search(r'Content-ID:\s*<response-(\d+)>', part, re.IGNORECASE)
+            status = re.search(r'HTTP/1\.1 (\d{3})', part)
+            if content_id and status and status.group(1) in ('200', '204', '404'):
+                done.add(int(content_id.group(1)))
+        return [name for index, name in enumerate(names) if index not in done]
+
+    def delete_many(self, names):
+        """Delete objects 100 per batch request; missing ones are skipped. Returns how many were sent."""
+        names = list(names)
+        for offset in range(0, len(names), BATCH_MAX_CALLS):
+            for name in self._delete_batch(names[offset:offset + BATCH_MAX_CALLS]):
+                self.delete(name)
+        return len(names)
+
+
+def sign_url(endpoint, bucket, name, access_id, secret, expires, params=None, method='GET', now=None):
+    """A V4 signed URL (GOOG4-HMAC-SHA256) for one object, valid for `expires` seconds."""
+    now = now or datetime.now(timezone.utc)
+    stamp = now.strftime('%Y%m%dT%H%M%SZ')
+    day = stamp[:8]
+    scope = f"{day}/auto/storage/goog4_request"
+    parts = urlsplit(endpoint)
+    path = f"{parts.path.rstrip('/')}/{_quote(bucket)}/{quote(name, safe='/-_.~')}"
+    query = {
+        **(params or {}),
+        'X-Goog-Algorithm': 'GOOG4-HMAC-SHA256',
+        'X-Goog-Credential': f"{access_id}/{scope}",
+        'X-Goog-Date': stamp,
+        'X-Goog-Expires': str(expires),
+        'X-Goog-SignedHeaders': 'host',
+    }
+    canonical_query = '&'.join(f"{_quote(key)}={_quote(value)}" for key, value in sorted(query.items()))
+    canonical_request = '\n'.join([
+        method, path, canonical_query, f"host:{parts.netloc}", '', 'host', 'UNSIGNED-PAYLOAD',
+    ])
+    string_to_sign = '\n'.join([
+        'GOOG4-HMAC-SHA256', stamp, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+    key = f"GOOG4{secret}".encode()
+    for part in (day, 'auto', 'storage', 'goog4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"{parts.scheme}://{parts.netloc}{path}?{canonical_query}&X-Goog-Signature={signature}"
+
+
+class ObjectReader:
+    """A seekable read-only view of one object, fetched in ranged reads of at least `block_size`."""
+
+    def __init__(self, client, name, block_size):
+        self.client = client
+        self.name = name
+        self.block_size = block_size
+        self.position = 0
+        self._size = None
+        self._buffer = b''
+        self._buffer_start = 0
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = int(self.client.metadata(self.name, fields='size')['size'])
+        return self._size
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def read(self, size=-1):
+        start = self.position - self._buffer_start
+        if size is not None and 0 <= size and 0 <= start and start + size <= len(self._buffer):
+            data = self._buffer[start:start + size]
+        elif size is None or size < 0:
+            data, self._size = self.client.download(self.name, self.position)
+            self._buffer = b''
+        else:
+            block, total = self.client.download(self.name, self.position, self.position + max(size, self.block_size) - 1)
+            if total is not None:
+                self._size = total
+            self._buffer, self._buffer_start = block, self.position
+            data = block[:size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self._buffer = b''
+
+
+@deconstructible
+class GoogleCloudStorage(Storage):
+    """Objects in one bucket; the options default to the GCS_* settings."""
+
+    def __init__(self, bucket_name=None, endpoint=None, public_endpoint=None, access_token=None,
+                 hmac_access_id=None, hmac_secret=None, signed_url_seconds=None, pool_size=None,
+                 timeout=None, upload_part_size=None, upload_workers=None, read_block_size=None):
+        self.bucket_name = bucket_name or settings.GCS_BUCKET_NAME
+        self.endpoint = (endpoint or getattr(settings, 'GCS_API_ENDPOINT', None) or DEFAULT_ENDPOINT).rstrip('/')
+        self.public_endpoint = (public_endpoint or getattr(settings, 'GCS_PUBLIC_ENDPOINT', None) or self.endpoint).rstrip('/')
+        self.access_token = access_token or getattr(settings, 'GCS_ACCESS_TOKEN', None)
+        self.hmac_access_id = hmac_access_id or getattr(settings, 'GCS_HMAC_ACCESS_ID', None)
+        self.hmac_secret = hmac_secret or getattr(settings, 'GCS_HMAC_SECRET', None)
+        self.signed_url_seconds = signed_url_seconds or getattr(settings, 'GCS_SIGNED_URL_SECONDS', 300)
+        self.pool_size = pool_size or getattr(settings, 'GCS_POOL_SIZE', 16)
+        self.timeout = timeout or getattr(settings, 'GCS_TIMEOUT', 60)
+        self.upload_part_size = upload_part_size or getattr(settings, 'GCS_UPLOAD_PART_SIZE', 16 * 1024 * 1024)
+        self.upload_workers = upload_workers or getattr(settings, 'GCS_UPLOAD_WORKERS', 8)
+        self.read_block_size = read_block_size or getattr(settings, 'GCS_READ_BLOCK_SIZE', 4 * 1024 * 1024)
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            token = self.access_token
+            if token is None and urlsplit(self.endpoint).hostname.endswith('googleapis.com'):
+                token = MetadataToken()
+            self._client = Client(self.bucket_name, self.endpoint, token, self.pool_size, self.timeout)
+        return self._client
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.upload_workers, thread_name_prefix='gcs-upload')
+            return self._executor
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("GCS objects are opened for reading only; save() writes them.")
+        return File(ObjectReader(self.client, name, self.read_block_size), name)
+
+    def _parts(self, content):
+        """The content in blocks of exactly upload_part_size bytes, the last one shorter."""
+        pending = bytearray()
+        for data in content.chunks(self.upload_part_size):
+            pending += data
+            while len(pending) >= self.upload_part_size:
+                yield bytes(pending[:self.upload_part_size])
+                del pending[:self.upload_part_size]
+        if pending:
+            yield bytes(pending)
+
+    def _save(self, name, content):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        stored_parts = getattr(content, 'stored_parts', None)
+        if stored_parts is not None:
+            self.compose(stored_parts(), name, content_type)
+            return name
+        parts = self._parts(content)
+        first = next(parts, b'')
+        second = next(parts, None)
+        if second is None:
+            self.client.upload(name, first, content_type)
+        else:
+            self._composite_upload(name, [first, second], parts, content_type)
+        return name
+
+    def _composite_upload(self, name, head, parts, content_type):
+        """Upload parts in parallel, holding at most upload_workers of them in memory, then compose them."""
+        prefix = f"tmp/composite/{secrets.token_hex(12)}/"
+        uploaded = []
+        pending = set()
+        try:
+            for index, data in enumerate(itertools.chain(head, parts)):
+                if len(pending) >= self.upload_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                part_name = f"{prefix}{index:05d}"
+                uploaded.append(part_name)
+                pending.add(self.executor.submit(self.client.upload, part_name, data, 'application/octet-stream'))
+            for future in wait(pending)[0]:
+                future.result()
+            self.compose(uploaded, name, content_type)
+        finally:
+            wait(pending)
+            self.delete_many(uploaded)
+
+    def compose(self, sources, destination, content_type='application/octet-stream'):
+        """Compose any number of objects into `destination`, in rounds of 32 sources per call."""
+        sources = list(sources)
+        intermediates = []
+        try:
+            while len(sources) > COMPOSE_MAX_SOURCES:
+                prefix = f"tmp/composite/{secrets.token_hex(12)}/"
+                groups = [sources[i:i + COMPOSE_MAX_SOURCES] for i in range(0, len(sources), COMPOSE_MAX_SOURCES)]
+                targets = [f"{prefix}{index:05d}" for index in range(len(groups))]
+                intermediates.extend(targets)
+                futures = [
+                    self.executor.submit(self.client.compose, group, target, 'application/octet-stream')
+                    for group, target in zip(groups, targets)
+                ]
+                for future in futures:
+                    future.result()
+                sources = targets
+            self.client.compose(sources, destination, content_type)
+        finally:
+            if intermediates:
+                self.delete_many(intermediates)
+
+    def delete(self, name):
+        self.client.delete(name)
+
+    def delete_many(self, names):
+        """Delete objects in batch requests of 100; missing ones are skipped."""
+        return self.client.delete_many(names)
+
+    def exists(self, name):
+        try:
+            self.client.metadata(name, fields='name')
+        except NotFound:
+            return False
+        return True
+
+    def listdir(self, path):
+        prefix = f"{path.rstrip('/')}/" if path else ''
+        directories, files = [], []
+        for prefixes, items in self.client.list(prefix, delimiter='/'):
+            directories.extend(entry[len(prefix):].rstrip('/') for entry in prefixes)
+            files.extend(item['name'][len(prefix):] for item in items)
+        return directories, files
+
+    def size(self, name):
+        return int(self.client.metadata(name, fields='size')['size'])
+
+    def _datetime(self, value):
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return moment if settings.USE_TZ else moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def get_modified_time(self, name):
+        return self._datetime(self.client.metadata(name, fields='updated')['updated'])
+
+    def get_created_time(self, name):
+        return self._datetime(self.client.metadata(name, fields='timeCreated')['timeCreated'])
+
+    def signed_url(self, name, expires=None, response_type=None, response_disposition=None):
+        """
+        A short-lived URL GCS serves the object from, Range requests
+        included, or None without GCS_HMAC_ACCESS_ID and GCS_HMAC_SECRET.
+        """
+        if not (self.hmac_access_id and self.hmac_secret):
+            return None
+        params = {}
+        if response_type:
+            params['response-content-type'] = response_type
+        if response_disposition:
+            params['response-content-disposition'] = response_disposition
+        return sign_url(
+            self.public_endpoint, self.bucket_name, name, self.hmac_access_id, self.hmac_secret,
+            expires or self.signed_url_seconds, params,
+        )
+
+    def url(self, name):
+        signed = self.signed_url(name)
+        if signed is not None:
+            return signed
+        return f"{self.public_endpoint}/{_quote(self.bucket_name)}/{quote(name, safe='/-_.~')}"
@@ -0,0 +1,91 @@
+"""
+Rendering of thumbnails and previews.
+
+This runs inside the thumbnail worker processes, so it must not import
+Django. Images are rendered with Pillow and PDFs read with pypdf. Nothing
+here can rasterise PDF pages, so the preview is the largest image embedded
+in the first page, which covers scans and most slide decks.
+"""
+import io
+
+import pypdf
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# Refuse decompression bombs instead of rendering them.
+MAX_PIXELS = 80_000_000
+
+# What Image.open() reads to pick a format.
+PREFIX_BYTES = 16
+
+
+def _read(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+
+def _pdf_first_image(handle):
+    reader = pypdf.PdfReader(handle)
+    if not reader.pages:
+        return None
+    images = sorted(reader.pages[0].images, key=lambda image: len(image.data), reverse=True)
+    return Image.open(io.BytesIO(images[0].data)) if images else None
+
+
+def _encode(image):
+    output = io.BytesIO()
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image.convert('RGBA').save(output, 'PNG', optimize=True)
+        content_type = 'image/png'
+    else:
+        image.convert('RGB').save(output, 'JPEG', quality=82, optimize=True, progressive=True)
+        content_type = 'image/jpeg'
+    return output.getvalue(), content_type, image.width, image.height
+
+
+def renderable(prefix):
+    """
+    Whether content starting with `prefix` is a PDF or an image format that
+    Pillow recognises by its signature, so it is worth reading in full.
+    """
+    if prefix.startswith(b'%PDF-'):
+        return True
+    Image.init()
+    for _, accept in Image.OPEN.values():
+        # Formats without a signature check would claim anything.
+        if accept is not None:
+            result = accept(prefix[:PREFIX_BYTES])
+            if result and not isinstance(result, str):
+                return True
+    return False
+
+
+def render(source, sizes):
+    """
+    Render `source` (a local path or bytes) at every `{variant: edge}` size.
+    Returns `{variant: (data, content_type, width, height)}`, or None when
+    the content is not something we can render. Broken files raise.
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with _read(source) as handle:
+        is_pdf = handle.read(5) == b'%PDF-'
+        handle.seek(0)
+        try:
+            image = _pdf_first_image(handle) if is_pdf else Image.open(handle)
+        except UnidentifiedImageError:
+            return None
+        if image is None:
+            return None
+        with image:
+            largest = max(sizes.values())
+            # JPEG decoders can downscale while decoding, which is far cheaper.
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            image.load()
+            results = {}
+            for variant, edge in sizes.items():
+                thumbnail = image.copy()
+                thumbnail.thumbnail((edge, edge), Image.LANCZOS)
+                results[variant] = _encode(thumbnail)
+            return results
@@ -0,0 +1,137 @@
+"""
+Per-user change journal behind the delta sync API.
+
+Every create, update, move and delete of a file or folder appends a Change
+with the next number of its owner's sequence. Numbers are handed out by
+incrementing the owner's JournalHead, which locks that row until the
+transaction commits; entries therefore become visible in sequence order
+and a reader never skips one that commits later.
+
+Entries carry the item's state after the change. A folder deleted or moved
+takes its subtree with it, so only the folder itself is recorded. Clients
+keep the last sequence number they applied as their cursor. compact()
+drops entries older than CHANGES_RETENTION_DAYS and raises the head's
+floor; a cursor below the floor can no longer be served and the
+client has to resync in full.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from api.storage.models import Change, File, Folder, JournalHead
+
+
+class CursorExpired(Exception):
+    """The cursor points before the oldest entry still kept, or past the newest."""
+
+    def __init__(self, head):
+        super().__init__("This cursor is no longer valid; resync from scratch.")
+        self.head = head
+
+
+def _retention():
+    return timedelta(days=getattr(settings, 'CHANGES_RETENTION_DAYS', 30))
+
+
+def file_change(file, action, parent_uuid):
+    return Change(
+        owner_id=file.owner_id, kind=Change.KIND_FILE, action=action, item_uuid=file.uuid,
+        parent_uuid=parent_uuid, name=file.name, size=file.size,
+    )
+
+
+def folder_change(folder, action):
+    return Change(
+        owner_id=folder.owner_id, kind=Change.KIND_FOLDER, action=action, item_uuid=folder.uuid,
+        parent_uuid=folder.parent_id, name=folder.name,
+    )
+
+
+def record(changes):
+    """Number and store `changes`, in order, as one block per owner."""
+    by_owner = defaultdict(list)
+    for change in changes:
+        by_owner[change.owner_id].append(change)
+    if not by_owner:
+        return
+    with transaction.atomic():
+        for owner_id, owned in sorted(by_owner.items()):
+            heads = JournalHead.objects.filter(owner_id=owner_id)
+            if not heads.update(seq=F('seq') + len(owned)):
+                JournalHead.objects.get_or_create(owner_id=owner_id)
+                heads.update(seq=F('seq') + len(owned))
+            last = heads.values_list('seq', flat=True).get()
+            for seq, change in enumerate(owned, start=last - len(owned) + 1):
+                change.seq = seq
+        Change.objects.bulk_create(changes, batch_size=1000)
+
+
+def _folder_uuids(folder_ids):
+    return dict(Folder.all_objects.filter(pk__in={pk for pk in folder_ids if pk}).values_list('pk', 'uuid'))
+
+
+def record_files(files, action, parent_uuid=None):
+    """Record `action` for many files; their folders' uuids are looked up unless `parent_uuid` is given."""
+    files = list(files)
+    if parent_uuid is None:
+        parents = _folder_uuids(file.folder_id for file in files)
+        record([file_change(file, action, parents.get(file.folder_id)) for file in files])
+    else:
+        record([file_change(file, action, parent_uuid) for file in files])
+
+
+def record_folders(folders, action):
+    record([folder_change(folder, action) for folder in folders])
+
+
+def record_subtree(folder, action):
+    """Record `action` for a folder and everything below it, parents before children."""
+    folders = [folder, *Folder.objects.filter(path__startswith=folder.subtree_prefix).order_by('depth', 'pk')]
+    files = File.objects.filter(Q(folder=folder) | Q(folder__path__startswith=folder.subtree_prefix))
+    parents = {item.pk: item.uuid for item in folders}
+    record(
+        [folder_change(item, action) for item in folders]
+        + [file_change(file, action, parents.get(file.folder_id)) for file in files.order_by('pk')]
+    )
+
+
+def _head(user_id):
+    return JournalHead.objects.filter(owner_id=user_id).values_list('seq', 'floor').first() or (0, 0)
+
+
+def head(user_id):
+    return _head(user_id)[0]
+
+
+def changes_since(user_id, cursor, limit):
+    """
+    Up to `limit` entries after `cursor`, the cursor to continue from and
+    whether more are waiting. Raises CursorExpired when the cursor cannot
+    be served.
+    """
+    changes = list(Change.objects.filter(owner_id=user_id, seq__gt=cursor).order_by('seq')[:limit + 1])
+    # Read after the entries: compaction raises the floor in the same
+    # transaction that deletes them, so a floor read afterwards covers them.
+    seq, floor = _head(user_id)
+    if cursor < floor or cursor > seq:
+        raise CursorExpired(seq)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return changes, (changes[-1].seq if changes else cursor), has_more
+
+
+def compact(before=None):
+    """Drop entries older than `before` (default: the retention period); returns how many went."""
+    before = before or timezone.now() - _retention()
+    removed = 0
+    floors = Change.objects.filter(created_at__lt=before).values('owner_id').annotate(floor=Max('seq'))
+    for row in floors.order_by('owner_id'):
+        with transaction.atomic():
+            JournalHead.objects.filter(owner_id=row['owner_id'], floor__lt=row['floor']).update(floor=row['floor'])
+            deleted, _ = Change.objects.filter(owner_id=row['owner_id'], seq__lte=row['floor']).delete()
+            removed += deleted
+    return removed
@@ -0,0 +1,124 @@
+"""
+Response cache for folder listings and the dashboard.
+
+Every folder has a version token, and every user has a tree version. Both
+live in the configured cache backend and are replaced whenever a child file
+or folder is created, renamed, moved or deleted. Cached responses and ETags
+are keyed by those tokens, so invalidation never has to find stale entries:
+they simply stop being addressed and expire.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.replicas import routing
+from api.storage.renderers import JSONRenderer
+
+
+def get_cache():
+    return caches[getattr(settings, 'LISTING_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+
+
+def _version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def folder_version(folder_uuid):
+    return _version(f"listing-version:folder:{folder_uuid}")
+
+
+def tree_version(user_id):
+    return _version(f"listing-version:tree:{user_id}")
+
+
+def _bump(folder_uuids, user_ids):
+    cache = get_cache()
+    keys = [f"listing-version:folder:{folder_uuid}" for folder_uuid in folder_uuids if folder_uuid]
+    keys += [f"listing-version:tree:{user_id}" for user_id in user_ids if user_id]
+    if keys:
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+    # Whoever wrote, the owners now read from the primary until replicas have the change.
+    routing.stick_to_primary(user_ids)
+
+
+def invalidate(folder_uuids=(), user_ids=()):
+    """Retire the versions of the given folders and user trees once the current transaction commits."""
+    folder_uuids, user_ids = set(folder_uuids), set(user_ids)
+    transaction.on_commit(lambda: _bump(folder_uuids, user_ids))
+
+
+async def _aversion(key):
+    cache = get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, uuid.uuid4().hex, None)
+        version = await cache.aget(key)
+    return version
+
+
+async def afolder_version(folder_uuid):
+    return await _aversion(f"listing-version:folder:{folder_uuid}")
+
+
+def _etag(request, scope, version):
+    query = getattr(request, 'query_params', request.GET)
+    params = '&'.join(f"{key}={value}" for key, value in sorted(query.items()))
+    raw = f"{scope}:{version}:{request.user.pk}:{request.get_host()}:{params}"
+    return quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32])
+
+
+def cached_response(request, scope, version, build):
+    """
+    Serve `build()` through the cache. A matching If-None-Match gets a 304
+    straight from the version token, without running `build` at all.
+    """
+    etag = _etag(request, scope, version)
+    key = 'listing:' + etag.strip('"')
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, _timeout())
+        response = Response(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def acached_response(request, scope, version, build):
+    """cached_response() for plain async views: `build` is a coroutine function and the response is rendered here."""
+    etag = _etag(request, scope, version)
+    key = 'listing:' + etag.strip('"')
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        cache = get_cache()
+        data = await cache.aget(key)
+        if data is None:
+            data = await build()
+            await cache.aset(key, data, _timeout())
+        response = HttpResponse(JSONRenderer().render(data), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
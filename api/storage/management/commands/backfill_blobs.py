@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.storage import blobs
+from api.storage.models import File
+
+
+class Command(BaseCommand):
+    help = "Move files uploaded before the blob store into content-addressed blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--keep-originals', action='store_true', help="Do not delete the old per-file objects.")
+
+    def handle(self, *args, **options):
+        migrated = 0
+        queryset = File.objects.filter(blob__isnull=True).exclude(file='').exclude(file__isnull=True)
+        while True:
+            batch = list(queryset.order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            for file in batch:
+                old_name = file.file.name
+                with file.file.open('rb') as content:
+                    blob = blobs.store_content(content)
+                with transaction.atomic():
+                    blobs.attach(file, blob)
+                    file.save(update_fields=['blob', 'file', 'size'])
+                if not options['keep_originals'] and old_name != file.file.name:
+                    file.file.storage.delete(old_name)
+                migrated += 1
+            self.stdout.write(f"{migrated} files moved to blobs")
+        self.stdout.write(self.style.SUCCESS(f"Done, {migrated} files moved to blobs."))
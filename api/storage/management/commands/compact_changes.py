@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.storage import journal
+
+
+class Command(BaseCommand):
+    help = "Drop change journal entries past their retention; clients holding older cursors will resync."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None, help="Keep this many days (default: CHANGES_RETENTION_DAYS).")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days']) if options['days'] is not None else None
+        removed = journal.compact(before)
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} change journal entries."))
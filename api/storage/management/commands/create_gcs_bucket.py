@@ -0,0 +1,24 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from api.storage import gcs
+
+
+class Command(BaseCommand):
+    help = "Create the GCS_BUCKET_NAME bucket, e.g. in a fresh fake-gcs-server."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', default='local', help="Project the bucket belongs to.")
+
+    def handle(self, *args, **options):
+        client = getattr(default_storage, 'client', None)
+        if not isinstance(client, gcs.Client):
+            raise CommandError("The default storage is not Google Cloud Storage; set GCS_BUCKET_NAME.")
+        try:
+            client.create_bucket(options['project'])
+        except gcs.GCSError as error:
+            if error.status != 409:
+                raise CommandError(str(error))
+            self.stdout.write(f"Bucket {client.bucket} already exists.")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Created bucket {client.bucket}."))
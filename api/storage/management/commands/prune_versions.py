@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.storage import versions
+from api.storage.models import File
+
+
+class Command(BaseCommand):
+    help = "Delete all but the newest versions of every file, and chunks uploaded for versions never committed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=None, help="Versions kept per file (default: VERSION_KEEP).")
+        parser.add_argument('--unused-hours', type=float, default=24, help="Age after which unreferenced chunks go.")
+
+    def handle(self, *args, **options):
+        keep = options['keep'] or getattr(settings, 'VERSION_KEEP', 50)
+        files = File.all_objects.annotate(version_count=Count('versions')).filter(version_count__gt=keep)
+        deleted = 0
+        for file in files.only('pk').iterator():
+            deleted += versions.prune(file, keep=keep)
+        collected = versions.collect_unused_chunks(timedelta(hours=options['unused_hours']))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} versions and {collected} unused chunks."))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.storage import trash
+
+
+class Command(BaseCommand):
+    help = "Background worker that purges trash entries once they are due, in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per transaction (default: TRASH_PURGE_BATCH_SIZE).")
+        parser.add_argument('--interval', type=float, default=30, help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--once', action='store_true', help="Purge what is due now and exit.")
+
+    def report(self, entry):
+        self.stdout.write(
+            f"{entry.uuid} {entry.name}: {entry.purged_files}/{entry.total_files} files, "
+            f"{entry.purged_folders}/{entry.total_folders} folders, {entry.purged_bytes} bytes"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            purged = trash.purge_due(options['batch_size'], on_batch=self.report)
+            if purged:
+                self.stdout.write(self.style.SUCCESS(f"Purged {purged} trash entries."))
+            if options['once']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
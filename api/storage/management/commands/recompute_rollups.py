@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.storage import rollups
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recompute folder and user size/count rollups from the file table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Limit to these users (default: everyone).")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        rollups.recompute(users)
+        self.stdout.write(self.style.SUCCESS(f"Recomputed rollups for {users.count()} users."))
@@ -0,0 +1,83 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.storage import sharded
+from api.storage.models import Blob, Derivative, File, UploadSession
+
+
+def _manager(model):
+    return getattr(model, 'all_objects', model._default_manager)
+
+
+class Command(BaseCommand):
+    help = "Move objects stored under the flat MEDIA_ROOT layout into sharded directories, in place."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move.")
+
+    def handle(self, *args, **options):
+        try:
+            default_storage.path('')
+        except NotImplementedError:
+            raise CommandError("The default storage has no local files to reshard.")
+        self.dry_run = options['dry_run']
+        moved = 0
+        for model in (File, Blob, Derivative):
+            moved += self.reshard_model(model, options['batch_size'])
+        sessions = self.reshard_sessions()
+        verb = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} objects and the chunks of {sessions} upload sessions."))
+
+    def flat_names(self, model, batch_size):
+        """Distinct stored names not sharded yet, walked in name order so moved ones are not revisited."""
+        names = (
+            _manager(model).exclude(file='').exclude(file__isnull=True)
+            .order_by('file').values_list('file', flat=True).distinct()
+        )
+        last = ''
+        while True:
+            batch = list(names.filter(file__gt=last)[:batch_size])
+            if not batch:
+                return
+            last = batch[-1]
+            yield from (name for name in batch if not sharded.is_sharded(name))
+
+    def reshard_model(self, model, batch_size):
+        moved = 0
+        for old_name in self.flat_names(model, batch_size):
+            old_path = default_storage.path(old_name)
+            if not os.path.exists(old_path):
+                self.stderr.write(f"{model.__name__} object {old_name} is missing, skipped.")
+                continue
+            moved += 1
+            if self.dry_run:
+                continue
+            new_name = default_storage.get_available_name(sharded.shard(old_name))
+            new_path = default_storage.path(new_name)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            # Linked first: the object stays reachable under both names until every row points at the new one.
+            os.link(old_path, new_path)
+            with transaction.atomic():
+                for other in (File, Blob, Derivative):
+                    _manager(other).filter(file=old_name).update(file=new_name)
+            os.unlink(old_path)
+        if moved:
+            self.stdout.write(f"{model.__name__}: {moved} objects")
+        return moved
+
+    def reshard_sessions(self):
+        moved = 0
+        for session in UploadSession.objects.filter(status=UploadSession.STATUS_ACTIVE).iterator():
+            old_path = default_storage.path(f"uploads/{session.uuid}")
+            if not os.path.isdir(old_path):
+                continue
+            moved += 1
+            if not self.dry_run:
+                new_path = default_storage.path(session.chunk_directory)
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                os.rename(old_path, new_path)
+        return moved
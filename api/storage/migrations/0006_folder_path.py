@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Folder = apps.get_model('storage', 'Folder')
+    rows = list(Folder.objects.values_list('pk', 'uuid', 'parent_id'))
+    by_uuid = {folder_uuid: (pk, parent_id) for pk, folder_uuid, parent_id in rows}
+    paths = {}
+
+    def resolve(folder_uuid):
+        if folder_uuid in paths:
+            return paths[folder_uuid]
+        pk, parent_id = by_uuid[folder_uuid]
+        if parent_id is None:
+            paths[folder_uuid] = ('/', 0)
+        else:
+            parent_path, parent_depth = resolve(parent_id)
+            paths[folder_uuid] = (f"{parent_path}{by_uuid[parent_id][0]}/", parent_depth + 1)
+        return paths[folder_uuid]
+
+    updated = []
+    for pk, folder_uuid, parent_id in rows:
+        path, depth = resolve(folder_uuid)
+        updated.append(Folder(pk=pk, path=path, depth=depth))
+    Folder.objects.bulk_update(updated, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(db_index=True, default='/', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_blob_sizes(apps, schema_editor):
+    File = apps.get_model('storage', 'File')
+    Blob = apps.get_model('storage', 'Blob')
+    File.objects.filter(blob__isnull=False).update(
+        size=Subquery(Blob.objects.filter(pk=OuterRef('blob_id')).values('size')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_folder_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(copy_blob_sizes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'name', 'id'], name='file_folder_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'created_at', 'id'], name='file_folder_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'updated_at', 'id'], name='file_folder_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', 'size', 'id'], name='file_folder_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'created_at', 'id'], name='folder_parent_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'updated_at', 'id'], name='folder_parent_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def compute_rollups(apps, schema_editor):
+    Folder = apps.get_model('storage', 'Folder')
+    File = apps.get_model('storage', 'File')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    folders = list(Folder.objects.only('pk', 'path', 'depth'))
+    totals = {folder.pk: [0, 0, 0] for folder in folders}
+    for row in File.objects.filter(folder__isnull=False).values('folder_id').annotate(total=Sum('size'), files=Count('id')):
+        totals[row['folder_id']][0] += row['total'] or 0
+        totals[row['folder_id']][1] += row['files']
+    for folder in sorted(folders, key=lambda folder: folder.depth, reverse=True):
+        ancestors = [int(pk) for pk in folder.path.strip('/').split('/') if pk]
+        if ancestors and ancestors[-1] in totals:
+            parent, own = totals[ancestors[-1]], totals[folder.pk]
+            parent[0] += own[0]
+            parent[1] += own[1]
+            parent[2] += own[2] + 1
+    for folder in folders:
+        folder.total_bytes, folder.file_count, folder.folder_count = totals[folder.pk]
+    Folder.objects.bulk_update(folders, ['total_bytes', 'file_count', 'folder_count'], batch_size=1000)
+
+    owned = {row['owner_id']: row for row in File.objects.values('owner_id').annotate(total=Sum('size'), files=Count('id'))}
+    folder_counts = dict(Folder.objects.values_list('owner_id').annotate(count=Count('id')))
+    users = list(User.objects.only('pk'))
+    for user in users:
+        row = owned.get(user.pk, {})
+        user.total_bytes = row.get('total') or 0
+        user.file_count = row.get('files', 0)
+        user.folder_count = folder_counts.get(user.pk, 0)
+    User.objects.bulk_update(users, ['total_bytes', 'file_count', 'folder_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_listing_indexes'),
+        ('user', '0002_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='file_count',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='folder_count',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_rollups, migrations.RunPython.noop),
+    ]
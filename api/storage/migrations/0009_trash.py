@@ -0,0 +1,80 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:36
+
+import django.db.models.deletion
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def trash_orphans(apps, schema_editor):
+    """
+    Files whose folder was deleted while File.folder was SET_NULL go to the
+    trash for the usual retention period; restoring one puts it in the
+    owner's root folder.
+    """
+    File = apps.get_model('storage', 'File')
+    TrashEntry = apps.get_model('storage', 'TrashEntry')
+    purge_after = timezone.now() + timedelta(days=getattr(settings, 'TRASH_RETENTION_DAYS', 30))
+    orphans = list(File.objects.filter(folder__isnull=True, trash__isnull=True))
+    entries = [
+        TrashEntry(owner_id=file.owner_id, kind='file', name=file.name, item_uuid=file.uuid,
+                   total_bytes=file.size, total_files=1, purge_after=purge_after)
+        for file in orphans
+    ]
+    TrashEntry.objects.bulk_create(entries, batch_size=1000)
+    for file, entry in zip(orphans, entries):
+        file.trash = entry
+    File.objects.bulk_update(orphans, ['trash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0008_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='folder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='files', to='storage.folder'),
+        ),
+        migrations.CreateModel(
+            name='TrashEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('kind', models.CharField(choices=[('file', 'File'), ('folder', 'Folder')], max_length=16)),
+                ('name', models.CharField(max_length=255)),
+                ('item_uuid', models.UUIDField()),
+                ('status', models.CharField(choices=[('trashed', 'Trashed'), ('purging', 'Purging'), ('purged', 'Purged')], default='trashed', max_length=16)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+                ('total_files', models.BigIntegerField(default=0)),
+                ('total_folders', models.BigIntegerField(default=0)),
+                ('purged_bytes', models.BigIntegerField(default=0)),
+                ('purged_files', models.BigIntegerField(default=0)),
+                ('purged_folders', models.BigIntegerField(default=0)),
+                ('trashed_at', models.DateTimeField(auto_now_add=True)),
+                ('purge_after', models.DateTimeField(db_index=True)),
+                ('purged_at', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trash_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'trash entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='trash',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='files', to='storage.trashentry'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='trash',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='folders', to='storage.trashentry'),
+        ),
+        migrations.RunPython(trash_orphans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.db import DatabaseError, migrations, transaction
+
+
+# Expression indexes matching the SQL Django emits for name__icontains and
+# name__istartswith on PostgreSQL: UPPER("name"::text) LIKE UPPER(...).
+TRIGRAM_INDEXES = [
+    ('file_name_trgm_idx', 'storage_file'),
+    ('folder_name_trgm_idx', 'storage_folder'),
+]
+PREFIX_INDEXES = [
+    ('file_owner_name_prefix_idx', 'storage_file'),
+    ('folder_owner_name_prefix_idx', 'storage_folder'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in PREFIX_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} (owner_id, UPPER(name::text) text_pattern_ops)'
+        )
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except DatabaseError:
+        # Without the extension substring search still works, just unindexed.
+        return
+    for name, table in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER(name::text) gin_trgm_ops)'
+        )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table in TRIGRAM_INDEXES + PREFIX_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_trash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
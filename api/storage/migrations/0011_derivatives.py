@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0010_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant', models.CharField(max_length=32)),
+                ('status', models.CharField(choices=[('ready', 'Ready'), ('unsupported', 'Unsupported'), ('failed', 'Failed')], max_length=16)),
+                ('file', models.FileField(blank=True, max_length=255, upload_to='derivatives/')),
+                ('content_type', models.CharField(blank=True, max_length=64)),
+                ('width', models.PositiveIntegerField(default=0)),
+                ('height', models.PositiveIntegerField(default=0)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='storage.blob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('blob', 'variant'), name='unique_blob_derivative')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_derivatives'),
+        ('user', '0002_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalHead',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='journal_head', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('seq', models.BigIntegerField(default=0)),
+                ('floor', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('file', 'File'), ('folder', 'Folder')], max_length=16)),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('moved', 'Moved'), ('deleted', 'Deleted')], max_length=16)),
+                ('item_uuid', models.UUIDField()),
+                ('parent_uuid', models.UUIDField(blank=True, null=True)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'seq'), name='unique_owner_change_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0013_file_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='codec',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='frame_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='frames',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import F
+
+
+def keep_orphans(apps, schema_editor):
+    """
+    0009 used to queue orphaned files for purging right away. Give the ones
+    still in the trash the usual retention period from when they were trashed.
+    """
+    TrashEntry = apps.get_model('storage', 'TrashEntry')
+    retention = timedelta(days=getattr(settings, 'TRASH_RETENTION_DAYS', 30))
+    TrashEntry.objects.filter(kind='file', status='trashed', files__folder__isnull=True).update(
+        purge_after=F('trashed_at') + retention,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0015_chunk_uploads'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_orphans, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def count_retained_versions(apps, schema_editor):
+    """Add the bytes held by older file versions to their owners' usage."""
+    File = apps.get_model('storage', 'File')
+    FileVersion = apps.get_model('storage', 'FileVersion')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    retained = dict(FileVersion.objects.values_list('file__owner_id').annotate(total=Sum('size')))
+    # The newest version of a file is its current content, already counted.
+    for owner_id, size in File.objects.filter(versions__isnull=False).distinct().values_list('owner_id', 'size'):
+        retained[owner_id] -= size
+    for owner_id, size in retained.items():
+        if size:
+            User.objects.filter(pk=owner_id).update(total_bytes=F('total_bytes') + size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0016_keep_trashed_orphans'),
+        ('user', '0002_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_retained_versions, migrations.RunPython.noop),
+    ]
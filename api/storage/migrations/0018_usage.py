@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_usage(apps, schema_editor):
+    Usage = apps.get_model('storage', 'Usage')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Usage.objects.bulk_create(
+        [
+            Usage(owner_id=pk, total_bytes=total_bytes, file_count=file_count, folder_count=folder_count)
+            for pk, total_bytes, file_count, folder_count
+            in User.objects.values_list('pk', 'total_bytes', 'file_count', 'folder_count').iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0017_count_retained_versions'),
+        ('user', '0002_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Usage',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('folder_count', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(copy_usage, migrations.RunPython.noop),
+    ]
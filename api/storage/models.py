@@ -1,29 +1,421 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+class LiveManager(models.Manager):
+    """Default manager that hides trashed rows; `all_objects` still sees them."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(trash__isnull=True)
+
+
+class TrashEntry(models.Model):
+    """
+    One deleted file or folder tree. Every row it covers points at it via
+    `trash`; the purge worker removes them and records its progress here.
+    """
+    KIND_FILE = 'file'
+    KIND_FOLDER = 'folder'
+    KIND_CHOICES = [
+        (KIND_FILE, 'File'),
+        (KIND_FOLDER, 'Folder'),
+    ]
+    STATUS_TRASHED = 'trashed'
+    STATUS_PURGING = 'purging'
+    STATUS_PURGED = 'purged'
+    STATUS_CHOICES = [
+        (STATUS_TRASHED, 'Trashed'),
+        (STATUS_PURGING, 'Purging'),
+        (STATUS_PURGED, 'Purged'),
+    ]
+
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='trash_entries')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    item_uuid = models.UUIDField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_TRASHED)
+    total_bytes = models.BigIntegerField(default=0)
+    total_files = models.BigIntegerField(default=0)
+    total_folders = models.BigIntegerField(default=0)
+    purged_bytes = models.BigIntegerField(default=0)
+    purged_files = models.BigIntegerField(default=0)
+    purged_folders = models.BigIntegerField(default=0)
+    trashed_at = models.DateTimeField(auto_now_add=True)
+    purge_after = models.DateTimeField(db_index=True)
+    purged_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'trash entries'
+
+    def __str__(self):
+        return f"{self.owner}:{self.name} ({self.status})"
+
+
 class Folder(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     name = models.CharField(max_length=255)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='subfolders', to_field='uuid')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
+    # Materialized path of ancestor ids, e.g. "/1/52/" for a folder two levels
+    # below the root with id 1. Roots have "/". Maintained by save().
+    path = models.CharField(max_length=1024, default='/', editable=False, db_index=True)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Rollups over everything below this folder, kept current by api.storage.rollups.
+    total_bytes = models.BigIntegerField(default=0, editable=False)
+    file_count = models.BigIntegerField(default=0, editable=False)
+    folder_count = models.BigIntegerField(default=0, editable=False)
+    trash = models.ForeignKey(TrashEntry, null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='folders')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination of folder listings walks these indexes.
+        indexes = [
+            models.Index(fields=['parent', 'name', 'id'], name='folder_parent_name_idx'),
+            models.Index(fields=['parent', 'created_at', 'id'], name='folder_parent_created_idx'),
+            models.Index(fields=['parent', 'updated_at', 'id'], name='folder_parent_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id', models.DEFERRED)
+        return instance
+
+    @property
+    def subtree_prefix(self):
+        """Path prefix shared by every descendant of this folder."""
+        return f"{self.path}{self.pk}/"
+
+    @property
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/') if pk]
+
+    def is_in_subtree_of(self, other):
+        return self.pk == other.pk or self.path.startswith(other.subtree_prefix)
+
+    def save(self, *args, **kwargs):
+        loaded_parent_id = getattr(self, '_loaded_parent_id', models.DEFERRED)
+        adding = self._state.adding
+        moved = adding or (loaded_parent_id is not models.DEFERRED and self.parent_id != loaded_parent_id)
+        if not moved:
+            super().save(*args, **kwargs)
+            return
+
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'path', 'depth'}
+        with transaction.atomic():
+            old_prefix = None
+            if not adding:
+                # Re-read under lock: an ancestor may have moved since this row was loaded.
+                self.path, self.depth = (
+                    Folder.all_objects.select_for_update().values_list('path', 'depth').get(pk=self.pk)
+                )
+                old_prefix = self.subtree_prefix
+                # Lets post_save handlers see where the folder came from.
+                self._moved_from_path = self.path
+            old_depth = self.depth
+            if self.parent_id is None:
+                self.path, self.depth = '/', 0
+            else:
+                parent_pk, parent_path, parent_depth = (
+                    Folder.all_objects.select_for_update()
+                    .values_list('pk', 'path', 'depth')
+                    .get(uuid=self.parent_id)
+                )
+                if old_prefix is not None and (parent_pk == self.pk or parent_path.startswith(old_prefix)):
+                    raise ValueError("A folder cannot be moved into itself or one of its subfolders.")
+                self.path = f"{parent_path}{parent_pk}/"
+                self.depth = parent_depth + 1
+            super().save(*args, **kwargs)
+            if old_prefix is not None and old_prefix != self.subtree_prefix:
+                Folder.all_objects.filter(path__startswith=old_prefix).update(
+                    path=Concat(Value(self.subtree_prefix), Substr('path', len(old_prefix) + 1)),
+                    depth=F('depth') + (self.depth - old_depth),
+                )
+        self._loaded_parent_id = self.parent_id
+        self._moved_from_path = None
+
     def __str__(self):
         return f"{self.owner}:{self.name}"
 
+class Blob(models.Model):
+    """
+    Content-addressed object shared by every File with the same bytes. A
+    chunked blob has no stored object of its own: its content is the
+    concatenation of its chunks (BlobChunk), and its key is a keyed digest
+    of that list rather than of the bytes (see api.storage.versions).
+
+    With a `codec` the object holds the content compressed in frames of
+    `frame_size` bytes, which start at the offsets in `frames`; `size` is
+    always that of the content (see api.storage.compression).
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    file = models.FileField(upload_to='blobs/', max_length=255, blank=True)
+    chunked = models.BooleanField(default=False)
+    codec = models.CharField(max_length=16, blank=True, default='')
+    stored_size = models.BigIntegerField(null=True, blank=True)
+    frame_size = models.PositiveIntegerField(default=0)
+    frames = models.JSONField(default=list, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
+
+class BlobChunk(models.Model):
+    """One entry of a chunked blob's manifest; holds a reference on `chunk`."""
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField()
+    chunk = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='+')
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'index'], name='unique_blob_chunk_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id}[{self.index}] = {self.chunk_id}"
+
+
+class ChunkUpload(models.Model):
+    """A version chunk `owner` has sent the bytes of, which they may use until they commit it."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    chunk = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'chunk'], name='unique_chunk_upload'),
+        ]
+
+    def __str__(self):
+        return f"{self.chunk_id} by {self.owner_id}"
+
+
+class Derivative(models.Model):
+    """A thumbnail or preview of a blob's content, shared by every File holding it."""
+    STATUS_READY = 'ready'
+    STATUS_UNSUPPORTED = 'unsupported'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_READY, 'Ready'),
+        (STATUS_UNSUPPORTED, 'Unsupported'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='derivatives')
+    variant = models.CharField(max_length=32)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES)
+    file = models.FileField(upload_to='derivatives/', max_length=255, blank=True)
+    content_type = models.CharField(max_length=64, blank=True)
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'variant'], name='unique_blob_derivative'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id}:{self.variant} ({self.status})"
+
+
 class File(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to='files/', blank=True, null=True)  # This will place uploads in MEDIA_ROOT/files/
-    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.SET_NULL, related_name='files')
+    blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name='files')
+    size = models.BigIntegerField(default=0)
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE, related_name='files')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
+    trash = models.ForeignKey(TrashEntry, null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='files')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Keyset pagination of folder listings walks these indexes.
+        indexes = [
+            models.Index(fields=['folder', 'name', 'id'], name='file_folder_name_idx'),
+            models.Index(fields=['folder', 'created_at', 'id'], name='file_folder_created_idx'),
+            models.Index(fields=['folder', 'updated_at', 'id'], name='file_folder_updated_idx'),
+            models.Index(fields=['folder', 'size', 'id'], name='file_folder_size_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the blob, folder and size the row was loaded with so
+        # signal handlers can tell what changed.
+        instance._loaded_blob_id = instance.__dict__.get('blob_id', models.DEFERRED)
+        instance._loaded_folder_id = instance.__dict__.get('folder_id', models.DEFERRED)
+        instance._loaded_size = instance.__dict__.get('size', models.DEFERRED)
+        return instance
+
     def __str__(self):
         return self.name
+
+
+class FileVersion(models.Model):
+    """A past or current content of a File; holds a reference on its blob."""
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name='versions')
+    size = models.BigIntegerField()
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'number'], name='unique_file_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_id} v{self.number}"
+
+
+class Usage(models.Model):
+    """
+    A user's storage usage, kept current by api.storage.rollups. Kept off
+    the user row so that saving a stale user instance cannot rewind it.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='usage')
+    total_bytes = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    folder_count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.owner_id}: {self.total_bytes} bytes"
+
+
+class JournalHead(models.Model):
+    """
+    A user's position in the change journal: the last sequence number handed
+    out and the highest one compacted away. Kept off the user row so that
+    saving a stale user instance cannot rewind it.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='journal_head')
+    seq = models.BigIntegerField(default=0)
+    floor = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.owner_id}: {self.floor}..{self.seq}"
+
+
+class Change(models.Model):
+    """
+    One entry of a user's change journal (see api.storage.journal). Entries
+    carry the item's state after the change, so clients can apply them
+    without fetching the item.
+    """
+    KIND_FILE = 'file'
+    KIND_FOLDER = 'folder'
+    KIND_CHOICES = [
+        (KIND_FILE, 'File'),
+        (KIND_FOLDER, 'Folder'),
+    ]
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_MOVED = 'moved'
+    ACTION_DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (ACTION_CREATED, 'Created'),
+        (ACTION_UPDATED, 'Updated'),
+        (ACTION_MOVED, 'Moved'),
+        (ACTION_DELETED, 'Deleted'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='changes')
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    item_uuid = models.UUIDField()
+    parent_uuid = models.UUIDField(null=True, blank=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        # Also the index that serves "everything after seq N" for a user.
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'seq'], name='unique_owner_change_seq'),
+        ]
+
+    def __str__(self):
+        return f"{self.owner_id}#{self.seq} {self.action} {self.kind} {self.item_uuid}"
+
+
+class UploadSession(models.Model):
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    name = models.CharField(max_length=255)
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE, related_name='upload_sessions')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    file = models.OneToOneField(File, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index == self.chunk_count - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    @property
+    def chunk_directory(self):
+        key = self.uuid.hex
+        return f"uploads/{key[:2]}/{key[2:4]}/{self.uuid}"
+
+    def chunk_name(self, index):
+        return f"{self.chunk_directory}/{index:06d}"
+
+    def __str__(self):
+        return f"{self.owner}:{self.name} ({self.status})"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk_index'),
+        ]
+        ordering = ['index']
+
+    def __str__(self):
+        return f"{self.session_id}:{self.index}"
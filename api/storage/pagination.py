@@ -0,0 +1,99 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def encode_cursor(ordering, value, pk):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([ordering, value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ordering, value, pk = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+    return ordering, value, pk
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over (sort key, id). Each page is an index range scan
+    on (parent, sort key, id), so page N costs the same as page 1 no matter
+    how many children a folder has. Cursors encode the last row's sort value
+    and id and stay valid while rows are added or removed.
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size_query_param = 'page_size'
+    default_ordering = 'name'
+    datetime_fields = ('created_at', 'updated_at')
+
+    def __init__(self, ordering_fields=('name', 'created_at', 'updated_at'), page_size=None):
+        self.ordering_fields = ordering_fields
+        self.page_size = page_size or getattr(settings, 'FOLDER_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'FOLDER_MAX_PAGE_SIZE', 1000)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({'ordering': [f"Choose one of {', '.join(self.ordering_fields)} (prefix '-' to reverse)."]})
+        return ordering
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        if not value.isdigit() or int(value) == 0:
+            raise ValidationError({'page_size': ['Expected a positive integer.']})
+        return min(int(value), self.max_page_size)
+
+    def _window(self, queryset, ordering, page_size, cursor):
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        if cursor is not None:
+            cursor_ordering, value, pk = decode_cursor(cursor)
+            if cursor_ordering != ordering:
+                raise ValidationError({'cursor': ['Cursor was issued for a different ordering.']})
+            if field in self.datetime_fields:
+                value = parse_datetime(value)
+            op = 'lt' if descending else 'gt'
+            queryset = queryset.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk}))
+        prefix = '-' if descending else ''
+        return queryset.order_by(f'{prefix}{field}', f'{prefix}pk')[:page_size + 1]
+
+    def _page(self, rows, ordering, page_size):
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = encode_cursor(ordering, getattr(last, ordering.lstrip('-')), last.pk)
+        return rows, next_cursor
+
+    def paginate(self, queryset, ordering, page_size, cursor=None):
+        return self._page(list(self._window(queryset, ordering, page_size, cursor)), ordering, page_size)
+
+    async def apaginate(self, queryset, ordering, page_size, cursor=None):
+        rows = [row async for row in self._window(queryset, ordering, page_size, cursor)]
+        return self._page(rows, ordering, page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = self.get_ordering(request)
+        rows, self.next_cursor = self.paginate(
+            queryset, self.ordering, self.get_page_size(request), request.query_params.get(self.cursor_query_param)
+        )
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.next_cursor, 'ordering': self.ordering, 'results': data})
@@ -0,0 +1,43 @@
+import json
+
+import orjson
+from rest_framework import renderers
+
+from api.metrics import recorder
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    DRF's JSON renderer, with the encoding counted as serialization time.
+    Compact output is encoded by orjson, several times faster on large
+    listings; the result is the same JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with recorder.timed('serialize'):
+            indent = self.get_indent(accepted_media_type, renderer_context or {})
+            if data is None or indent or self.ensure_ascii or not self.compact:
+                return super().render(data, accepted_media_type, renderer_context)
+            rendered = orjson.dumps(
+                data, default=self.encoder_class().default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+            )
+            # As DRF does: keep the output valid inside JavaScript string literals.
+            if b'\xe2\x80\xa8' in rendered or b'\xe2\x80\xa9' in rendered:
+                rendered = rendered.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+            return rendered
+
+
+class PassthroughRenderer(renderers.BaseRenderer):
+    """
+    Lets binary endpoints answer any `Accept` header. Views behind it return
+    their own HttpResponse; only error payloads ever reach `render`.
+    """
+    media_type = '*/*'
+    format = None
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or isinstance(data, bytes):
+            return data or b''
+        return json.dumps(data).encode()
@@ -0,0 +1,250 @@
+"""
+Incremental size and count rollups.
+
+Every Folder carries `total_bytes`, `file_count` and `folder_count` for its
+whole subtree (itself excluded), and every user's Usage row carries the same
+numbers for everything they own, plus the bytes of older file versions they keep.
+Changes are pushed up the ancestor chain, which the
+materialized path gives us without any lookups, as one UPDATE per table,
+and retire the cached listings of every folder on the chain.
+"""
+import weakref
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Sum
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.storage import listing_cache
+from api.storage.models import File, FileVersion, Folder, Usage
+
+
+User = get_user_model()
+
+# pk sets of multi-row deletes, keyed by the QuerySet that started them.
+_deleting = weakref.WeakKeyDictionary()
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+    default_detail = 'Storage quota exceeded.'
+    default_code = 'quota_exceeded'
+
+
+def path_ids(path):
+    return [int(pk) for pk in path.strip('/').split('/') if pk]
+
+
+def chain(path, folder_pk):
+    """Primary keys of a folder and all of its ancestors."""
+    return path_ids(path) + [folder_pk]
+
+
+def _apply(folder_ids, user_id, size, files, folders):
+    changes = {}
+    if size:
+        changes['total_bytes'] = F('total_bytes') + size
+    if files:
+        changes['file_count'] = F('file_count') + files
+    if folders:
+        changes['folder_count'] = F('folder_count') + folders
+    if not changes:
+        return False
+    if folder_ids:
+        Folder.all_objects.filter(pk__in=folder_ids).update(**changes)
+    if user_id:
+        usage = Usage.objects.filter(owner_id=user_id)
+        if not usage.update(**changes):
+            Usage.objects.get_or_create(owner_id=user_id)
+            usage.update(**changes)
+    return True
+
+
+def _invalidate(folder_ids):
+    # The totals are in each folder's cached detail and in its row of its parent's listing.
+    if folder_ids:
+        listing_cache.invalidate(Folder.all_objects.filter(pk__in=folder_ids).values_list('uuid', flat=True))
+
+
+def apply(folder_ids, user_id, size=0, files=0, folders=0):
+    if _apply(folder_ids, user_id, size, files, folders):
+        _invalidate(folder_ids)
+
+
+def add_to_chain(deltas, folder_ids, size=0, files=0, folders=0):
+    for folder_id in folder_ids:
+        delta = deltas[folder_id]
+        delta[0] += size
+        delta[1] += files
+        delta[2] += folders
+
+
+def apply_deltas(deltas):
+    """
+    Apply per-folder `[size, files, folders]` deltas, e.g. collected with
+    add_to_chain(), with one UPDATE per distinct delta rather than per folder.
+    """
+    groups = defaultdict(list)
+    for folder_id, delta in deltas.items():
+        if any(delta):
+            groups[tuple(delta)].append(folder_id)
+    for (size, files, folders), folder_ids in groups.items():
+        _apply(folder_ids, None, size, files, folders)
+    _invalidate([folder_id for folder_ids in groups.values() for folder_id in folder_ids])
+
+
+def new_deltas():
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def folder_chain(folder_id):
+    if not folder_id:
+        return []
+    row = Folder.all_objects.filter(pk=folder_id).values_list('path', flat=True).first()
+    return [] if row is None else chain(row, folder_id)
+
+
+def quota_for(quota_bytes):
+    return quota_bytes if quota_bytes is not None else getattr(settings, 'DEFAULT_USER_QUOTA_BYTES', None)
+
+
+def check_quota(user_id, additional_bytes):
+    """O(1): compares the user's running total against their quota."""
+    row = User.objects.filter(pk=user_id).values_list('usage__total_bytes', 'quota_bytes').first()
+    if row is None:
+        return
+    total_bytes, quota_bytes = row
+    quota = quota_for(quota_bytes)
+    if quota is not None and (total_bytes or 0) + additional_bytes > quota:
+        raise QuotaExceeded(f'Storing {additional_bytes} more bytes would exceed the quota of {quota} bytes.')
+
+
+def _deleted_with_user(origin):
+    return isinstance(origin, User)
+
+
+def _is_top_of_delete(instance, origin):
+    """Whether `instance` is the highest folder removed by this delete."""
+    if isinstance(origin, Folder):
+        return origin.pk == instance.pk
+    if hasattr(origin, 'model') and origin.model is Folder:
+        if origin not in _deleting:
+            _deleting[origin] = set(origin.values_list('pk', flat=True))
+        return not set(instance.ancestor_ids) & _deleting[origin]
+    return False
+
+
+def retained_bytes(files):
+    """Bytes the older versions of `files` hold besides their current content."""
+    sizes = {file.pk: file.size for file in files}
+    if not sizes:
+        return 0
+    rows = FileVersion.objects.filter(file__in=sizes).values('file_id').annotate(total=Sum('size'))
+    # The newest version is always the current content.
+    return sum(row['total'] - sizes[row['file_id']] for row in rows)
+
+
+def file_created(file):
+    apply(folder_chain(file.folder_id), file.owner_id, size=file.size, files=1)
+
+
+def file_changed(file, old_folder_id, old_size):
+    if old_folder_id == file.folder_id:
+        if old_size != file.size:
+            apply(folder_chain(file.folder_id), file.owner_id, size=file.size - old_size)
+        return
+    apply(folder_chain(old_folder_id), None, size=-old_size, files=-1)
+    apply(folder_chain(file.folder_id), None, size=file.size, files=1)
+    if old_size != file.size:
+        apply([], file.owner_id, size=file.size - old_size)
+
+
+def file_deleted(file, origin):
+    if _deleted_with_user(origin):
+        return
+    # Files removed along with a folder were already subtracted from the
+    # surviving ancestors by folder_deleting(), trashed ones when trashed.
+    removed_with_folder = isinstance(origin, Folder) or getattr(origin, 'model', None) is Folder
+    folders = [] if removed_with_folder or file.trash_id else folder_chain(file.folder_id)
+    apply(folders, file.owner_id, size=-file.size, files=-1)
+    # Set by the pre_delete handler: the versions are gone by now.
+    retained = getattr(file, '_retained_bytes', 0)
+    if retained:
+        apply([], file.owner_id, size=-retained)
+
+
+def folder_created(folder):
+    apply(path_ids(folder.path), folder.owner_id, folders=1)
+
+
+def _subtree_totals(folder_pk):
+    return Folder.all_objects.values_list('total_bytes', 'file_count', 'folder_count').get(pk=folder_pk)
+
+
+def folder_moved(folder, old_path):
+    total_bytes, file_count, folder_count = _subtree_totals(folder.pk)
+    old_ancestors = path_ids(old_path)
+    new_ancestors = path_ids(folder.path)
+    common = set(old_ancestors) & set(new_ancestors)
+    apply([pk for pk in old_ancestors if pk not in common], None,
+          size=-total_bytes, files=-file_count, folders=-(folder_count + 1))
+    apply([pk for pk in new_ancestors if pk not in common], None,
+          size=total_bytes, files=file_count, folders=folder_count + 1)
+
+
+def folder_deleting(folder, origin):
+    """Run from pre_delete, while the folder's own rollups can still be read."""
+    if _deleted_with_user(origin):
+        return
+    if _is_top_of_delete(folder, origin) and not folder.trash_id:
+        total_bytes, file_count, folder_count = _subtree_totals(folder.pk)
+        apply(folder.ancestor_ids, None, size=-total_bytes, files=-file_count, folders=-(folder_count + 1))
+    apply([], folder.owner_id, folders=-1)
+
+
+def recompute(users=None):
+    """
+    Rebuild every rollup from scratch with a handful of aggregate queries
+    per user. Used to repair drift; see the recompute_rollups command.
+    Folder rollups only cover live rows, while user totals include the
+    trash until it is purged and the older versions of every file.
+    Trashed folders keep the totals they had.
+    """
+    users = User.objects.all() if users is None else users
+    for user in users.iterator():
+        folders = list(Folder.objects.filter(owner=user).only('pk', 'path', 'depth'))
+        totals = {folder.pk: [0, 0, 0] for folder in folders}
+        direct = (
+            File.objects.filter(owner=user, folder__isnull=False)
+            .values('folder_id').annotate(total=Sum('size'), files=Count('id'))
+        )
+        for row in direct:
+            if row['folder_id'] in totals:
+                totals[row['folder_id']][0] += row['total'] or 0
+                totals[row['folder_id']][1] += row['files']
+        # Deepest first, so each folder is complete before it is added to its parent.
+        for folder in sorted(folders, key=lambda folder: folder.depth, reverse=True):
+            ancestors = folder.ancestor_ids
+            if ancestors and ancestors[-1] in totals:
+                parent = totals[ancestors[-1]]
+                own = totals[folder.pk]
+                parent[0] += own[0]
+                parent[1] += own[1]
+                parent[2] += own[2] + 1
+        for folder in folders:
+            folder.total_bytes, folder.file_count, folder.folder_count = totals[folder.pk]
+        Folder.objects.bulk_update(folders, ['total_bytes', 'file_count', 'folder_count'], batch_size=1000)
+
+        owned = File.all_objects.filter(owner=user).aggregate(total=Sum('size'), files=Count('id'))
+        versioned = File.all_objects.filter(owner=user, versions__isnull=False).distinct().values('size')
+        retained = (
+            (FileVersion.objects.filter(file__owner=user).aggregate(total=Sum('size'))['total'] or 0)
+            - sum(row['size'] for row in versioned)
+        )
+        Usage.objects.update_or_create(owner=user, defaults={
+            'total_bytes': (owned['total'] or 0) + retained,
+            'file_count': owned['files'],
+            'folder_count': Folder.all_objects.filter(owner=user).count(),
+        })
@@ -0,0 +1,211 @@
+"""
+Name search over a user's files and folders.
+
+Matches are ranked: the exact name first, then names starting with the
+query, then names with a word starting with it, then any other substring;
+ties are broken by name. Results are keyset paginated on (rank, name, id).
+
+On PostgreSQL the query is answered by the indexes from migration 0010:
+trigram GIN indexes on UPPER(name) serve substring matches and
+(owner, UPPER(name)) btree indexes serve prefixes. Queries shorter than a
+trigram only match prefixes. Other databases (SQLite in tests and local
+development) use an in-process index per user instead, rebuilt whenever
+the user's tree version (see listing_cache) changes.
+"""
+import bisect
+import heapq
+import threading
+from collections import OrderedDict, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from rest_framework.exceptions import ValidationError
+
+from api.storage import listing_cache
+from api.storage.models import File, Folder
+from api.storage.pagination import decode_cursor, encode_cursor
+
+
+MIN_SUBSTRING_LENGTH = 3
+WORD_SEPARATORS = (' ', '_', '-', '.', '(', '[')
+
+
+def backend():
+    configured = getattr(settings, 'SEARCH_BACKEND', None)
+    if configured:
+        return configured
+    return 'database' if connection.vendor == 'postgresql' else 'memory'
+
+
+def rank(name, query):
+    """Python twin of the database ranking; both take upper-cased strings."""
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    if any(separator + query in name for separator in WORD_SEPARATORS):
+        return 2
+    return 3
+
+
+def search(user, query, kind='files', extensions=(), min_size=None, max_size=None,
+           modified_after=None, modified_before=None, page_size=50, cursor=None):
+    """Return one page of matching Files (or Folders for kind='folders') and the next cursor."""
+    scope = f"search:{kind}:{query.upper()}"
+    after = None
+    if cursor is not None:
+        cursor_scope, value, pk = decode_cursor(cursor)
+        if cursor_scope != scope:
+            raise ValidationError({'cursor': ['Cursor was issued for a different search.']})
+        after = (value[0], value[1], pk)
+    filters = {
+        'extensions': [f".{extension.upper()}" for extension in extensions],
+        'min_size': min_size, 'max_size': max_size,
+        'modified_after': modified_after, 'modified_before': modified_before,
+    }
+    model = Folder if kind == 'folders' else File
+    if model is Folder:
+        filters['min_size'] = filters['max_size'] = None
+    if backend() == 'database':
+        rows = _database_search(user, model, query, filters, page_size + 1, after)
+    else:
+        rows = _memory_search(user, model, query, filters, page_size + 1, after)
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(scope, [last.rank, last.name], last.pk)
+    return rows, next_cursor
+
+
+def _database_search(user, model, query, filters, limit, after):
+    queryset = model.objects.filter(owner=user)
+    if model is Folder:
+        queryset = queryset.filter(parent__isnull=False)
+    if len(query) < MIN_SUBSTRING_LENGTH:
+        queryset = queryset.filter(name__istartswith=query)
+    else:
+        queryset = queryset.filter(name__icontains=query)
+    if filters['extensions']:
+        queryset = queryset.filter(reduce(or_, (Q(name__iendswith=extension) for extension in filters['extensions'])))
+    if model is File and filters['min_size'] is not None:
+        queryset = queryset.filter(size__gte=filters['min_size'])
+    if model is File and filters['max_size'] is not None:
+        queryset = queryset.filter(size__lte=filters['max_size'])
+    if filters['modified_after'] is not None:
+        queryset = queryset.filter(updated_at__gte=filters['modified_after'])
+    if filters['modified_before'] is not None:
+        queryset = queryset.filter(updated_at__lt=filters['modified_before'])
+
+    word = reduce(or_, (Q(name__icontains=separator + query) for separator in WORD_SEPARATORS))
+    queryset = queryset.annotate(rank=Case(
+        When(name__iexact=query, then=Value(0)),
+        When(name__istartswith=query, then=Value(1)),
+        When(word, then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    ))
+    if after is not None:
+        after_rank, after_name, after_pk = after
+        queryset = queryset.filter(
+            Q(rank__gt=after_rank) | Q(rank=after_rank, name__gt=after_name) | Q(rank=after_rank, name=after_name, pk__gt=after_pk)
+        )
+    return list(queryset.order_by('rank', 'name', 'pk')[:limit])
+
+
+class MemoryIndex:
+    """
+    One user's names: trigram postings for substring queries and a sorted
+    list for prefix queries, with the columns the filters need.
+    """
+
+    def __init__(self, rows):
+        self.rows = {}
+        self.sorted_names = []
+        self.trigrams = defaultdict(set)
+        for pk, name, size, updated_at in rows:
+            upper = name.upper()
+            self.rows[pk] = (name, upper, size, updated_at)
+            self.sorted_names.append((upper, pk))
+            for start in range(len(upper) - 2):
+                self.trigrams[upper[start:start + 3]].add(pk)
+        self.sorted_names.sort()
+
+    def candidates(self, query):
+        if len(query) < MIN_SUBSTRING_LENGTH:
+            start = bisect.bisect_left(self.sorted_names, (query,))
+            matches = []
+            for upper, pk in self.sorted_names[start:]:
+                if not upper.startswith(query):
+                    break
+                matches.append(pk)
+            return matches
+        postings = sorted((self.trigrams.get(query[start:start + 3], set()) for start in range(len(query) - 2)), key=len)
+        matches = set.intersection(*postings) if postings else set()
+        return [pk for pk in matches if query in self.rows[pk][1]]
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _max_indexes():
+    return getattr(settings, 'SEARCH_MEMORY_INDEXES', 32)
+
+
+def memory_index(user, model):
+    key = (user.pk, model.__name__)
+    version = listing_cache.tree_version(user.pk)
+    with _lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(key)
+            return cached[1]
+    queryset = model.objects.filter(owner=user)
+    if model is Folder:
+        rows = (
+            (pk, name, None, updated_at) for pk, name, updated_at in
+            queryset.filter(parent__isnull=False).values_list('pk', 'name', 'updated_at').iterator()
+        )
+    else:
+        rows = queryset.values_list('pk', 'name', 'size', 'updated_at').iterator()
+    index = MemoryIndex(rows)
+    with _lock:
+        _indexes[key] = (version, index)
+        _indexes.move_to_end(key)
+        while len(_indexes) > _max_indexes():
+            _indexes.popitem(last=False)
+    return index
+
+
+def _memory_search(user, model, query, filters, limit, after):
+    index = memory_index(user, model)
+    query = query.upper()
+    ranked = []
+    for pk in index.candidates(query):
+        name, upper, size, updated_at = index.rows[pk]
+        if filters['extensions'] and not upper.endswith(tuple(filters['extensions'])):
+            continue
+        if filters['min_size'] is not None and size < filters['min_size']:
+            continue
+        if filters['max_size'] is not None and size > filters['max_size']:
+            continue
+        if filters['modified_after'] is not None and updated_at < filters['modified_after']:
+            continue
+        if filters['modified_before'] is not None and updated_at >= filters['modified_before']:
+            continue
+        key = (rank(upper, query), name, pk)
+        if after is None or key > after:
+            ranked.append(key)
+    ranked = heapq.nsmallest(limit, ranked)
+    objects = model.objects.in_bulk([pk for _, _, pk in ranked])
+    rows = []
+    for row_rank, _, pk in ranked:
+        if pk in objects:
+            objects[pk].rank = row_rank
+            rows.append(objects[pk])
+    return rows
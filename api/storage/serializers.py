@@ -1,14 +1,37 @@
+from django.conf import settings
+from django.urls import reverse
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
-from api.storage.models import File, Folder
+from api.metrics import recorder
+from api.storage.models import Change, File, FileVersion, Folder, TrashEntry, UploadSession
+from api.storage import rollups, uploads
+from api.storage.rows import RowSerializer, select
+from api.storage.pagination import KeysetPagination
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class MeteredMixin:
+    """Counts building the representation as serialization time in the request metrics."""
+
+    def to_representation(self, instance):
+        with recorder.timed('serialize'):
+            return super().to_representation(instance)
+
+
+class UserSerializer(MeteredMixin, serializers.ModelSerializer):
+    total_bytes = serializers.IntegerField(source="usage.total_bytes", read_only=True)
+    file_count = serializers.IntegerField(source="usage.file_count", read_only=True)
+    folder_count = serializers.IntegerField(source="usage.folder_count", read_only=True)
+    quota_bytes = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ["uuid", "username", "email", "date_joined"]
+        fields = ["uuid", "username", "email", "date_joined", "total_bytes", "file_count", "folder_count", "quota_bytes"]
+
+    def get_quota_bytes(self, obj) -> int | None:
+        return rollups.quota_for(obj.quota_bytes)
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -28,29 +51,317 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class FileSerializer(serializers.ModelSerializer):
+def download_urls(context):
+    """download_url for RowSerializer: the URL is reversed once and the uuid spliced in per row."""
+    placeholder = "00000000-0000-0000-0000-000000000000"
+    url = reverse("file-download", kwargs={"uuid": placeholder})
+    request = context.get("request")
+    prefix, suffix = (request.build_absolute_uri(url) if request else url).split(placeholder)
+
+    def download_url(uuid, file, blob):
+        if not file and not blob:
+            return None
+        return f"{prefix}{uuid}{suffix}"
+    return download_url
+
+
+class FileSerializer(MeteredMixin, serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    row_methods = {"download_url": (("uuid", "file", "blob"), download_urls)}
+
     class Meta:
         model = File
-        fields = ["uuid", "name", "file", "folder", "owner", "created_at", "updated_at"]
-        read_only_fields = ["uuid", "owner", "created_at"]
+        fields = ["uuid", "name", "file", "download_url", "size", "folder", "owner", "created_at", "updated_at"]
+        read_only_fields = ["uuid", "size", "owner", "created_at"]
+
+    def get_download_url(self, obj):
+        if not obj.file and not obj.blob_id:
+            return None
+        url = reverse("file-download", kwargs={"uuid": obj.uuid})
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
 
 
-class SubfolderSerializer(serializers.ModelSerializer):
+class SubfolderSerializer(MeteredMixin, serializers.ModelSerializer):
     class Meta:
         model = Folder
-        fields = ["uuid", "name", "created_at", "updated_at"]
+        fields = ["uuid", "name", "total_bytes", "created_at", "updated_at"]
         read_only_fields = ["uuid", "created_at"]
 
 
-class FolderSerializer(serializers.ModelSerializer):
-    subfolders = SubfolderSerializer(many=True, read_only=True)
-    files = FileSerializer(many=True, read_only=True)
-    owner = serializers.UUIDField(source="owner.uuid", read_only=True)
+class FolderSerializer(MeteredMixin, serializers.ModelSerializer):
+    """
+    Folder detail. Children are not listed in full: the response carries the
+    first page of each kind, the cursors to continue from and the counts.
+    The rest is served by FolderViewSet.children.
+    """
+    subfolders = serializers.SerializerMethodField()
+    files = serializers.SerializerMethodField()
+    subfolder_count = serializers.SerializerMethodField()
+    file_count = serializers.SerializerMethodField()
+    subfolders_next = serializers.SerializerMethodField()
+    files_next = serializers.SerializerMethodField()
+    total_file_count = serializers.IntegerField(source="file_count", read_only=True)
+    total_folder_count = serializers.IntegerField(source="folder_count", read_only=True)
+    owner = serializers.UUIDField(source="owner_id", read_only=True)
 
     class Meta:
         model = Folder
-        fields = ["uuid", "name", "parent", "subfolders", "files", "owner", "created_at", "updated_at"]
+        fields = [
+            "uuid", "name", "parent", "subfolders", "files", "subfolder_count", "file_count",
+            "subfolders_next", "files_next", "total_bytes", "total_file_count", "total_folder_count",
+            "owner", "created_at", "updated_at",
+        ]
         read_only_fields = ["uuid", "owner", "created_at"]
+        extra_kwargs = {"parent": {"required": False}}
+
+    def _listing(self, obj):
+        cache = self.__dict__.setdefault("_listing_cache", {})
+        if obj.pk not in cache:
+            paginator = KeysetPagination()
+            subfolders, subfolders_next = paginator.paginate(self.subfolder_rows(obj), "name", paginator.page_size)
+            files, files_next = paginator.paginate(self.file_rows(obj), "name", paginator.page_size)
+            cache[obj.pk] = self.listing(
+                subfolders, subfolders_next, obj.subfolders.count(), files, files_next, obj.files.count()
+            )
+        return cache[obj.pk]
+
+    def subfolder_rows(self, obj):
+        return select(SubfolderSerializer, obj.subfolders.all())
+
+    def file_rows(self, obj):
+        return select(FileSerializer, obj.files.all())
 
+    def listing(self, subfolders, subfolders_next, subfolder_count, files, files_next, file_count):
+        """The children part of the representation, from pages of subfolder_rows() and file_rows()."""
+        layout = self.context.get("layout", "rows")
+        return {
+            "subfolders": RowSerializer(SubfolderSerializer, self.context).data(subfolders, layout),
+            "files": RowSerializer(FileSerializer, self.context).data(files, layout),
+            "subfolders_next": subfolders_next,
+            "files_next": files_next,
+            "subfolder_count": subfolder_count,
+            "file_count": file_count,
+        }
+
+    def prime_listing(self, obj, listing):
+        """Supply the first pages and counts up front, e.g. when they were fetched with the async ORM."""
+        self.__dict__.setdefault("_listing_cache", {})[obj.pk] = listing
+
+    @extend_schema_field(SubfolderSerializer(many=True))
     def get_subfolders(self, obj):
-        return FolderSerializer(obj.subfolders.all(), many=True).data
+        return self._listing(obj)["subfolders"]
+
+    @extend_schema_field(FileSerializer(many=True))
+    def get_files(self, obj):
+        return self._listing(obj)["files"]
+
+    def get_subfolders_next(self, obj) -> str | None:
+        return self._listing(obj)["subfolders_next"]
+
+    def get_files_next(self, obj) -> str | None:
+        return self._listing(obj)["files_next"]
+
+    def get_subfolder_count(self, obj) -> int:
+        return self._listing(obj)["subfolder_count"]
+
+    def get_file_count(self, obj) -> int:
+        return self._listing(obj)["file_count"]
+
+    def validate_name(self, value):
+        if "/" in value:
+            raise serializers.ValidationError("Folder names cannot contain '/'.")
+        return value
+
+    def validate_parent(self, value):
+        if value is None:
+            if self.instance is not None and self.instance.parent_id is None:
+                return None
+            raise serializers.ValidationError("Only the root folder has no parent.")
+        if value.owner_id != self.context["request"].user.pk:
+            raise serializers.ValidationError("Folder not found.")
+        if self.instance is not None:
+            if self.instance.parent_id is None:
+                raise serializers.ValidationError("The root folder cannot be moved.")
+            if value.is_in_subtree_of(self.instance):
+                raise serializers.ValidationError("A folder cannot be moved into itself or one of its subfolders.")
+        return value
+
+
+class FolderNodeSerializer(MeteredMixin, serializers.ModelSerializer):
+    parent = serializers.UUIDField(source="parent_id", read_only=True)
+
+    class Meta:
+        model = Folder
+        fields = ["uuid", "name", "parent", "depth", "total_bytes", "file_count", "folder_count", "created_at", "updated_at"]
+        read_only_fields = fields
+
+
+class TrashEntrySerializer(MeteredMixin, serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TrashEntry
+        fields = [
+            "uuid", "kind", "name", "item_uuid", "status", "trashed_at", "purge_after", "purged_at",
+            "total_bytes", "total_files", "total_folders", "purged_bytes", "purged_files", "purged_folders", "progress",
+        ]
+        read_only_fields = fields
+
+    def get_progress(self, obj) -> float:
+        """Share of the entry's rows the purge worker has removed so far."""
+        if obj.status == TrashEntry.STATUS_PURGED:
+            return 1.0
+        total = obj.total_files + obj.total_folders
+        return round((obj.purged_files + obj.purged_folders) / total, 4) if total else 0.0
+
+
+class SearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=255)
+    type = serializers.ChoiceField(choices=["files", "folders"], default="files")
+    ext = serializers.CharField(required=False, help_text="Comma separated extensions, e.g. pdf,docx")
+    min_size = serializers.IntegerField(required=False, min_value=0)
+    max_size = serializers.IntegerField(required=False, min_value=0)
+    modified_after = serializers.DateTimeField(required=False)
+    modified_before = serializers.DateTimeField(required=False)
+    page_size = serializers.IntegerField(required=False, min_value=1)
+    cursor = serializers.CharField(required=False)
+
+    def validate_ext(self, value):
+        return [extension.strip().lstrip(".") for extension in value.split(",") if extension.strip().lstrip(".")]
+
+    def validate_page_size(self, value):
+        return min(value, getattr(settings, "SEARCH_MAX_PAGE_SIZE", 200))
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    cursor = serializers.IntegerField(required=False, min_value=0)
+    page_size = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_page_size(self, value):
+        return min(value, getattr(settings, "CHANGES_MAX_PAGE_SIZE", 1000))
+
+
+class ChangeSerializer(MeteredMixin, serializers.ModelSerializer):
+    type = serializers.CharField(source="kind")
+    uuid = serializers.UUIDField(source="item_uuid")
+    parent = serializers.UUIDField(source="parent_uuid")
+    at = serializers.DateTimeField(source="created_at")
+
+    class Meta:
+        model = Change
+        fields = ["seq", "type", "action", "uuid", "parent", "name", "size", "at"]
+
+
+class BatchSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    folders = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    target = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        count = len(attrs["files"]) + len(attrs["folders"])
+        if not count:
+            raise serializers.ValidationError("Select at least one file or folder.")
+        limit = getattr(settings, "BATCH_MAX_ITEMS", 10000)
+        if count > limit:
+            raise serializers.ValidationError(f"A batch may contain at most {limit} items.")
+        return attrs
+
+
+class UploadSessionSerializer(MeteredMixin, serializers.ModelSerializer):
+    folder = serializers.SlugRelatedField(slug_field="uuid", queryset=Folder.objects.all(), required=False, allow_null=True)
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+    missing_chunks = serializers.SerializerMethodField()
+    offset = serializers.SerializerMethodField()
+    file = FileSerializer(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "uuid", "name", "folder", "size", "sha256", "chunk_size", "chunk_count", "status",
+            "received_chunks", "missing_chunks", "offset", "file", "created_at", "updated_at",
+        ]
+        read_only_fields = ["uuid", "status", "file", "created_at", "updated_at"]
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Size must not be negative.")
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and (len(value) != 64 or any(c not in "0123456789abcdef" for c in value)):
+            raise serializers.ValidationError("Expected a hex encoded SHA-256 digest.")
+        return value
+
+    def validate_chunk_size(self, value):
+        limit = getattr(settings, "UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024)
+        if value > limit:
+            raise serializers.ValidationError(f"Chunk size must not exceed {limit} bytes.")
+        return value
+
+    def validate_folder(self, value):
+        if value is not None and value.owner_id != self.context["request"].user.pk:
+            raise serializers.ValidationError("Folder not found.")
+        return value
+
+    def validate(self, attrs):
+        size = attrs.get("size", 0)
+        chunk_size = attrs.get("chunk_size") or uploads.default_chunk_size()
+        if chunk_size < min(uploads.min_chunk_size(), size):
+            raise serializers.ValidationError({
+                "chunk_size": f"Chunk size must be at least {uploads.min_chunk_size()} bytes.",
+            })
+        if -(-size // chunk_size) > uploads.max_chunks():
+            raise serializers.ValidationError({
+                "chunk_size": f"An upload may have at most {uploads.max_chunks()} chunks; use larger ones.",
+            })
+        return attrs
+
+    def _received(self, obj):
+        return {chunk.index for chunk in obj.chunks.all()}
+
+    def get_received_chunks(self, obj):
+        return sorted(self._received(obj))
+
+    def get_missing_chunks(self, obj):
+        return uploads.missing_chunks(obj, self._received(obj))
+
+    def get_offset(self, obj):
+        index = uploads.first_missing(obj, self._received(obj))
+        return obj.size if index is None else index * obj.chunk_size
+
+
+class FileVersionSerializer(MeteredMixin, serializers.ModelSerializer):
+    chunked = serializers.BooleanField(source="blob.chunked", read_only=True)
+
+    class Meta:
+        model = FileVersion
+        fields = ["number", "size", "chunked", "created_by", "created_at"]
+
+
+class ManifestChunkSerializer(serializers.Serializer):
+    sha256 = serializers.RegexField(r"^[0-9a-f]{64}$")
+    size = serializers.IntegerField(min_value=1)
+
+
+class ManifestSerializer(serializers.Serializer):
+    chunks = ManifestChunkSerializer(many=True, allow_empty=True)
+
+    def validate_chunks(self, value):
+        limit = getattr(settings, "VERSION_MAX_CHUNKS", 100000)
+        if len(value) > limit:
+            raise serializers.ValidationError(f"A manifest has at most {limit} chunks.")
+        return [(chunk["sha256"], chunk["size"]) for chunk in value]
+
+
+class PruneVersionsSerializer(serializers.Serializer):
+    keep = serializers.IntegerField(required=False, min_value=1)
+    numbers = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+    def validate(self, attrs):
+        if "keep" not in attrs and "numbers" not in attrs:
+            raise serializers.ValidationError("Give `keep` or `numbers`.")
+        return attrs
@@ -0,0 +1,105 @@
+"""
+Local storage laid out for millions of objects.
+
+Names given to save() that are not sharded yet (`files/report.pdf`) become
+`files/ab/cd/<uuid>.pdf`, so no directory grows past a few thousand entries
+and names never collide. Names that already carry two levels of hex shards
+(`blobs/ab/cd/<sha256>`, `uploads/ab/cd/<uuid>/000001`) are kept, so the
+callers that derive names themselves can still find their objects.
+
+Writes go to a temporary file in the target directory that is hard-linked
+into place once complete, so readers never see a partial object and an
+existing object is never replaced. MEDIA_FSYNC picks what is flushed to disk
+before save() returns: 'none', 'file' (the data) or 'full' (the data and the
+directory entry, so the object survives a power cut).
+
+`manage.py reshard_media` moves objects stored under the flat layout.
+"""
+import os
+import posixpath
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+SHARDED = re.compile(r'^(?:[^/]+/)*[0-9a-f]{2}/[0-9a-f]{2}/[^/]+')
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+
+def is_sharded(name):
+    return bool(SHARDED.match(name))
+
+
+def shard(name):
+    """A fresh sharded name in the same top-level directory, keeping the extension."""
+    directory, basename = posixpath.split(name)
+    key = uuid.uuid4().hex
+    return posixpath.join(directory, key[:2], key[2:4], key + posixpath.splitext(basename)[1].lower())
+
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    def __init__(self, fsync=None, **kwargs):
+        super().__init__(**kwargs)
+        self._fsync = fsync
+
+    @property
+    def fsync(self):
+        policy = self._fsync or getattr(settings, 'MEDIA_FSYNC', 'file')
+        if policy not in FSYNC_POLICIES:
+            raise ValueError(f"MEDIA_FSYNC must be one of {', '.join(FSYNC_POLICIES)}.")
+        return policy
+
+    def get_available_name(self, name, max_length=None):
+        if not is_sharded(name):
+            name = shard(name)
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    temp.write(chunk)
+                temp.flush()
+                if self.fsync != 'none':
+                    os.fsync(temp.fileno())
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            while True:
+                try:
+                    # Unlike rename, link refuses to replace an object that appeared meanwhile.
+                    os.link(temp_path, full_path)
+                    break
+                except FileExistsError:
+                    name = self.get_available_name(name)
+                    full_path = self.path(name)
+        finally:
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+        if self.fsync == 'full':
+            fsync_directory(os.path.dirname(full_path))
+        return str(name).replace('\\', '/')
@@ -0,0 +1,191 @@
+import functools
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from api.storage import blobs, journal, listing_cache, rollups
+from api.storage.models import Change, File, FileVersion, Folder
+
+
+_state = threading.local()
+
+
+@contextmanager
+def muted():
+    """
+    Silence the bookkeeping handlers below. Batch operations use this and
+    update blob references, rollups and listing caches in aggregate instead.
+    """
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def unless_muted(handler):
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not getattr(_state, 'muted', False):
+            handler(*args, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=File)
+@unless_muted
+def track_blob_reference(sender, instance, created, update_fields=None, **kwargs):
+    previous = None if created else getattr(instance, '_loaded_blob_id', None)
+    if previous is DEFERRED or (update_fields is not None and 'blob' not in update_fields):
+        return
+    if instance.blob_id != previous:
+        if instance.blob_id:
+            blobs.add_reference(instance.blob_id)
+        if previous:
+            blobs.release_reference(previous)
+
+
+@receiver(post_delete, sender=File)
+@unless_muted
+def release_blob_reference(sender, instance, **kwargs):
+    if instance.blob_id:
+        blobs.release_reference(instance.blob_id)
+
+
+@receiver(post_delete, sender=FileVersion)
+@unless_muted
+def release_version_blob_reference(sender, instance, **kwargs):
+    blobs.release_reference(instance.blob_id)
+
+
+@receiver(post_save, sender=File)
+@unless_muted
+def update_file_rollups(sender, instance, created, **kwargs):
+    if created:
+        rollups.file_created(instance)
+        return
+    old_folder_id = getattr(instance, '_loaded_folder_id', DEFERRED)
+    old_size = getattr(instance, '_loaded_size', DEFERRED)
+    if old_folder_id is not DEFERRED and old_size is not DEFERRED:
+        rollups.file_changed(instance, old_folder_id, old_size)
+
+
+@receiver(pre_delete, sender=File)
+@unless_muted
+def measure_deleted_file_versions(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_user(origin):
+        instance._retained_bytes = rollups.retained_bytes([instance])
+
+
+@receiver(post_delete, sender=File)
+@unless_muted
+def update_deleted_file_rollups(sender, instance, origin=None, **kwargs):
+    rollups.file_deleted(instance, origin)
+
+
+@receiver(post_save, sender=Folder)
+@unless_muted
+def update_folder_rollups(sender, instance, created, **kwargs):
+    if created:
+        rollups.folder_created(instance)
+    elif getattr(instance, '_moved_from_path', None) is not None:
+        rollups.folder_moved(instance, instance._moved_from_path)
+
+
+@receiver(pre_delete, sender=Folder)
+@unless_muted
+def update_deleted_folder_rollups(sender, instance, origin=None, **kwargs):
+    rollups.folder_deleting(instance, origin)
+
+
+def _folder_uuids(*folder_ids):
+    folder_ids = {pk for pk in folder_ids if pk and pk is not DEFERRED}
+    if not folder_ids:
+        return []
+    return list(Folder.objects.filter(pk__in=folder_ids).values_list('uuid', flat=True))
+
+
+@receiver(post_save, sender=Folder)
+@unless_muted
+def invalidate_folder_listings(sender, instance, created, **kwargs):
+    previous_parent = getattr(instance, '_loaded_parent_id', None)
+    parents = {instance.parent_id, None if previous_parent is DEFERRED else previous_parent}
+    listing_cache.invalidate([instance.uuid, *parents], [instance.owner_id])
+
+
+@receiver(post_delete, sender=Folder)
+@unless_muted
+def invalidate_deleted_folder_listings(sender, instance, **kwargs):
+    listing_cache.invalidate([instance.uuid, instance.parent_id], [instance.owner_id])
+
+
+@receiver(post_save, sender=File)
+@unless_muted
+def invalidate_file_listings(sender, instance, created, **kwargs):
+    previous_folder = None if created else getattr(instance, '_loaded_folder_id', None)
+    listing_cache.invalidate(_folder_uuids(instance.folder_id, previous_folder), [instance.owner_id])
+
+
+@receiver(post_delete, sender=File)
+@unless_muted
+def invalidate_deleted_file_listings(sender, instance, **kwargs):
+    listing_cache.invalidate(_folder_uuids(instance.folder_id), [instance.owner_id])
+
+
+def _deleted_with_user(origin):
+    return isinstance(origin, get_user_model())
+
+
+@receiver(post_save, sender=Folder)
+@unless_muted
+def journal_folder_saved(sender, instance, created, **kwargs):
+    if created:
+        action = Change.ACTION_CREATED
+    elif getattr(instance, '_moved_from_path', None) is not None:
+        action = Change.ACTION_MOVED
+    else:
+        action = Change.ACTION_UPDATED
+    journal.record_folders([instance], action)
+
+
+@receiver(post_delete, sender=Folder)
+@unless_muted
+def journal_folder_deleted(sender, instance, origin=None, **kwargs):
+    if not instance.trash_id and not _deleted_with_user(origin):
+        journal.record_folders([instance], Change.ACTION_DELETED)
+
+
+@receiver(post_save, sender=File)
+@unless_muted
+def journal_file_saved(sender, instance, created, **kwargs):
+    previous_folder = getattr(instance, '_loaded_folder_id', DEFERRED)
+    if created:
+        action = Change.ACTION_CREATED
+    elif previous_folder is not DEFERRED and previous_folder != instance.folder_id:
+        action = Change.ACTION_MOVED
+    else:
+        action = Change.ACTION_UPDATED
+    journal.record_files([instance], action)
+
+
+@receiver(post_delete, sender=File)
+@unless_muted
+def journal_file_deleted(sender, instance, origin=None, **kwargs):
+    # Trashed files were recorded as deleted when trashed, and files going
+    # with their folder are covered by the folder's entry.
+    removed_with_folder = isinstance(origin, Folder) or getattr(origin, 'model', None) is Folder
+    if not instance.trash_id and not removed_with_folder and not _deleted_with_user(origin):
+        journal.record_files([instance], Change.ACTION_DELETED)
+
+
+# Connected last: the handlers above compare against the loaded state.
+@receiver(post_save, sender=File)
+def remember_loaded_state(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'blob' in update_fields:
+        instance._loaded_blob_id = instance.blob_id
+    instance._loaded_folder_id = instance.folder_id
+    instance._loaded_size = instance.size
@@ -0,0 +1,236 @@
+"""
+Thumbnails and previews, rendered once per blob.
+
+Derivatives belong to a Blob, not a File, so every file with the same
+content shares them, and they are deleted along with the blob. Rendering
+happens off the request path. A small thread pool takes the jobs and hands
+the CPU-heavy part (api.storage.imaging) to a process pool. Requests only
+wait briefly (THUMBNAIL_WAIT_SECONDS) for a thumbnail that does not exist
+yet. With THUMBNAIL_WORKERS = 0 rendering runs inline in the caller, which
+is what tests use.
+"""
+import base64
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, close_old_connections, transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from api.storage import imaging
+from api.storage.blobs import get_storage, open_blob
+from api.storage.models import Blob, Derivative
+
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png'}
+
+_lock = threading.Lock()
+_processes = None
+_threads = None
+_pending = {}
+
+
+def sizes():
+    return getattr(settings, 'THUMBNAIL_SIZES', {'small': 128, 'medium': 256, 'large': 512})
+
+
+def _workers():
+    return getattr(settings, 'THUMBNAIL_WORKERS', 2)
+
+
+def derivative_name(sha256, variant, content_type):
+    return f"derivatives/{sha256[:2]}/{sha256[2:4]}/{sha256}-{variant}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def _pools():
+    global _processes, _threads
+    with _lock:
+        if _processes is None:
+            # Spawned, not forked: workers only import api.storage.imaging,
+            # never Django, and inherit no database connections.
+            _processes = ProcessPoolExecutor(_workers(), mp_context=multiprocessing.get_context('spawn'))
+            _threads = ThreadPoolExecutor(_workers(), thread_name_prefix='thumbnails')
+    return _processes, _threads
+
+
+def _source(blob):
+    """
+    A local path the worker can open itself, or the bytes when storage has no
+    paths or the blob is chunked or compressed. None, after reading only the
+    first few bytes, for content imaging cannot render.
+    """
+    with open_blob(blob) as handle:
+        if not imaging.renderable(handle.read(imaging.PREFIX_BYTES)):
+            return None
+        if not blob.chunked and not blob.codec:
+            try:
+                return get_storage().path(blob.file.name)
+            except NotImplementedError:
+                pass
+        handle.seek(0)
+        return handle.read()
+
+
+def _render(blob):
+    source = _source(blob)
+    if source is None:
+        return None
+    if _workers() == 0:
+        return imaging.render(source, sizes())
+    processes, _ = _pools()
+    return processes.submit(imaging.render, source, sizes()).result()
+
+
+def _record(blob, variant, status, **fields):
+    try:
+        with transaction.atomic():
+            Derivative.objects.update_or_create(blob=blob, variant=variant, defaults={'status': status, **fields})
+    except IntegrityError:
+        # Rendered concurrently by another process; theirs is as good as ours.
+        pass
+
+
+def generate(blob):
+    """Render and store every missing derivative of `blob`."""
+    done = set(Derivative.objects.filter(blob=blob).values_list('variant', flat=True))
+    if done >= set(sizes()):
+        return
+    max_bytes = getattr(settings, 'THUMBNAIL_MAX_SOURCE_BYTES', 64 * 1024 * 1024)
+    if blob.size > max_bytes:
+        for variant in sizes():
+            _record(blob, variant, Derivative.STATUS_UNSUPPORTED)
+        return
+    try:
+        rendered = _render(blob)
+    except Exception:
+        logger.exception("Rendering derivatives of blob %s failed", blob.sha256)
+        for variant in sizes():
+            _record(blob, variant, Derivative.STATUS_FAILED)
+        return
+    storage = get_storage()
+    for variant in sizes():
+        if rendered is None:
+            _record(blob, variant, Derivative.STATUS_UNSUPPORTED)
+            continue
+        data, content_type, width, height = rendered[variant]
+        name = derivative_name(blob.sha256, variant, content_type)
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(data))
+        _record(blob, variant, Derivative.STATUS_READY, file=name, content_type=content_type,
+                width=width, height=height, size=len(data))
+
+
+def _generate_in_background(blob_id):
+    close_old_connections()
+    try:
+        blob = Blob.objects.filter(pk=blob_id).first()
+        if blob is not None:
+            generate(blob)
+    finally:
+        with _lock:
+            _pending.pop(blob_id, None)
+        close_old_connections()
+
+
+def schedule(blob_id):
+    """Queue rendering of a blob's derivatives; returns a Future. Jobs for the same blob are shared."""
+    if _workers() == 0:
+        future = Future()
+        blob = Blob.objects.filter(pk=blob_id).first()
+        if blob is not None:
+            generate(blob)
+        future.set_result(None)
+        return future
+    _, threads = _pools()
+    with _lock:
+        future = _pending.get(blob_id)
+        if future is None:
+            future = _pending[blob_id] = threads.submit(_generate_in_background, blob_id)
+    return future
+
+
+def schedule_on_commit(blob_id):
+    if getattr(settings, 'THUMBNAIL_ON_UPLOAD', True):
+        transaction.on_commit(lambda: schedule(blob_id))
+
+
+def get(blob_id, variant, wait=0):
+    """
+    The derivative of `blob_id`, rendering it if needed and waiting up to
+    `wait` seconds for that. Returns None while it is still being rendered.
+    """
+    derivative = Derivative.objects.filter(blob_id=blob_id, variant=variant).first()
+    if derivative is not None:
+        return derivative
+    future = schedule(blob_id)
+    try:
+        future.result(timeout=wait)
+    except FutureTimeout:
+        return None
+    return Derivative.objects.filter(blob_id=blob_id, variant=variant).first()
+
+
+def lookup(blob_ids, variant):
+    """Derivatives of many blobs in one query. Missing ones are scheduled and reported as pending."""
+    blob_ids = set(blob_ids)
+    derivatives = {
+        derivative.blob_id: derivative
+        for derivative in Derivative.objects.filter(blob_id__in=blob_ids, variant=variant)
+    }
+    missing = blob_ids - set(derivatives)
+    for blob_id in missing:
+        schedule(blob_id)
+    if missing and _workers() == 0:
+        derivatives.update(
+            (derivative.blob_id, derivative)
+            for derivative in Derivative.objects.filter(blob_id__in=missing, variant=variant)
+        )
+    return derivatives
+
+
+def cache_control():
+    # Derivatives never change: a new upload is a new blob, so a new URL's ETag.
+    return f"private, max-age={getattr(settings, 'THUMBNAIL_CACHE_SECONDS', 365 * 24 * 3600)}, immutable"
+
+
+def etag(derivative):
+    return quote_etag(f"{derivative.blob_id}-{derivative.variant}")
+
+
+def read(derivative):
+    with get_storage().open(derivative.file.name, 'rb') as handle:
+        return handle.read()
+
+
+def build_response(request, derivative):
+    tag = etag(derivative)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and tag in parse_etags(if_none_match):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(read(derivative), content_type=derivative.content_type)
+    response['ETag'] = tag
+    response['Cache-Control'] = cache_control()
+    return response
+
+
+def describe(file, derivative, include_data=False):
+    """A file's thumbnail state for batch responses, optionally with the image inlined as base64."""
+    if not file.blob_id:
+        return {'uuid': str(file.uuid), 'status': Derivative.STATUS_UNSUPPORTED}
+    if derivative is None:
+        return {'uuid': str(file.uuid), 'status': 'pending'}
+    item = {'uuid': str(file.uuid), 'status': derivative.status}
+    if derivative.status == Derivative.STATUS_READY:
+        item.update(etag=etag(derivative), content_type=derivative.content_type,
+                    width=derivative.width, height=derivative.height)
+        if include_data:
+            item['data'] = base64.b64encode(read(derivative)).decode()
+    return item
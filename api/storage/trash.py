@@ -0,0 +1,251 @@
+"""
+Trash: soft delete with a background purge.
+
+Deleting a file or folder only points it, and everything below it, at a new
+TrashEntry. That is a few set-based UPDATEs however large the tree is.
+Trashed rows are hidden by the default managers and leave their folders'
+rollups at once, but keep counting towards the owner's quota until purged.
+Entries already in the trash below a newly trashed folder are merged into
+the new entry, so every trashed row belongs to exactly one tree.
+
+`manage.py purge_trash` runs the purge worker. It deletes due entries in
+bounded batches, files first and then folders deepest first, and releases
+their blobs so unreferenced storage objects are removed. Each batch updates
+the entry's counters, which the trash API reports as progress.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from api.storage import blobs, journal, listing_cache, rollups, signals, uploads
+from api.storage.models import Change, File, FileVersion, Folder, TrashEntry, UploadSession
+
+
+def _purge_after():
+    return timezone.now() + timedelta(days=getattr(settings, 'TRASH_RETENTION_DAYS', 30))
+
+
+def _batch_size():
+    return getattr(settings, 'TRASH_PURGE_BATCH_SIZE', 500)
+
+
+def _folder_uuids(folder_ids):
+    return list(Folder.all_objects.filter(pk__in={pk for pk in folder_ids if pk}).values_list('uuid', flat=True))
+
+
+def trash_files(files):
+    """Trash many files at once: one entry each, created and linked in bulk."""
+    with transaction.atomic():
+        files = list(File.objects.select_for_update().filter(pk__in=[file.pk for file in files]))
+        if not files:
+            return []
+        purge_after = _purge_after()
+        entries = [
+            TrashEntry(owner_id=file.owner_id, kind=TrashEntry.KIND_FILE, name=file.name, item_uuid=file.uuid,
+                       total_bytes=file.size, total_files=1, purge_after=purge_after)
+            for file in files
+        ]
+        TrashEntry.objects.bulk_create(entries)
+        for file, entry in zip(files, entries):
+            file.trash = entry
+        File.all_objects.bulk_update(files, ['trash'], batch_size=1000)
+
+        paths = dict(Folder.all_objects.filter(pk__in={file.folder_id for file in files}).values_list('pk', 'path'))
+        deltas = rollups.new_deltas()
+        for file in files:
+            if file.folder_id in paths:
+                rollups.add_to_chain(deltas, rollups.chain(paths[file.folder_id], file.folder_id), size=-file.size, files=-1)
+        rollups.apply_deltas(deltas)
+        journal.record_files(files, Change.ACTION_DELETED)
+        listing_cache.invalidate(_folder_uuids(paths), {file.owner_id for file in files})
+    return entries
+
+
+def trash_file(file):
+    entries = trash_files([file])
+    return entries[0] if entries else None
+
+
+def _absorb(folder, entries):
+    """
+    Merge earlier entries below `folder` into its tree: their items left the
+    rollups of the folders between them and `folder` when they were trashed,
+    so add them back there, keeping the tree's totals right for a restore.
+    """
+    for entry in entries:
+        if entry.kind == TrashEntry.KIND_FOLDER:
+            item = Folder.all_objects.filter(uuid=entry.item_uuid).first()
+            if item is not None:
+                ancestors = item.ancestor_ids
+                size, files, folders = item.total_bytes, item.file_count, item.folder_count + 1
+        else:
+            item = File.all_objects.filter(uuid=entry.item_uuid).first()
+            if item is not None:
+                ancestors = rollups.folder_chain(item.folder_id)
+                size, files, folders = item.size, 1, 0
+        if item is None or folder.pk not in ancestors:
+            continue
+        rollups.apply(ancestors[ancestors.index(folder.pk):], None, size=size, files=files, folders=folders)
+
+
+def trash_folder(folder):
+    with transaction.atomic():
+        folder = Folder.objects.select_for_update().get(pk=folder.pk)
+        if folder.parent_id is None:
+            raise ValueError("The root folder cannot be deleted.")
+        folders = Folder.all_objects.filter(Q(pk=folder.pk) | Q(path__startswith=folder.subtree_prefix))
+        files = File.all_objects.filter(Q(folder=folder) | Q(folder__path__startswith=folder.subtree_prefix))
+        nested = set(folders.exclude(trash=None).values_list('trash_id', flat=True))
+        nested |= set(files.exclude(trash=None).values_list('trash_id', flat=True))
+        nested = list(TrashEntry.objects.filter(pk__in=nested))
+        # What the ancestors lose is only what is still live; absorbed items left them already.
+        live_totals = (folder.total_bytes, folder.file_count, folder.folder_count)
+        _absorb(folder, nested)
+
+        entry = TrashEntry.objects.create(
+            owner_id=folder.owner_id, kind=TrashEntry.KIND_FOLDER, name=folder.name, item_uuid=folder.uuid,
+            purge_after=_purge_after(),
+        )
+        entry.total_folders = folders.update(trash=entry)
+        files.update(trash=entry)
+        totals = File.all_objects.filter(trash=entry).aggregate(total=Sum('size'), count=Count('id'))
+        entry.total_bytes, entry.total_files = totals['total'] or 0, totals['count']
+        entry.save(update_fields=['total_bytes', 'total_files', 'total_folders'])
+        TrashEntry.objects.filter(pk__in=[nested_entry.pk for nested_entry in nested]).delete()
+
+        total_bytes, file_count, folder_count = live_totals
+        rollups.apply(folder.ancestor_ids, None, size=-total_bytes, files=-file_count, folders=-(folder_count + 1))
+        journal.record_folders([folder], Change.ACTION_DELETED)
+        listing_cache.invalidate([folder.uuid, folder.parent_id], [folder.owner_id])
+    return entry
+
+
+def restore(entry):
+    """Put a trashed item back where it was. Its parent is always live: trashing the parent would have absorbed it."""
+    with transaction.atomic():
+        entry = TrashEntry.objects.select_for_update().get(pk=entry.pk)
+        if entry.status != TrashEntry.STATUS_TRASHED:
+            raise ValueError("This item is already being purged.")
+        Folder.all_objects.filter(trash=entry).update(trash=None)
+        File.all_objects.filter(trash=entry).update(trash=None)
+        if entry.kind == TrashEntry.KIND_FOLDER:
+            folder = Folder.objects.get(uuid=entry.item_uuid)
+            rollups.apply(folder.ancestor_ids, None, size=folder.total_bytes, files=folder.file_count,
+                          folders=folder.folder_count + 1)
+            journal.record_subtree(folder, Change.ACTION_CREATED)
+            listing_cache.invalidate([folder.uuid, folder.parent_id], [entry.owner_id])
+        else:
+            file = File.objects.get(uuid=entry.item_uuid)
+            if file.folder_id is None:
+                # Orphaned before there was a trash (migration 0009): back into the owner's root folder.
+                file.folder_id = Folder.objects.values_list('pk', flat=True).get(uuid=file.owner.root_folder_uuid)
+                File.objects.filter(pk=file.pk).update(folder_id=file.folder_id)
+            rollups.apply(rollups.folder_chain(file.folder_id), None, size=file.size, files=1)
+            journal.record_files([file], Change.ACTION_CREATED)
+            listing_cache.invalidate(_folder_uuids([file.folder_id]), [entry.owner_id])
+        entry.delete()
+
+
+def schedule_purge(entries):
+    """Make entries due right away instead of at the end of the retention period."""
+    return entries.filter(status=TrashEntry.STATUS_TRASHED).update(purge_after=timezone.now())
+
+
+def claim_due():
+    """Pick the next entry due for purging, or one a stopped worker left half done."""
+    with transaction.atomic():
+        entry = (
+            TrashEntry.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[TrashEntry.STATUS_TRASHED, TrashEntry.STATUS_PURGING], purge_after__lte=timezone.now())
+            .order_by('purge_after', 'pk')
+            .first()
+        )
+        if entry is not None and entry.status != TrashEntry.STATUS_PURGING:
+            entry.status = TrashEntry.STATUS_PURGING
+            entry.save(update_fields=['status'])
+    return entry
+
+
+def _delete_legacy_objects(names):
+    """Files stored before blobs own their object unless a copy still points at it."""
+    referenced = set(File.all_objects.filter(file__in=names).values_list('file', flat=True))
+    blobs.delete_objects([name for name in names if name not in referenced])
+
+
+def _purge_files(entry, batch_size):
+    files = list(
+        File.all_objects.select_for_update(skip_locked=True).filter(trash=entry)
+        .only('pk', 'file', 'blob_id', 'size', 'owner_id')[:batch_size]
+    )
+    if not files:
+        return 0
+    size = sum(file.size for file in files)
+    retained = rollups.retained_bytes(files)
+    legacy = [file.file.name for file in files if not file.blob_id and file.file]
+    pks = [file.pk for file in files]
+    references = Counter(file.blob_id for file in files)
+    references.update(FileVersion.objects.filter(file__in=pks).values_list('blob_id', flat=True))
+    File.all_objects.filter(pk__in=pks).delete()
+    blobs.release_references(references)
+    if legacy:
+        transaction.on_commit(lambda: _delete_legacy_objects(legacy))
+    rollups.apply([], entry.owner_id, size=-(size + retained), files=-len(files))
+    TrashEntry.objects.filter(pk=entry.pk).update(
+        purged_files=F('purged_files') + len(files), purged_bytes=F('purged_bytes') + size,
+    )
+    return len(files)
+
+
+def _purge_folders(entry, batch_size):
+    # Deepest first: every child of a folder in the batch is deeper, so it is
+    # either gone already or in the same batch, and the DELETE never cascades.
+    folder_ids = list(
+        Folder.all_objects.select_for_update(skip_locked=True).filter(trash=entry)
+        .order_by('-depth').values_list('pk', flat=True)[:batch_size]
+    )
+    if not folder_ids:
+        return 0
+    for session in UploadSession.objects.filter(folder_id__in=folder_ids, status=UploadSession.STATUS_ACTIVE):
+        uploads.delete_chunks(session)
+    Folder.all_objects.filter(pk__in=folder_ids).delete()
+    rollups.apply([], entry.owner_id, folders=-len(folder_ids))
+    TrashEntry.objects.filter(pk=entry.pk).update(purged_folders=F('purged_folders') + len(folder_ids))
+    return len(folder_ids)
+
+
+def purge_batch(entry, batch_size=None):
+    """
+    Delete one bounded batch of the entry's rows in its own transaction and
+    return how many went. Once nothing is left the entry is marked purged
+    and 0 is returned.
+    """
+    batch_size = batch_size or _batch_size()
+    with transaction.atomic(), signals.muted():
+        removed = _purge_files(entry, batch_size) or _purge_folders(entry, batch_size)
+        if not removed:
+            TrashEntry.objects.filter(pk=entry.pk).update(status=TrashEntry.STATUS_PURGED, purged_at=timezone.now())
+    return removed
+
+
+def purge(entry, batch_size=None, on_batch=None):
+    while purge_batch(entry, batch_size):
+        if on_batch is not None:
+            entry.refresh_from_db()
+            on_batch(entry)
+    entry.refresh_from_db()
+    return entry
+
+
+def purge_due(batch_size=None, on_batch=None):
+    """Purge every entry that is due; returns how many were purged."""
+    purged = 0
+    while True:
+        entry = claim_due()
+        if entry is None:
+            return purged
+        purge(entry, batch_size, on_batch)
+        purged += 1
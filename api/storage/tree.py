@@ -0,0 +1,94 @@
+from django.db.models import Q
+
+from api.storage.models import File, Folder
+
+
+def ancestors(folder):
+    """Ancestors of `folder` from the root down, in one query."""
+    ids = folder.ancestor_ids
+    if not ids:
+        return []
+    by_pk = Folder.objects.in_bulk(ids)
+    return [by_pk[pk] for pk in ids if pk in by_pk]
+
+
+def subtree_folders(folder, max_depth=None):
+    queryset = Folder.objects.filter(path__startswith=folder.subtree_prefix)
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=folder.depth + max_depth)
+    return queryset.order_by('depth', 'name')
+
+
+def subtree_files(folder, max_depth=None):
+    queryset = File.objects.filter(Q(folder=folder) | Q(folder__path__startswith=folder.subtree_prefix))
+    if max_depth is not None:
+        queryset = queryset.filter(folder__depth__lte=folder.depth + max_depth)
+    return queryset.order_by('folder_id', 'name')
+
+
+def split_path(path):
+    return [segment for segment in path.strip('/').split('/') if segment]
+
+
+def resolve_path(user, path):
+    """
+    Resolve "docs/2024/report.pdf" below the user's root folder. Returns a
+    Folder, a File or None. Candidate folders are fetched in one query by
+    name and walked in memory; a trailing file name costs one more query.
+    """
+    segments = split_path(path)
+    candidates = Folder.objects.filter(owner=user).filter(
+        Q(uuid=user.root_folder_uuid) | Q(name__in=segments, depth__lte=len(segments))
+    ).order_by('created_at')
+    children = {}
+    root = None
+    for folder in candidates:
+        if folder.uuid == user.root_folder_uuid:
+            root = folder
+        children.setdefault((folder.parent_id, folder.name), folder)
+    if root is None:
+        return None
+
+    current = root
+    for index, segment in enumerate(segments):
+        child = children.get((current.uuid, segment))
+        if child is None:
+            if index != len(segments) - 1:
+                return None
+            return File.objects.filter(owner=user, folder=current, name=segment).order_by('created_at').first()
+        current = child
+    return current
+
+
+def build_tree(user, max_depth=None, serialize_folder=None, serialize_files=None):
+    """
+    Nest all of a user's folders and files below their root folder using two
+    flat queries. `max_depth` cuts the tree off below that many levels.
+    Serializer callables turn rows into dicts; nesting happens in memory.
+    """
+    folders = Folder.objects.filter(owner=user)
+    files = File.objects.filter(owner=user, folder__isnull=False)
+    if max_depth is not None:
+        folders = folders.filter(depth__lte=max_depth)
+        files = files.filter(folder__depth__lte=max_depth)
+
+    by_uuid = {}
+    by_pk = {}
+    root = None
+    # Ordering by depth guarantees a parent is placed before its children.
+    for folder in folders.order_by('depth', 'name'):
+        node = serialize_folder(folder)
+        node["subfolders"] = []
+        node["files"] = []
+        by_uuid[folder.uuid] = by_pk[folder.pk] = node
+        if folder.uuid == user.root_folder_uuid:
+            root = node
+        elif folder.parent_id in by_uuid:
+            by_uuid[folder.parent_id]["subfolders"].append(node)
+
+    files = list(files.order_by('name'))
+    for file, data in zip(files, serialize_files(files)):
+        node = by_pk.get(file.folder_id)
+        if node is not None:
+            node["files"].append(data)
+    return root
@@ -0,0 +1,198 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api.storage import blobs, rollups, thumbnails
+from api.storage.models import Blob, File, UploadChunk, UploadSession
+
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def get_storage():
+    return File._meta.get_field('file').storage
+
+
+class LimitedReader(DjangoFile):
+    """Reads at most `limit` bytes from a request stream, block by block."""
+
+    def __init__(self, stream, limit, name=None):
+        super().__init__(None, name=name)
+        self.stream = stream
+        self.limit = limit
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        remaining = self.limit - self.bytes_read
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or STREAM_BLOCK_SIZE
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def overflowed(self):
+        return bool(self.stream.read(1))
+
+    def close(self):
+        pass
+
+
+class SessionContent(DjangoFile):
+    """Presents the stored chunks of an upload session as one sequential file."""
+
+    def __init__(self, session, name=None):
+        super().__init__(None, name=name or session.name)
+        self.session = session
+        self.size = session.size
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or STREAM_BLOCK_SIZE
+        storage = get_storage()
+        for index in range(self.session.chunk_count):
+            with storage.open(self.session.chunk_name(index), 'rb') as part:
+                while True:
+                    data = part.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+
+    def stored_parts(self):
+        """The chunk objects in order, so storages that can compose objects (GCS) skip the copy."""
+        return [self.session.chunk_name(index) for index in range(self.session.chunk_count)]
+
+    def close(self):
+        pass
+
+
+def default_chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def min_chunk_size():
+    return getattr(settings, 'UPLOAD_MIN_CHUNK_SIZE', 256 * 1024)
+
+
+def max_chunks():
+    return getattr(settings, 'UPLOAD_MAX_CHUNKS', 10000)
+
+
+def missing_chunks_limit():
+    return getattr(settings, 'UPLOAD_MISSING_CHUNKS_LIMIT', 1000)
+
+
+def write_chunk(session, index, stream):
+    if session.status != UploadSession.STATUS_ACTIVE:
+        raise ValidationError({'detail': 'Upload session is not active.'})
+    if index >= session.chunk_count:
+        raise ValidationError({'index': f'Chunk index must be lower than {session.chunk_count}.'})
+
+    expected = session.expected_chunk_size(index)
+    if stream is None:
+        raise ValidationError({'detail': f'Expected {expected} bytes for chunk {index}, got 0.'})
+
+    storage = get_storage()
+    name = session.chunk_name(index)
+    if storage.exists(name):
+        storage.delete(name)
+
+    reader = LimitedReader(stream, expected, name=name)
+    saved_name = storage.save(name, reader)
+    if reader.bytes_read != expected or reader.overflowed():
+        storage.delete(saved_name)
+        raise ValidationError({'detail': f'Expected {expected} bytes for chunk {index}.'})
+
+    chunk, _ = UploadChunk.objects.update_or_create(session=session, index=index, defaults={'size': expected})
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk
+
+
+def _received(session):
+    return set(session.chunks.values_list('index', flat=True))
+
+
+def missing_chunks(session, received=None):
+    """The first UPLOAD_MISSING_CHUNKS_LIMIT indexes of chunks not received yet."""
+    received = _received(session) if received is None else received
+    missing = (index for index in range(session.chunk_count) if index not in received)
+    return list(islice(missing, missing_chunks_limit()))
+
+
+def first_missing(session, received=None):
+    """The index of the first chunk not received yet, or None when all have been."""
+    received = _received(session) if received is None else received
+    for expected, index in enumerate(sorted(received)):
+        if index != expected:
+            return expected
+    return len(received) if len(received) < session.chunk_count else None
+
+
+def delete_chunks(session):
+    storage = get_storage()
+    names = [session.chunk_name(index) for index in range(session.chunk_count)]
+    if hasattr(storage, 'delete_many'):
+        storage.delete_many(names)
+        return
+    for name in names:
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def _create_file(session, blob):
+    if session.folder is not None and session.folder.trash_id:
+        raise ValidationError({'detail': 'The target folder has been deleted.'})
+    file = blobs.attach(File(name=session.name, folder=session.folder, owner=session.owner), blob)
+    file.save()
+    thumbnails.schedule_on_commit(blob.pk)
+    session.file = file
+    session.status = UploadSession.STATUS_COMPLETE
+    session.save(update_fields=['file', 'status', 'updated_at'])
+    return file
+
+
+def complete_with_blob(session, blob):
+    """Finish a session from content the server already holds; no bytes move."""
+    with transaction.atomic():
+        if not Blob.objects.select_for_update().filter(pk=blob.pk).exists():
+            return None
+        rollups.check_quota(session.owner_id, blob.size)
+        return _create_file(session, blob)
+
+
+def commit_session(session):
+    if session.status != UploadSession.STATUS_ACTIVE:
+        raise ValidationError({'detail': 'Upload session is not active.'})
+    missing = missing_chunks(session)
+    if missing:
+        raise ValidationError({'detail': 'Upload is incomplete.', 'missing_chunks': missing})
+    rollups.check_quota(session.owner_id, session.size)
+
+    # Hash and store outside the transaction: both stream the whole upload.
+    content = SessionContent(session)
+    sha256, size = blobs.hash_content(content)
+    if session.sha256 and session.sha256 != sha256:
+        raise ValidationError({'sha256': 'Uploaded content does not match the declared checksum.'})
+    blob = blobs.store_content(content, sha256=sha256, size=size)
+
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status != UploadSession.STATUS_ACTIVE:
+            raise ValidationError({'detail': 'Upload session is not active.'})
+        if not Blob.objects.select_for_update().filter(pk=blob.pk).exists():
+            raise ValidationError({'detail': 'Stored content was reclaimed concurrently, commit again.'})
+        file = _create_file(session, blob)
+        transaction.on_commit(lambda: delete_chunks(session))
+    return file
@@ -1,17 +1,42 @@
 
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from rest_framework.routers import DefaultRouter
+from api.storage import async_views
 from api.storage.views import (
+    BatchViewSet,
+    ChangesView,
     FolderViewSet,
     FileViewSet,
+    PathLookupView,
+    SearchView,
+    TrashViewSet,
+    UploadSessionViewSet,
 )
 
 
 router = DefaultRouter()
 router.register(r'folder', FolderViewSet)
 router.register(r'file', FileViewSet)
+router.register(r'upload', UploadSessionViewSet, basename='upload')
+router.register(r'batch', BatchViewSet, basename='batch')
+router.register(r'trash', TrashViewSet, basename='trash')
+
+# Native async GET/PUT handlers in front of the DRF routes for the same URLs.
+drf_views = {pattern.name: pattern.callback for pattern in router.urls if pattern.name}
 
 urlpatterns = [
+    re_path(r'^folder/(?P<uuid>[^/.]+)/$', async_views.hybrid(
+        {'GET': async_views.folder_detail}, drf_views['folder-detail']), name='folder-detail'),
+    re_path(r'^file/(?P<uuid>[^/.]+)/$', async_views.hybrid(
+        {'GET': async_views.file_detail}, drf_views['file-detail']), name='file-detail'),
+    re_path(r'^file/(?P<uuid>[^/.]+)/download/$', async_views.hybrid(
+        {'GET': async_views.file_download, 'HEAD': async_views.file_download}, drf_views['file-download'],
+        scope='download'), name='file-download'),
+    re_path(r'^upload/(?P<uuid>[^/.]+)/chunks/(?P<index>[0-9]+)/$', async_views.hybrid(
+        {'PUT': async_views.upload_chunk}, drf_views['upload-chunk'], scope='upload'), name='upload-chunk'),
+    re_path(r'^path/(?P<path>.*)$', PathLookupView.as_view(), name='path_lookup'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('changes/', ChangesView.as_view(), name='changes'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
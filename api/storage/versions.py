@@ -0,0 +1,254 @@
+"""
+Version history of files, uploaded as deltas.
+
+Every FileVersion holds a reference on a blob, so listing, restoring and
+pruning versions only move references: no bytes are copied, and content
+nothing needs any more is reclaimed by blob collection as usual. The File
+itself keeps pointing at the blob of its newest version.
+
+New versions are uploaded as content-defined chunks (api.storage.chunking):
+
+1. POST versions/diff/ with the manifest of the new content, a list of
+   {sha256, size}; the answer lists the chunks the user does not hold.
+2. PUT each of those to versions/chunks/<sha256>/.
+3. POST versions/ with the manifest to make it the current version.
+
+Chunks are ordinary blobs, shared by every version and user holding them.
+A user holds the chunks of content their files or versions reference and
+the ones they have sent (ChunkUpload); any other chunk must be sent and
+checked against its hash, even when the server stores it already, so that
+nobody can claim content, or learn that it exists, from a hash alone.
+A version's content is a chunked blob listing them, stored once per
+distinct manifest. Its key is an HMAC of the manifest under SECRET_KEY
+rather than a hash of the bytes, which nobody has computed, so it can never
+be mistaken for, or collide with, content uploaded by anyone.
+
+Files that were never versioned have no FileVersion rows; their history is
+their current content, numbered 1, until the first new version is stored.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from rest_framework.exceptions import ValidationError
+
+from api.storage import blobs, chunking, rollups
+from api.storage.models import Blob, BlobChunk, ChunkUpload, File, FileVersion
+
+
+LOOKUP_BATCH_SIZE = 500
+
+
+def params():
+    return chunking.Params(
+        getattr(settings, 'VERSION_CHUNK_MIN_SIZE', chunking.MIN_SIZE),
+        getattr(settings, 'VERSION_CHUNK_AVG_SIZE', chunking.AVG_SIZE),
+        getattr(settings, 'VERSION_CHUNK_MAX_SIZE', chunking.MAX_SIZE),
+    )
+
+
+def manifest_key(entries):
+    value = '\n'.join(f"{sha256}:{size}" for sha256, size in entries)
+    return salted_hmac('api.storage.versions.manifest', value, algorithm='sha256').hexdigest()
+
+
+def history(file):
+    """The file's versions, newest first; an unsaved version 1 for a file never versioned."""
+    versions = list(file.versions.select_related('blob'))
+    if versions or not file.blob_id:
+        return versions
+    return [FileVersion(file=file, number=1, blob=file.blob, size=file.size, created_at=file.updated_at)]
+
+
+def get_version(file, number):
+    if number == 1 and file.blob_id and not file.versions.exists():
+        return history(file)[0]
+    return get_object_or_404(file.versions.select_related('blob'), number=number)
+
+
+def as_of(file, number):
+    """`file` with the content of version `number`, for downloads."""
+    version = get_version(file, number)
+    blobs.attach(file, version.blob)
+    file.updated_at = version.created_at
+    return file
+
+
+def manifest(version):
+    """The [{sha256, size, offset}] chunks of a version; content stored whole is one chunk."""
+    blob = version.blob
+    if not blob.chunked:
+        return [{'sha256': blob.sha256, 'size': blob.size, 'offset': 0}]
+    return [
+        {'sha256': sha256, 'size': size, 'offset': offset}
+        for sha256, size, offset in blob.chunks.values_list('chunk_id', 'chunk__size', 'offset')
+    ]
+
+
+def _held_by(user):
+    referenced = blobs.referenced_by(user).values('pk')
+    return (
+        Q(pk__in=referenced)
+        | Exists(BlobChunk.objects.filter(chunk=OuterRef('pk'), blob__in=referenced))
+        | Exists(ChunkUpload.objects.filter(owner=user, chunk=OuterRef('pk')))
+    )
+
+
+def _stored_sizes(hashes, user, lock=False):
+    """The sizes of the chunks among `hashes` that `user` holds."""
+    queryset = (Blob.objects.select_for_update() if lock else Blob.objects).filter(_held_by(user))
+    sizes = {}
+    hashes = list(hashes)
+    for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+        batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+        sizes.update(queryset.filter(pk__in=batch, chunked=False).values_list('sha256', 'size'))
+    return sizes
+
+
+def _missing(entries, sizes):
+    missing = []
+    for sha256, size in entries:
+        if sizes.get(sha256) != size and sha256 not in missing:
+            missing.append(sha256)
+    return missing
+
+
+def missing(entries, user):
+    """The distinct chunks of a manifest the user does not hold yet, in manifest order."""
+    return _missing(entries, _stored_sizes({sha256 for sha256, _ in entries}, user))
+
+
+def store_chunk(sha256, stream, user):
+    """Store one chunk, checked against the hash it was announced with, as sent by `user`."""
+    limit = params().max_size
+    data = stream.read(limit + 1) if stream is not None else b''
+    if len(data) > limit:
+        raise ValidationError({'detail': f"Chunks are at most {limit} bytes."})
+    content = ContentFile(data)
+    digest, size = blobs.hash_content(content)
+    if digest != sha256:
+        raise ValidationError({'detail': "The chunk does not match its SHA-256."})
+    blob = blobs.store_content(content, digest, size)
+    ChunkUpload.objects.bulk_create([ChunkUpload(owner=user, chunk=blob)], ignore_conflicts=True)
+    return blob
+
+
+def _require(entries, sizes):
+    absent = _missing(entries, sizes)
+    if absent:
+        raise ValidationError({'detail': "Some chunks have not been uploaded.", 'missing': absent})
+
+
+def _manifest_blob(entries, user):
+    """The blob of a manifest's content, created with a reference on each chunk when it is new."""
+    if not entries:
+        return blobs.store_content(ContentFile(b''))
+    # Locked, so collecting unreferenced chunks waits until these references are added.
+    _require(entries, _stored_sizes({sha256 for sha256, _ in entries}, user, lock=True))
+    if len(entries) == 1:
+        # A single chunk is the whole content: its own blob serves as is.
+        return Blob.objects.get(pk=entries[0][0])
+    key = manifest_key(entries)
+    blob = Blob.objects.filter(pk=key).first()
+    if blob is not None:
+        return blob
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(sha256=key, size=sum(size for _, size in entries), chunked=True)
+    except IntegrityError:
+        return Blob.objects.get(pk=key)
+    rows, offset = [], 0
+    for index, (sha256, size) in enumerate(entries):
+        rows.append(BlobChunk(blob=blob, index=index, offset=offset, chunk_id=sha256))
+        offset += size
+    BlobChunk.objects.bulk_create(rows, batch_size=LOOKUP_BATCH_SIZE)
+    blobs.add_references(Counter(sha256 for sha256, _ in entries))
+    return blob
+
+
+def _ensure_history(file):
+    """Record a never-versioned file's content as version 1."""
+    if file.blob_id and not file.versions.exists():
+        FileVersion.objects.create(
+            file=file, number=1, blob_id=file.blob_id, size=file.size, created_by_id=file.owner_id,
+        )
+        blobs.add_reference(file.blob_id)
+
+
+def _make_current(file, blob, user):
+    """Point the file at `blob` and record that as a new version; the file must be locked."""
+    _ensure_history(file)
+    if file.blob_id == blob.pk:
+        return file.versions.first()
+    # The previous content stays on as an older version, so all of the new
+    # content counts toward the quota and the old size is now retained.
+    rollups.check_quota(file.owner_id, blob.size)
+    retained = file.size if file.blob_id else 0
+    blobs.attach(file, blob)
+    file.save(update_fields=['blob', 'file', 'size', 'updated_at'])
+    if retained:
+        rollups.apply([], file.owner_id, size=retained)
+    number = (file.versions.aggregate(last=Max('number'))['last'] or 0) + 1
+    version = FileVersion.objects.create(
+        file=file, number=number, blob=blob, size=blob.size, created_by=user,
+    )
+    blobs.add_reference(blob.pk)
+    return version
+
+
+def commit(file, entries, user):
+    """Make the content described by `entries`, [(sha256, size)], the file's current version."""
+    with transaction.atomic():
+        file = File.objects.select_related('blob').select_for_update(of=('self',)).get(pk=file.pk)
+        version = _make_current(file, _manifest_blob(entries, user), user)
+        # The version references them now.
+        ChunkUpload.objects.filter(owner=user, chunk__in={sha256 for sha256, _ in entries}).delete()
+        return version
+
+
+def restore(file, number, user):
+    """Make an earlier version current again, as a new version with the same content."""
+    with transaction.atomic():
+        file = File.objects.select_related('blob').select_for_update(of=('self',)).get(pk=file.pk)
+        return _make_current(file, get_version(file, number).blob, user)
+
+
+def prune(file, keep=None, numbers=None):
+    """
+    Delete old versions: all but the `keep` newest, or those in `numbers`.
+    The newest version is always kept. Returns how many were deleted.
+    """
+    with transaction.atomic():
+        versions = file.versions.select_for_update()
+        newest = versions.aggregate(last=Max('number'))['last']
+        if newest is None:
+            return 0
+        doomed = versions.exclude(number=newest)
+        if numbers is not None:
+            doomed = doomed.filter(number__in=numbers)
+        if keep is not None:
+            doomed = doomed.filter(number__lte=newest - max(keep, 1))
+        doomed = list(doomed.values_list('pk', 'size'))
+        # The post_delete handler releases each version's blob reference.
+        deleted, _ = FileVersion.objects.filter(pk__in=[pk for pk, _ in doomed]).delete()
+        rollups.apply([], file.owner_id, size=-sum(size for _, size in doomed))
+    return deleted
+
+
+def collect_unused_chunks(older_than=None):
+    """
+    Reclaim blobs nothing references that were stored before `older_than`
+    ago: chunks uploaded for versions that were never committed.
+    """
+    older_than = older_than if older_than is not None else timedelta(hours=24)
+    cutoff = timezone.now() - older_than
+    collected = 0
+    for blob_id in list(Blob.objects.filter(ref_count=0, created_at__lt=cutoff).values_list('pk', flat=True)):
+        collected += blobs.collect(blob_id)
+    return collected
@@ -1,42 +1,458 @@
-from rest_framework import mixins, viewsets, permissions, generics
+from rest_framework import mixins, viewsets, permissions, generics, status
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.shortcuts import get_object_or_404
 
-from api.storage.models import File, Folder
-from api.storage.serializers import RegisterSerializer, FileSerializer, FolderSerializer, UserSerializer
+from api.replicas.routing import replica_reads
+from api.storage.models import Derivative, File, Folder, TrashEntry, UploadSession
+from api.storage.pagination import KeysetPagination
+from api.storage.serializers import RegisterSerializer, BatchSerializer, ChangeSerializer, ChangesQuerySerializer, SearchSerializer, FileSerializer, FileVersionSerializer, FolderNodeSerializer, FolderSerializer, ManifestSerializer, PruneVersionsSerializer, SubfolderSerializer, TrashEntrySerializer, UserSerializer, UploadSessionSerializer
+from api.storage import archives, batch, blobs, downloads, journal, listing_cache, rollups, rows, search, thumbnails, trash, tree, uploads, versions
+from api.storage.renderers import JSONRenderer, PassthroughRenderer
+from api.throttling.transfers import Transfer, content_length
 
 
 User = get_user_model()
 
 
-class FolderViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+def version_number(request):
+    number = request.query_params.get('version')
+    if number is None:
+        return None
+    if not number.isdigit():
+        raise ValidationError({'version': ["Expected a version number."]})
+    return int(number)
+
+
+def thumbnail_variant(request):
+    variant = request.query_params.get('size', 'small')
+    if variant not in thumbnails.sizes():
+        raise ValidationError({'size': [f"Choose one of {', '.join(thumbnails.sizes())}."]})
+    return variant
+
+
+class FolderViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.UpdateModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     queryset = Folder.objects.all()
     serializer_class = FolderSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "uuid"
+    # The token bucket requests draw from (api.throttling); content transfers override it per action.
+    throttle_scope = 'metadata'
 
-    def retrieve(self, request, uuid=None):
+    def get_queryset(self):
+        return Folder.objects.filter(owner=self.request.user)
+
+    def get_folder(self, uuid):
         if uuid == "default":
-            folder = get_object_or_404(Folder, owner=request.user, name='root')
+            return get_object_or_404(Folder, owner=self.request.user, name='root')
+        return get_object_or_404(Folder, uuid=uuid, owner=self.request.user)
+
+    @replica_reads
+    def retrieve(self, request, uuid=None):
+        """The folder with the first page of its children; `?layout=columns` lists them as one array per field."""
+        folder_uuid = request.user.root_folder_uuid if uuid == "default" else uuid
+        layout = rows.get_layout(request)
+        return listing_cache.cached_response(
+            request,
+            f"folder:{folder_uuid}",
+            listing_cache.folder_version(folder_uuid),
+            lambda: self.serializer_class(self.get_folder(uuid), context={'request': request, 'layout': layout}).data,
+        )
+
+    def perform_create(self, serializer):
+        parent = serializer.validated_data.get('parent')
+        if parent is None:
+            parent = get_object_or_404(Folder, uuid=self.request.user.root_folder_uuid, owner=self.request.user)
+        serializer.save(owner=self.request.user, parent=parent)
+
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except ValueError as exc:
+            raise ValidationError({'parent': [str(exc)]})
+
+    def destroy(self, request, uuid=None):
+        """Move the folder and everything in it to the trash."""
+        try:
+            entry = trash.trash_folder(self.get_folder(uuid))
+        except ValueError as exc:
+            raise ValidationError({'detail': str(exc)})
+        return Response(TrashEntrySerializer(entry).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def children(self, request, uuid=None):
+        """
+        One page of a folder's files (`?type=files`, the default) or subfolders
+        (`?type=folders`); `?layout=columns` lists them as one array per field.
+        """
+        folder = self.get_folder(uuid)
+        kind = request.query_params.get('type', 'files')
+        if kind == 'files':
+            paginator = KeysetPagination(ordering_fields=('name', 'created_at', 'updated_at', 'size'))
+            queryset, serializer_class = folder.files.all(), FileSerializer
+        elif kind == 'folders':
+            paginator = KeysetPagination()
+            queryset, serializer_class = folder.subfolders.all(), SubfolderSerializer
         else:
-            folder = get_object_or_404(Folder, uuid=uuid, owner=request.user)
-        serializer = self.serializer_class(folder, context={'request': request})
-        return Response(serializer.data)
+            raise ValidationError({'type': ["Expected 'files' or 'folders'."]})
+        layout = rows.get_layout(request)
+        page = paginator.paginate_queryset(rows.select(serializer_class, queryset), request, view=self)
+        data = rows.RowSerializer(serializer_class, {'request': request}).data(page, layout)
+        return paginator.get_paginated_response(data)
+
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, PassthroughRenderer], throttle_scope='download')
+    def archive(self, request, uuid=None):
+        """Stream the folder and everything below it as a ZIP (`?compression=deflate` to compress)."""
+        folder = self.get_folder(uuid)
+        compression = request.query_params.get('compression', 'store')
+        if compression not in archives.COMPRESSION:
+            raise ValidationError({'compression': ["Expected 'store' or 'deflate'."]})
+        body = archives.stream_zip(archives.folder_entries(folder), archives.COMPRESSION[compression])
+        transfer = Transfer(request.user, 'download')
+        # Thread sensitive: the entries come from open database cursors.
+        response = StreamingHttpResponse(
+            downloads.stream_body(request, body, thread_sensitive=True, transfer=transfer), content_type='application/zip',
+        )
+        response['Content-Disposition'] = content_disposition_header(True, f"{folder.name}.zip")
+        # Let nginx pass the archive through as it is produced.
+        response['X-Accel-Buffering'] = 'no'
+        return transfer.admit(request, response)
+
+    @action(detail=True, methods=['get'])
+    def thumbnails(self, request, uuid=None):
+        """Thumbnails for one page of the folder's files (paged like `children`), inlined as base64."""
+        folder = self.get_folder(uuid)
+        variant = thumbnail_variant(request)
+        paginator = KeysetPagination(ordering_fields=('name', 'created_at', 'updated_at', 'size'))
+        files = paginator.paginate_queryset(folder.files.all(), request, view=self)
+        derivatives = thumbnails.lookup([file.blob_id for file in files if file.blob_id], variant)
+        return paginator.get_paginated_response([
+            thumbnails.describe(file, derivatives.get(file.blob_id), include_data=True) for file in files
+        ])
+
+    @action(detail=True, methods=['get'])
+    def ancestors(self, request, uuid=None):
+        folder = self.get_folder(uuid)
+        return Response(FolderNodeSerializer(tree.ancestors(folder), many=True).data)
+
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, uuid=None):
+        folder = self.get_folder(uuid)
+        max_depth = request.query_params.get('depth')
+        max_depth = int(max_depth) if max_depth and max_depth.isdigit() else None
+        folders = tree.subtree_folders(folder, max_depth=max_depth)
+        files = tree.subtree_files(folder, max_depth=max_depth)
+        return Response({
+            "folders": FolderNodeSerializer(folders, many=True).data,
+            "files": FileSerializer(files, many=True, context={'request': request}).data,
+        })
 
 
-class FileViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+class FileViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
     queryset = File.objects.all()
     serializer_class = FileSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "uuid"
+    throttle_scope = 'metadata'
 
+    @replica_reads
     def retrieve(self, request, uuid=None):
         file = get_object_or_404(File, owner=request.user, uuid=uuid)
         serializer = self.serializer_class(file, context={'request': request})
         return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, PassthroughRenderer])
+    def thumbnail(self, request, uuid=None):
+        """
+        JPEG or PNG thumbnail, `?size=small|medium|large`. Answers 202 while
+        it is still being rendered and 404 for content without thumbnails.
+        """
+        file = get_object_or_404(File, owner=request.user, uuid=uuid)
+        variant = thumbnail_variant(request)
+        if not file.blob_id:
+            raise Http404("No thumbnail for this file.")
+        derivative = thumbnails.get(file.blob_id, variant, wait=getattr(settings, 'THUMBNAIL_WAIT_SECONDS', 2))
+        if derivative is None:
+            return Response({'status': 'pending'}, status=status.HTTP_202_ACCEPTED, headers={'Retry-After': '1'})
+        if derivative.status != Derivative.STATUS_READY:
+            raise Http404("No thumbnail for this file.")
+        return thumbnails.build_response(request, derivative)
+
+    def destroy(self, request, uuid=None):
+        """Move the file to the trash."""
+        entry = trash.trash_file(get_object_or_404(File, owner=request.user, uuid=uuid))
+        if entry is None:
+            raise Http404("No such file.")
+        return Response(TrashEntrySerializer(entry).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get', 'head'], renderer_classes=[JSONRenderer, PassthroughRenderer], throttle_scope='download')
+    def download(self, request, uuid=None):
+        file = get_object_or_404(File.objects.select_related('blob'), owner=request.user, uuid=uuid)
+        number = version_number(request)
+        if number is not None:
+            file = versions.as_of(file, number)
+        if not downloads.has_content(file):
+            raise Http404("File has no content.")
+        as_attachment = request.query_params.get('inline') not in ('1', 'true')
+        transfer = Transfer(request.user, 'download')
+        return transfer.admit(request, downloads.build_download_response(
+            request, file, as_attachment=as_attachment, transfer=transfer,
+        ))
+
+    @action(detail=True, methods=['get', 'post'])
+    def versions(self, request, uuid=None):
+        """
+        GET lists the file's versions, newest first. POST {"chunks": [{sha256,
+        size}, ...]} makes that content the current version, once every chunk
+        has been uploaded; otherwise it answers 400 with the `missing` ones.
+        """
+        file = get_object_or_404(File.objects.select_related('blob'), owner=request.user, uuid=uuid)
+        if request.method == 'GET':
+            return Response(FileVersionSerializer(versions.history(file), many=True).data)
+        serializer = ManifestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        version = versions.commit(file, serializer.validated_data['chunks'], request.user)
+        return Response(FileVersionSerializer(version).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], url_path='versions/diff')
+    def versions_diff(self, request, uuid=None):
+        """The chunks of a manifest still to be uploaded, and how clients must cut them."""
+        get_object_or_404(File, owner=request.user, uuid=uuid)
+        serializer = ManifestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({
+            'missing': versions.missing(serializer.validated_data['chunks'], request.user),
+            'chunking': versions.params().describe(),
+        })
+
+    @action(detail=True, methods=['put'], url_path=r'versions/chunks/(?P<sha256>[0-9a-f]{64})', throttle_scope='upload')
+    def version_chunk(self, request, uuid=None, sha256=None):
+        get_object_or_404(File, owner=request.user, uuid=uuid)
+        transfer = Transfer(request.user, 'upload')
+        with transfer.slot(content_length(request)):
+            blob = versions.store_chunk(sha256, transfer.reader(request.stream), request.user)
+        return Response({'sha256': blob.sha256, 'size': blob.size}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path=r'versions/(?P<number>[0-9]+)')
+    def version(self, request, uuid=None, number=None):
+        """One version with its chunk manifest, to diff local content against."""
+        file = get_object_or_404(File.objects.select_related('blob'), owner=request.user, uuid=uuid)
+        version = versions.get_version(file, int(number))
+        return Response({**FileVersionSerializer(version).data, 'chunks': versions.manifest(version)})
+
+    @action(detail=True, methods=['post'], url_path=r'versions/(?P<number>[0-9]+)/restore')
+    def restore_version(self, request, uuid=None, number=None):
+        file = get_object_or_404(File.objects.select_related('blob'), owner=request.user, uuid=uuid)
+        version = versions.restore(file, int(number), request.user)
+        return Response(FileVersionSerializer(version).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], url_path='versions/prune')
+    def prune_versions(self, request, uuid=None):
+        """Delete old versions: all but the `keep` newest, or the listed `numbers`."""
+        file = get_object_or_404(File, owner=request.user, uuid=uuid)
+        serializer = PruneVersionsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = versions.prune(file, **serializer.validated_data)
+        return Response({'deleted': deleted})
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable uploads: create a session, PUT chunks in any order, inspect the
+    session to see which chunks have arrived, then commit it into a File.
+    A session created with the `sha256` of content the user already stores
+    completes immediately, without any chunks.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "uuid"
+    throttle_scope = 'metadata'
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user).prefetch_related('chunks')
+
+    def perform_create(self, serializer):
+        folder = serializer.validated_data.get('folder')
+        if folder is None:
+            folder = get_object_or_404(Folder, uuid=self.request.user.root_folder_uuid, owner=self.request.user)
+        chunk_size = serializer.validated_data.get('chunk_size') or uploads.default_chunk_size()
+        rollups.check_quota(self.request.user.pk, serializer.validated_data['size'])
+        session = serializer.save(owner=self.request.user, folder=folder, chunk_size=chunk_size)
+        # Pre-flight dedup: when the user already stores the content, finish right away.
+        if session.sha256:
+            blob = blobs.find_blob(session.sha256, session.size, owner=self.request.user)
+            if blob is not None:
+                uploads.complete_with_blob(session, blob)
+
+    def perform_destroy(self, instance):
+        if instance.status == UploadSession.STATUS_ACTIVE:
+            uploads.delete_chunks(instance)
+        instance.delete()
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>[0-9]+)', throttle_scope='upload')
+    def chunk(self, request, uuid=None, index=None):
+        session = self.get_object()
+        transfer = Transfer(request.user, 'upload')
+        with transfer.slot(content_length(request)):
+            chunk = uploads.write_chunk(session, int(index), transfer.reader(request.stream))
+        return Response({"index": chunk.index, "size": chunk.size}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, uuid=None):
+        session = self.get_object()
+        file = uploads.commit_session(session)
+        serializer = FileSerializer(file, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class TrashViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    The user's trash. Entries are purged by `manage.py purge_trash` once
+    their retention ends; DELETE (or `empty`) makes them due right away.
+    Purged entries stay listed with their final counters.
+    """
+    serializer_class = TrashEntrySerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "uuid"
+
+    def get_queryset(self):
+        queryset = TrashEntry.objects.filter(owner=self.request.user).order_by('-trashed_at', '-pk')
+        entry_status = self.request.query_params.get('status')
+        if entry_status:
+            queryset = queryset.filter(status=entry_status)
+        return queryset
+
+    def destroy(self, request, uuid=None):
+        entry = self.get_object()
+        trash.schedule_purge(TrashEntry.objects.filter(pk=entry.pk))
+        entry.refresh_from_db()
+        return Response(self.get_serializer(entry).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, uuid=None):
+        try:
+            trash.restore(self.get_object())
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'])
+    def empty(self, request):
+        scheduled = trash.schedule_purge(TrashEntry.objects.filter(owner=request.user))
+        return Response({"scheduled": scheduled}, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchViewSet(viewsets.GenericViewSet):
+    """
+    Move, copy or trash many files and folders at once. Each request takes
+    `files` and `folders` UUID lists (plus a `target` folder for move and
+    copy), runs in one transaction and returns a result per item.
+    """
+    serializer_class = BatchSerializer
+    permission_classes = [IsAuthenticated]
+
+    def _validated(self, request, needs_target=True):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        target = None
+        if needs_target:
+            if 'target' not in data:
+                raise ValidationError({'target': ["This field is required."]})
+            target = Folder.objects.filter(uuid=data['target'], owner=request.user).first()
+            if target is None:
+                raise ValidationError({'target': ["Folder not found."]})
+        return data['files'], data['folders'], target
+
+    def _respond(self, results):
+        failed = sum(1 for item in results if item['status'] != batch.OK)
+        return Response({"succeeded": len(results) - failed, "failed": failed, "results": results})
+
+    @action(detail=False, methods=['post'])
+    def move(self, request):
+        files, folders, target = self._validated(request)
+        return self._respond(batch.move(request.user, files, folders, target))
+
+    @action(detail=False, methods=['post'])
+    def copy(self, request):
+        files, folders, target = self._validated(request)
+        return self._respond(batch.copy(request.user, files, folders, target))
+
+    # Not named `delete`: that would also answer HTTP DELETE requests.
+    @action(detail=False, methods=['post'], url_path='delete', url_name='delete')
+    def remove(self, request):
+        files, folders, target = self._validated(request, needs_target=False)
+        return self._respond(batch.delete(request.user, files, folders))
+
+
+class PathLookupView(APIView):
+    """Resolve a slash separated path below the user's root folder, e.g. /api/path/docs/2024/report.pdf."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, path=""):
+        item = tree.resolve_path(request.user, path)
+        if item is None:
+            raise Http404("No folder or file at this path.")
+        if isinstance(item, File):
+            return Response({"type": "file", **FileSerializer(item, context={'request': request}).data})
+        return Response({"type": "folder", **FolderSerializer(item, context={'request': request}).data})
+
+
+class SearchView(APIView):
+    """
+    Ranked name search, e.g. /api/search/?q=report&ext=pdf&min_size=1024.
+    `type=folders` searches folders instead of files; `cursor` pages on.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = SearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        kind = data['type']
+        matches, next_cursor = search.search(
+            request.user, data['q'], kind=kind, extensions=data.get('ext', ()),
+            min_size=data.get('min_size'), max_size=data.get('max_size'),
+            modified_after=data.get('modified_after'), modified_before=data.get('modified_before'),
+            page_size=data.get('page_size') or getattr(settings, 'SEARCH_PAGE_SIZE', 50), cursor=data.get('cursor'),
+        )
+        if kind == 'folders':
+            results = FolderNodeSerializer(matches, many=True).data
+        else:
+            results = FileSerializer(matches, many=True, context={'request': request}).data
+        return Response({"next": next_cursor, "results": results})
+
+
+class ChangesView(APIView):
+    """
+    Delta sync: the journal entries after `cursor`, oldest first, e.g.
+    /api/changes/?cursor=1042. Without a cursor only the current cursor is
+    returned; take it before listing the tree and poll from there. Answers
+    410 with `reset` when the cursor is too old and the client must resync.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = ChangesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        cursor = params.validated_data.get('cursor')
+        if cursor is None:
+            return Response({"cursor": journal.head(request.user.pk), "has_more": False, "changes": []})
+        page_size = params.validated_data.get('page_size') or getattr(settings, 'CHANGES_PAGE_SIZE', 500)
+        try:
+            changes, next_cursor, has_more = journal.changes_since(request.user.pk, cursor, page_size)
+        except journal.CursorExpired as exc:
+            return Response({"detail": str(exc), "reset": True, "cursor": exc.head}, status=status.HTTP_410_GONE)
+        return Response({
+            "cursor": next_cursor, "has_more": has_more, "changes": ChangeSerializer(changes, many=True).data,
+        })
@@ -23,3 +23,71 @@ def login_url():
 @pytest.fixture
 def registered_user(client, user_data):
     User.objects.create_user(**user_data)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    from django.core.cache import cache
+    from api.throttling import state
+    from api.user import authentication
+
+    cache.clear()
+    authentication.clear()
+    state.clear()
+    yield
+    cache.clear()
+    authentication.clear()
+    state.clear()
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path / "media")
+    return settings.MEDIA_ROOT
+
+
+@pytest.fixture(autouse=True)
+def inline_thumbnails(settings):
+    settings.THUMBNAIL_WORKERS = 0
+
+
+@pytest.fixture
+def auth_client(create_user):
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    client.force_authenticate(user=create_user)
+    return client
+
+
+@pytest.fixture
+def make_file(create_user):
+    from django.core.files.base import ContentFile
+    from api.storage import blobs
+    from api.storage.models import File, Folder
+
+    def _make_file(name="data.bin", content=b"", folder=None, owner=None):
+        owner = owner or create_user
+        folder = folder or Folder.objects.get(uuid=owner.root_folder_uuid)
+        file = blobs.attach(File(name=name, folder=folder, owner=owner), blobs.store_content(ContentFile(content)))
+        file.save()
+        return file
+
+    return _make_file
+
+
+@pytest.fixture
+def other_client(db):
+    from rest_framework.test import APIClient
+
+    other = User.objects.create_user(username="otheruser", email="other@example.com", password="strongpassword123")
+    client = APIClient()
+    client.force_authenticate(user=other)
+    return client
+
+
+@pytest.fixture
+def root(create_user):
+    from api.storage.models import Folder
+
+    return Folder.objects.get(uuid=create_user.root_folder_uuid)
@@ -0,0 +1,211 @@
+"""
+An in-process stand-in for fake-gcs-server: the slice of the GCS JSON API
+that api.storage.gcs uses, plus V4 signed URL downloads that are checked
+against the HMAC secret. It counts connections and requests and can be told
+to fail or slow down, so the tests can see pooling, retries and parallelism.
+"""
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from api.storage import gcs
+
+
+class FakeGCSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bucket, hmac_secret=None):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.bucket = bucket
+        self.hmac_secret = hmac_secret
+        self.objects = {}
+        self.requests = []
+        self.connections = 0
+        self.failures = []
+        self.upload_delay = 0
+        self.uploads_in_flight = 0
+        self.max_uploads_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def fail_next(self, status, count=1):
+        self.failures.extend([status] * count)
+
+    def calls(self, method=None, prefix=''):
+        return [(m, path) for m, path in self.requests if (method is None or m == method) and path.startswith(prefix)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def reply(self, status, body=b'', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers = {'Content-Type': 'application/json', **(headers or {})}
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def dispatch(self, method):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        body = self.body()
+        with server.lock:
+            server.requests.append((method, parts.path))
+            failure = server.failures.pop(0) if server.failures else None
+        if failure:
+            return self.reply(failure, {'error': {'code': failure}})
+
+        prefix = f"/storage/v1/b/{server.bucket}/o"
+        if method == 'POST' and parts.path == f"/upload/storage/v1/b/{server.bucket}/o":
+            return self.upload(query['name'], body)
+        if method == 'POST' and parts.path == '/batch/storage/v1':
+            return self.batch(body)
+        if method == 'POST' and parts.path == '/storage/v1/b':
+            return self.reply(200, {'name': json.loads(body)['name']})
+        if method == 'GET' and parts.path == prefix:
+            return self.listing(query)
+        if parts.path.startswith(prefix + '/'):
+            name = unquote(parts.path[len(prefix) + 1:])
+            if method == 'POST' and name.endswith('/compose'):
+                return self.compose(name[:-len('/compose')], json.loads(body))
+            if method == 'DELETE':
+                with server.lock:
+                    found = server.objects.pop(name, None)
+                return self.reply(204 if found is not None else 404)
+            if method == 'GET':
+                return self.get(name, query)
+        if method == 'GET' and parts.path.startswith(f"/{server.bucket}/"):
+            return self.signed_get(parts, query)
+        self.reply(400, {'error': 'unsupported'})
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def resource(self, name, data):
+        return {'name': name, 'bucket': self.server.bucket, 'size': str(len(data)),
+                'updated': '2024-01-02T03:04:05.000Z', 'timeCreated': '2024-01-02T03:04:05.000Z'}
+
+    def upload(self, name, data):
+        server = self.server
+        with server.lock:
+            server.uploads_in_flight += 1
+            server.max_uploads_in_flight = max(server.max_uploads_in_flight, server.uploads_in_flight)
+        time.sleep(server.upload_delay)
+        with server.lock:
+            server.uploads_in_flight -= 1
+            server.objects[name] = data
+        self.reply(200, self.resource(name, data))
+
+    def compose(self, destination, request):
+        sources = [source['name'] for source in request['sourceObjects']]
+        with self.server.lock:
+            if len(sources) > gcs.COMPOSE_MAX_SOURCES or any(name not in self.server.objects for name in sources):
+                return self.reply(400, {'error': 'bad compose'})
+            data = self.server.objects[destination] = b''.join(self.server.objects[name] for name in sources)
+        self.reply(200, self.resource(destination, data))
+
+    def ranged(self, data, extra=None):
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match is None:
+            return self.reply(200, data, extra)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            return self.reply(416, b'', {'Content-Range': f"bytes */{len(data)}"})
+        self.reply(206, data[start:end + 1], {**(extra or {}), 'Content-Range': f"bytes {start}-{end}/{len(data)}"})
+
+    def get(self, name, query):
+        data = self.server.objects.get(name)
+        if data is None:
+            return self.reply(404, {'error': 'not found'})
+        if query.get('alt') == 'media':
+            return self.ranged(data)
+        self.reply(200, self.resource(name, data))
+
+    def listing(self, query):
+        prefix, delimiter = query.get('prefix', ''), query.get('delimiter')
+        items, prefixes = [], set()
+        for name in sorted(self.server.objects):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+            else:
+                items.append({'name': name})
+        self.reply(200, {'items': items, 'prefixes': sorted(prefixes)})
+
+    def batch(self, body):
+        boundary = re.search(r'boundary=(\S+)', self.headers['Content-Type']).group(1)
+        responses = []
+        for part in body.decode().split(f"--{boundary}")[1:-1]:
+            content_id = re.search(r'Content-ID: <(\d+)>', part).group(1)
+            path = re.search(r'DELETE (\S+) HTTP/1\.1', part).group(1)
+            name = unquote(path.rsplit('/o/', 1)[1])
+            with self.server.lock:
+                found = self.server.objects.pop(name, None)
+            status = '204 No Content' if found is not None else '404 Not Found'
+            responses.append(
+                f"--response_boundary\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n"
+            )
+        payload = (''.join(responses) + "--response_boundary--\r\n").encode()
+        self.reply(200, payload, {'Content-Type': 'multipart/mixed; boundary=response_boundary'})
+
+    def signed_get(self, parts, query):
+        server = self.server
+        name = unquote(parts.path[len(server.bucket) + 2:])
+        if server.hmac_secret is not None:
+            signature = query.pop('X-Goog-Signature', None)
+            stamp = datetime.strptime(query['X-Goog-Date'], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            access_id = query['X-Goog-Credential'].split('/')[0]
+            params = {key: value for key, value in query.items() if not key.startswith('X-Goog-')}
+            expected = gcs.sign_url(
+                f"http://{self.headers['Host']}", server.bucket, name, access_id, server.hmac_secret,
+                int(query['X-Goog-Expires']), params, now=stamp,
+            )
+            expired = (datetime.now(timezone.utc) - stamp).total_seconds() > int(query['X-Goog-Expires'])
+            if expired or expected.rpartition('X-Goog-Signature=')[2] != signature:
+                return self.reply(403, b'SignatureDoesNotMatch')
+        data = server.objects.get(name)
+        if data is None:
+            return self.reply(404, b'NoSuchKey')
+        headers = {}
+        if 'response-content-disposition' in query:
+            headers['Content-Disposition'] = query['response-content-disposition']
+        if 'response-content-type' in query:
+            headers['Content-Type'] = query['response-content-type']
+        self.ranged(data, headers)
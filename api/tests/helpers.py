@@ -0,0 +1,14 @@
+"""Helpers shared by several test modules; fixtures live in conftest."""
+
+
+def rollup(obj):
+    obj.refresh_from_db()
+    return obj.total_bytes, obj.file_count, obj.folder_count
+
+
+def download(client, file, **headers):
+    return client.get(f"/api/file/{file.uuid}/download/", **headers)
+
+
+def body(response):
+    return b"".join(response.streaming_content)
@@ -0,0 +1,69 @@
+import io
+import zipfile
+
+import pytest
+from rest_framework import status
+
+from api.storage.models import Folder
+
+
+@pytest.fixture
+def docs(create_user):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    return Folder.objects.create(name="docs", parent=root, owner=create_user)
+
+
+def read_archive(response):
+    assert response.streaming
+    return zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+
+@pytest.mark.django_db
+def test_folder_archive_streams_subtree(auth_client, create_user, docs, make_file):
+    work = Folder.objects.create(name="work", parent=docs, owner=create_user)
+    Folder.objects.create(name="empty", parent=docs, owner=create_user)
+    make_file("a.txt", b"hello", folder=docs)
+    make_file("a.txt", b"again", folder=docs)
+    make_file("b.bin", bytes(range(256)) * 1000, folder=work)
+
+    response = auth_client.get(f"/api/folder/{docs.uuid}/archive/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"] == "application/zip"
+    assert "Content-Length" not in response
+    assert 'filename="docs.zip"' in response["Content-Disposition"]
+
+    archive = read_archive(response)
+    assert archive.testzip() is None
+    assert set(archive.namelist()) == {
+        "docs/", "docs/work/", "docs/empty/", "docs/a.txt", "docs/a (2).txt", "docs/work/b.bin",
+    }
+    assert {archive.read("docs/a.txt"), archive.read("docs/a (2).txt")} == {b"hello", b"again"}
+    assert archive.read("docs/work/b.bin") == bytes(range(256)) * 1000
+    assert all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist())
+
+
+@pytest.mark.django_db
+def test_folder_archive_deflate(auth_client, docs, make_file):
+    make_file("zeros.bin", b"\0" * 100000, folder=docs)
+    response = auth_client.get(f"/api/folder/{docs.uuid}/archive/?compression=deflate")
+    archive = read_archive(response)
+    info = archive.getinfo("docs/zeros.bin")
+    assert info.compress_type == zipfile.ZIP_DEFLATED
+    assert info.compress_size < 1000
+    assert archive.read("docs/zeros.bin") == b"\0" * 100000
+
+
+@pytest.mark.django_db
+def test_folder_archive_is_produced_incrementally(auth_client, docs, make_file, settings):
+    settings.DOWNLOAD_CHUNK_SIZE = 1024
+    make_file("big.bin", b"x" * 50000, folder=docs)
+    response = auth_client.get(f"/api/folder/{docs.uuid}/archive/")
+    chunks = list(response.streaming_content)
+    assert len(chunks) > 40
+    assert max(len(chunk) for chunk in chunks) < 4096
+
+
+@pytest.mark.django_db
+def test_folder_archive_rejects_unknown_compression(auth_client, docs):
+    response = auth_client.get(f"/api/folder/{docs.uuid}/archive/?compression=lzma")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
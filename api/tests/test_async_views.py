@@ -0,0 +1,112 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.storage.models import File, Folder, UploadChunk
+
+
+User = get_user_model()
+
+
+def bearer(user):
+    return {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+
+
+@pytest.fixture
+def token(create_user):
+    return bearer(create_user)
+
+
+@async_to_sync
+async def fetch(method, url, auth=None, headers=None, **extra):
+    # AsyncClient only turns per-request headers into ASGI headers.
+    response = await getattr(AsyncClient(), method)(url, headers={**(auth or {}), **(headers or {})}, **extra)
+    if response.streaming:
+        assert response.is_async
+        response.body = b"".join([part async for part in response.streaming_content])
+    return response
+
+
+@pytest.mark.django_db(transaction=True)
+def test_download_streams_from_the_event_loop(token, make_file):
+    file = make_file("a.bin", bytes(range(256)) * 100)
+
+    response = fetch("get", f"/api/file/{file.uuid}/download/", token)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.body == bytes(range(256)) * 100
+    assert response["ETag"] == f'"{file.blob_id}"'
+
+    response = fetch("get", f"/api/file/{file.uuid}/download/", token, headers={"Range": "bytes=10-19"})
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.body == bytes(range(10, 20))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_details_match_the_drf_views(token, auth_client, create_user, make_file):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    file = make_file("a.txt", b"hello", folder=docs)
+
+    response = fetch("get", f"/api/folder/{docs.uuid}/", token)
+    assert response.status_code == status.HTTP_200_OK
+    expected = auth_client.get(f"/api/folder/{docs.uuid}/")
+    assert response.json() == expected.json()
+    assert response["ETag"] == expected["ETag"]
+    assert fetch("get", f"/api/folder/{docs.uuid}/", token, headers={"If-None-Match": response["ETag"]}).status_code == 304
+
+    response = fetch("get", f"/api/file/{file.uuid}/", token)
+    assert response.json() == auth_client.get(f"/api/file/{file.uuid}/").json()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_upload_chunk(token, auth_client):
+    session = auth_client.post("/api/upload/", {"name": "a.bin", "size": 5}, format="json").data
+    response = fetch(
+        "put", f"/api/upload/{session['uuid']}/chunks/0/", token, data=b"hello",
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"index": 0, "size": 5}
+    assert UploadChunk.objects.filter(session__uuid=session["uuid"]).count() == 1
+
+    response = fetch(
+        "put", f"/api/upload/{session['uuid']}/chunks/1/", token, data=b"x", content_type="application/octet-stream",
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_views_authenticate(make_file):
+    file = make_file("a.txt", b"hello")
+    assert fetch("get", f"/api/file/{file.uuid}/").status_code == status.HTTP_401_UNAUTHORIZED
+    bad = {"Authorization": "Bearer nonsense"}
+    assert fetch("get", f"/api/file/{file.uuid}/download/", bad).status_code == status.HTTP_401_UNAUTHORIZED
+
+    other = User.objects.create_user(username="otheruser", email="other@example.com", password="strongpassword123")
+    response = fetch("get", f"/api/file/{file.uuid}/download/", bearer(other))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db(transaction=True)
+def test_other_methods_reach_the_drf_views(token, make_file):
+    file = make_file("a.txt", b"hello")
+    response = fetch("delete", f"/api/file/{file.uuid}/", token)
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert not File.objects.filter(pk=file.pk).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_native_views_share_the_drf_buckets(token, auth_client, make_file, settings):
+    settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": {"download": "2/min"}}
+    file = make_file("a.txt", b"hello")
+    assert fetch("get", f"/api/file/{file.uuid}/download/", token).body == b"hello"
+    assert auth_client.get(f"/api/file/{file.uuid}/download/").status_code == status.HTTP_200_OK
+
+    response = fetch("get", f"/api/file/{file.uuid}/download/", token)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response["Retry-After"]) >= 1
+    # Details draw from the metadata bucket.
+    assert fetch("get", f"/api/file/{file.uuid}/", token).status_code == status.HTTP_200_OK
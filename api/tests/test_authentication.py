@@ -0,0 +1,97 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from api.user import authentication
+
+
+@pytest.fixture
+def tokens(client, registered_user, login_url, user_data):
+    response = client.post(login_url, {"username": user_data["username"], "password": user_data["password"]})
+    assert response.status_code == status.HTTP_200_OK
+    return response.data
+
+
+def bearer(access):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+    return client
+
+
+def user_queries(queries):
+    return [query["sql"] for query in queries.captured_queries if '"user_customuser"' in query["sql"]]
+
+
+@pytest.mark.django_db
+def test_requests_do_not_load_the_user(tokens):
+    client = bearer(tokens["access"])
+    assert client.get("/api/changes/").status_code == status.HTTP_200_OK
+
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get("/api/changes/").status_code == status.HTTP_200_OK
+        assert client.get("/api/user/dashboard/").status_code == status.HTTP_200_OK
+    assert user_queries(queries) == []
+
+
+@pytest.mark.django_db
+def test_full_db_verification_is_an_option(tokens, settings):
+    settings.AUTH_VERIFY_USER_IN_DB = True
+    client = bearer(tokens["access"])
+    client.get("/api/changes/")
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get("/api/changes/").status_code == status.HTTP_200_OK
+    assert len(user_queries(queries)) == 1
+
+
+@pytest.mark.django_db
+def test_deactivated_user_is_rejected_at_once(tokens, django_user_model):
+    client = bearer(tokens["access"])
+    assert client.get("/api/changes/").status_code == status.HTTP_200_OK
+
+    user = django_user_model.objects.get(username="testuser")
+    user.is_active = False
+    user.save()
+    assert client.get("/api/changes/").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_user_details_are_loaded_in_full(tokens):
+    response = bearer(tokens["access"]).get("/api/user/default/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["email"] == "testuser@example.com"
+
+
+@pytest.mark.django_db
+def test_refresh_rotates_and_rejects_reuse(client, tokens):
+    response = client.post("/api/user/token-refresh/", {"refresh": tokens["refresh"]})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["refresh"] != tokens["refresh"]
+    assert bearer(response.data["access"]).get("/api/changes/").status_code == status.HTTP_200_OK
+
+    response = client.post("/api/user/token-refresh/", {"refresh": tokens["refresh"]})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert BlacklistedToken.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_reuse_is_rejected_even_when_the_blacklist_set_missed_it(client, tokens, settings):
+    settings.AUTH_BLACKLIST_SYNC_SECONDS = 3600
+    assert client.post("/api/user/token-refresh/", {"refresh": tokens["refresh"]}).status_code == status.HTTP_200_OK
+    # As if another process had blacklisted it and this one has not synced yet.
+    authentication.blacklist.jtis.clear()
+
+    response = client.post("/api/user/token-refresh/", {"refresh": tokens["refresh"]})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert BlacklistedToken.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_refresh_skips_the_blacklist_query(client, tokens):
+    refresh = client.post("/api/user/token-refresh/", {"refresh": tokens["refresh"]}).data["refresh"]
+    with CaptureQueriesContext(connection) as queries:
+        assert client.post("/api/user/token-refresh/", {"refresh": refresh}).status_code == status.HTTP_200_OK
+    assert user_queries(queries) == []
+    assert not [query for query in queries.captured_queries if query["sql"].startswith("SELECT") and "blacklistedtoken" in query["sql"]]
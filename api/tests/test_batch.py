@@ -0,0 +1,116 @@
+import pytest
+from rest_framework import status
+
+from api.storage.models import Blob, File, Folder
+from api.tests.helpers import rollup
+
+
+@pytest.fixture
+def folders(root, create_user):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    work = Folder.objects.create(name="work", parent=docs, owner=create_user)
+    archive = Folder.objects.create(name="archive", parent=root, owner=create_user)
+    return docs, work, archive
+
+
+@pytest.mark.django_db
+def test_move_many_files_in_constant_queries(auth_client, folders, make_file, django_assert_max_num_queries):
+    docs, work, archive = folders
+    files = [make_file(f"{index}.jpg", b"x" * index, folder=work) for index in range(1, 21)]
+
+    # Includes three for the change journal entries and one for the folders whose listings are retired.
+    with django_assert_max_num_queries(16):
+        response = auth_client.post("/api/batch/move/", {
+            "files": [str(file.uuid) for file in files],
+            "target": str(archive.uuid),
+        }, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["succeeded"] == 20
+    assert File.objects.filter(folder=archive).count() == 20
+    assert rollup(work) == (0, 0, 0)
+    assert rollup(docs) == (0, 0, 1)
+    assert rollup(archive) == (210, 20, 0)
+
+
+@pytest.mark.django_db
+def test_move_reports_per_item_results(auth_client, root, folders, make_file, other_client):
+    docs, work, archive = folders
+    file = make_file("a.txt", b"abc", folder=docs)
+    foreign = Folder.objects.exclude(owner=file.owner).first()
+
+    response = auth_client.post("/api/batch/move/", {
+        "files": [str(file.uuid)],
+        "folders": [str(archive.uuid), str(docs.uuid), str(root.uuid), str(foreign.uuid)],
+        "target": str(work.uuid),
+    }, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    statuses = [(item["type"], item["status"]) for item in response.data["results"]]
+    assert statuses == [("file", "ok"), ("folder", "ok"), ("folder", "invalid"), ("folder", "invalid"), ("folder", "not_found")]
+    file.refresh_from_db()
+    archive.refresh_from_db()
+    assert file.folder == work
+    assert archive.parent_id == work.uuid
+    assert rollup(work) == (3, 1, 1)
+
+
+@pytest.mark.django_db
+def test_copy_shares_blobs(auth_client, create_user, folders, make_file):
+    docs, work, archive = folders
+    make_file("a.txt", b"hello", folder=work)
+    single = make_file("b.txt", b"world", folder=archive)
+
+    response = auth_client.post("/api/batch/copy/", {
+        "files": [str(single.uuid)],
+        "folders": [str(docs.uuid)],
+        "target": str(archive.uuid),
+    }, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["succeeded"] == 2
+
+    copy = Folder.objects.get(uuid=response.data["results"][1]["copy"])
+    assert copy.parent_id == archive.uuid
+    copied_work = Folder.objects.get(parent=copy)
+    assert copied_work.path == f"{copy.path}{copy.pk}/"
+    assert File.objects.get(folder=copied_work).blob_id == File.objects.get(folder=work).blob_id
+    assert Blob.objects.count() == 2
+    assert sorted(Blob.objects.values_list("ref_count", flat=True)) == [2, 2]
+    assert rollup(archive) == (15, 3, 2)
+    assert rollup(create_user.usage) == (20, 4, 6)
+
+
+@pytest.mark.django_db
+def test_copy_into_own_subtree_is_rejected(auth_client, folders):
+    docs, work, archive = folders
+    response = auth_client.post("/api/batch/copy/", {"folders": [str(docs.uuid)], "target": str(work.uuid)}, format="json")
+    assert response.data["results"][0]["status"] == "invalid"
+    assert Folder.objects.filter(name="docs").count() == 1
+
+
+@pytest.mark.django_db
+def test_delete_moves_items_to_trash(auth_client, create_user, root, folders, make_file):
+    docs, work, archive = folders
+    make_file("a.txt", b"hello", folder=work)
+    loose = make_file("b.txt", b"world", folder=archive)
+
+    response = auth_client.post("/api/batch/delete/", {
+        "files": [str(loose.uuid)],
+        "folders": [str(docs.uuid), str(work.uuid)],
+    }, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["failed"] == 0
+    results = response.data["results"]
+    assert results[1]["trash"] == results[2]["trash"]
+    assert not Folder.objects.filter(pk__in=[docs.pk, work.pk]).exists()
+    assert not File.objects.filter(pk=loose.pk).exists()
+    assert Folder.all_objects.filter(pk__in=[docs.pk, work.pk]).count() == 2
+    assert rollup(root) == (0, 0, 1)
+    # Trashed items count towards the quota until they are purged.
+    assert rollup(create_user.usage) == (10, 2, 4)
+
+
+@pytest.mark.django_db
+def test_target_must_be_owned(auth_client, other_client, make_file):
+    file = make_file("a.txt", b"abc")
+    foreign = Folder.objects.exclude(owner=file.owner).first()
+    response = auth_client.post("/api/batch/move/", {"files": [str(file.uuid)], "target": str(foreign.uuid)}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,52 @@
+import argparse
+
+import pytest
+from django.db.models import Sum
+
+from api.storage.models import Blob, File, Folder
+from benchmarks import generate
+
+
+def generate_drive(*args):
+    parser = argparse.ArgumentParser()
+    generate.add_arguments(parser)
+    return generate.Generator(parser.parse_args(args), batch_size=7).run()
+
+
+@pytest.mark.django_db
+def test_generated_drive_is_consistent():
+    users = generate_drive("--users", "2", "--depth", "2", "--breadth", "3", "--files", "4",
+                           "--chain", "5", "--wide", "20", "--blobs", "3", "--blob-size", "100")
+    assert [user.username for user in users] == ["bench-0", "bench-1"]
+    user = users[0]
+
+    # Root, 3 + 9 in the tree, a chain of 5 and the wide folder.
+    assert Folder.objects.filter(owner=user).count() == 19
+    assert File.objects.filter(owner=user).count() == 13 * 4 + 4 + 20
+    assert user.usage.file_count == 76
+    assert user.usage.total_bytes == 7600
+
+    for folder in Folder.objects.filter(owner=user).select_related("parent"):
+        if folder.parent is None:
+            assert (folder.path, folder.depth) == ("/", 0)
+        else:
+            assert folder.path == folder.parent.subtree_prefix
+            assert folder.depth == folder.parent.depth + 1
+    assert Folder.objects.filter(owner=user).order_by("-depth").first().depth == 5
+
+    root = Folder.objects.get(uuid=user.root_folder_uuid)
+    assert (root.file_count, root.folder_count, root.total_bytes) == (76, 18, 7600)
+    assert Blob.objects.aggregate(refs=Sum("ref_count"))["refs"] == File.objects.count() == 152
+
+
+@pytest.mark.django_db
+def test_generation_is_reproducible():
+    generate_drive("--users", "1", "--depth", "1", "--breadth", "2", "--files", "5", "--wide", "5")
+    first = list(File.objects.order_by("pk").values_list("name", "blob_id"))
+    File.objects.all().delete()
+    Folder.objects.all().delete()
+    Blob.objects.all().delete()
+    generate.bench_users().delete()
+
+    generate_drive("--users", "1", "--depth", "1", "--breadth", "2", "--files", "5", "--wide", "5")
+    assert list(File.objects.order_by("pk").values_list("name", "blob_id")) == first
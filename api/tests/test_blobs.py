@@ -0,0 +1,86 @@
+import hashlib
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework import status
+
+from api.storage.models import Blob, File
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_same_content_is_stored_once(make_file):
+    first = make_file("a.txt", b"same bytes")
+    second = make_file("b.txt", b"same bytes")
+    assert first.blob_id == second.blob_id == sha256(b"same bytes")
+    assert Blob.objects.count() == 1
+    assert Blob.objects.get().ref_count == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_blob_is_collected_after_last_reference(make_file):
+    first = make_file("a.txt", b"payload")
+    second = make_file("b.txt", b"payload")
+    storage = Blob._meta.get_field("file").storage
+    name = first.blob.file.name
+
+    first.delete()
+    assert Blob.objects.get().ref_count == 1
+    second.delete()
+    assert not Blob.objects.exists()
+    assert not storage.exists(name)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_owner_cascade_releases_references(make_file, create_user):
+    make_file("a.txt", b"payload")
+    make_file("b.txt", b"payload")
+    other = get_user_model().objects.create_user(username="keeper", password="strongpassword123")
+    make_file("c.txt", b"payload", owner=other)
+    assert Blob.objects.get().ref_count == 3
+
+    create_user.delete()
+    assert Blob.objects.get().ref_count == 1
+
+
+@pytest.mark.django_db
+def test_preflight_hash_completes_without_bytes(auth_client, make_file):
+    existing = make_file("installer.exe", b"x" * 100)
+    response = auth_client.post(
+        "/api/upload/",
+        {"name": "copy.exe", "size": 100, "sha256": existing.blob_id},
+        format="json",
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["status"] == "complete"
+    assert response.data["file"]["name"] == "copy.exe"
+    assert File.objects.get(uuid=response.data["file"]["uuid"]).blob_id == existing.blob_id
+
+
+@pytest.mark.django_db
+def test_preflight_hash_of_someone_elses_content_needs_the_bytes(auth_client, make_file, create_user):
+    other = get_user_model().objects.create_user(username="keeper", password="strongpassword123")
+    existing = make_file("secret.txt", b"y" * 100, owner=other)
+    response = auth_client.post(
+        "/api/upload/",
+        {"name": "guess.txt", "size": 100, "sha256": existing.blob_id},
+        format="json",
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["status"] == "active"
+    assert not File.objects.filter(owner=create_user, blob_id=existing.blob_id).exists()
+
+
+@pytest.mark.django_db
+def test_commit_rejects_checksum_mismatch(auth_client):
+    session = auth_client.post(
+        "/api/upload/", {"name": "a.txt", "size": 3, "sha256": sha256(b"xyz")}, format="json"
+    ).data
+    assert session["status"] == "active"
+    auth_client.put(f"/api/upload/{session['uuid']}/chunks/0/", data=b"abc", content_type="application/octet-stream")
+    response = auth_client.post(f"/api/upload/{session['uuid']}/commit/")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert not File.objects.exists()
@@ -0,0 +1,120 @@
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+
+from api.storage.models import Change, Folder
+
+
+def head(client):
+    return client.get("/api/changes/").data["cursor"]
+
+
+def changes(client, cursor, **params):
+    response = client.get("/api/changes/", {"cursor": cursor, **params})
+    assert response.status_code == status.HTTP_200_OK
+    return response.data
+
+
+def summary(data):
+    return [(change["type"], change["action"], change["name"]) for change in data["changes"]]
+
+
+@pytest.mark.django_db
+def test_changes_after_cursor(auth_client, create_user, root, make_file):
+    cursor = head(auth_client)
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    file = make_file("a.txt", b"hello", folder=docs)
+    file.name = "b.txt"
+    file.save()
+
+    data = changes(auth_client, cursor)
+    assert summary(data) == [("folder", "created", "docs"), ("file", "created", "a.txt"), ("file", "updated", "b.txt")]
+    assert data["changes"][1]["parent"] == str(docs.uuid)
+    assert data["changes"][1]["size"] == 5
+    assert [change["seq"] for change in data["changes"]] == sorted(change["seq"] for change in data["changes"])
+    assert data["cursor"] == data["changes"][-1]["seq"]
+    assert data["has_more"] is False
+
+    idle = auth_client.get("/api/changes/", {"cursor": data["cursor"]})
+    assert idle.data == {"cursor": data["cursor"], "has_more": False, "changes": []}
+    assert len(idle.content) < 100
+
+
+@pytest.mark.django_db
+def test_changes_are_paged(auth_client, create_user, root):
+    cursor = head(auth_client)
+    for index in range(5):
+        Folder.objects.create(name=f"f{index}", parent=root, owner=create_user)
+
+    first = changes(auth_client, cursor, page_size=3)
+    assert first["has_more"] is True
+    second = changes(auth_client, first["cursor"], page_size=3)
+    assert second["has_more"] is False
+    assert [name for _, _, name in summary(first) + summary(second)] == [f"f{index}" for index in range(5)]
+
+
+@pytest.mark.django_db
+def test_moves_and_deletes_are_recorded(auth_client, create_user, root, make_file):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    work = Folder.objects.create(name="work", parent=root, owner=create_user)
+    file = make_file("a.txt", b"hello", folder=docs)
+    cursor = head(auth_client)
+
+    auth_client.post("/api/batch/move/", {"files": [str(file.uuid)], "target": str(work.uuid)}, format="json")
+    auth_client.patch(f"/api/folder/{work.uuid}/", {"parent": str(docs.uuid)}, format="json")
+    auth_client.delete(f"/api/folder/{docs.uuid}/")
+
+    data = changes(auth_client, cursor)
+    assert summary(data) == [("file", "moved", "a.txt"), ("folder", "moved", "work"), ("folder", "deleted", "docs")]
+    assert data["changes"][0]["parent"] == str(work.uuid)
+
+
+@pytest.mark.django_db
+def test_restore_and_copy_record_whole_subtrees(auth_client, create_user, root, make_file):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    make_file("a.txt", b"hello", folder=docs)
+    entry = auth_client.delete(f"/api/folder/{docs.uuid}/").data
+    cursor = head(auth_client)
+
+    auth_client.post(f"/api/trash/{entry['uuid']}/restore/")
+    auth_client.post("/api/batch/copy/", {"folders": [str(docs.uuid)], "target": str(root.uuid)}, format="json")
+
+    assert summary(changes(auth_client, cursor)) == [
+        ("folder", "created", "docs"), ("file", "created", "a.txt"),
+        ("folder", "created", "docs"), ("file", "created", "a.txt"),
+    ]
+
+
+@pytest.mark.django_db
+def test_changes_are_per_user(auth_client, other_client, create_user, root):
+    cursor = head(other_client)
+    Folder.objects.create(name="docs", parent=root, owner=create_user)
+    assert changes(other_client, cursor)["changes"] == []
+
+
+@pytest.mark.django_db
+def test_compacted_cursor_asks_for_resync(auth_client, create_user, root):
+    cursor = head(auth_client)
+    Folder.objects.create(name="old", parent=root, owner=create_user)
+    Change.objects.update(created_at=timezone.now() - timedelta(days=60))
+    Folder.objects.create(name="new", parent=root, owner=create_user)
+
+    call_command("compact_changes")
+    assert list(Change.objects.values_list("name", flat=True)) == ["new"]
+
+    response = auth_client.get("/api/changes/", {"cursor": cursor})
+    assert response.status_code == status.HTTP_410_GONE
+    assert response.data["reset"] is True
+    assert response.data["cursor"] == head(auth_client)
+
+    current = Change.objects.get().seq - 1
+    assert summary(changes(auth_client, current)) == [("folder", "created", "new")]
+
+
+@pytest.mark.django_db
+def test_cursor_from_the_future_asks_for_resync(auth_client):
+    response = auth_client.get("/api/changes/", {"cursor": head(auth_client) + 10})
+    assert response.status_code == status.HTTP_410_GONE
@@ -0,0 +1,105 @@
+import gzip
+import os
+
+import pytest
+from rest_framework import status
+
+from api.storage import compression
+from api.storage.models import Blob
+from api.tests.helpers import body, download
+
+
+TEXT = b"".join(b"line %d of a log file that compresses well\n" % number for number in range(20000))
+
+
+@pytest.fixture
+def small_frames(settings):
+    settings.COMPRESSION_FRAME_SIZE = 64 * 1024
+
+
+def test_choose_skips_small_compressed_and_random_content():
+    from django.core.files.base import ContentFile
+
+    assert compression.choose(ContentFile(TEXT), len(TEXT)) == compression.GZIP
+    assert compression.choose(ContentFile(TEXT[:100]), 100) == ""
+    assert compression.choose(ContentFile(TEXT, name="notes.zip"), len(TEXT)) == ""
+    assert compression.choose(ContentFile(gzip.compress(TEXT)), len(TEXT)) == ""
+    assert compression.choose(ContentFile(os.urandom(100000)), 100000) == ""
+
+
+@pytest.mark.django_db
+def test_text_is_stored_compressed_and_random_bytes_as_is(make_file, small_frames):
+    text = make_file("log.txt", TEXT)
+    assert text.size == len(TEXT)
+    assert text.blob.codec == "gzip"
+    assert text.blob.stored_size < len(TEXT) // 4
+    assert len(text.blob.frames) == -(-len(TEXT) // (64 * 1024))
+    # The stored object is a single, valid gzip stream.
+    with text.blob.file.open("rb") as stored:
+        assert gzip.decompress(stored.read()) == TEXT
+
+    noise = make_file("noise.bin", os.urandom(100000))
+    assert noise.blob.codec == ""
+    assert noise.blob.stored_size is None
+
+
+@pytest.mark.django_db
+def test_disabled_stores_as_is(make_file, settings):
+    settings.COMPRESSION_ENABLED = False
+    assert make_file("log.txt", TEXT).blob.codec == ""
+
+
+@pytest.mark.django_db
+def test_downloads_and_ranges_are_decoded(auth_client, make_file, small_frames):
+    file = make_file("log.txt", TEXT)
+
+    response = download(auth_client, file)
+    assert response.status_code == status.HTTP_200_OK
+    assert "Content-Encoding" not in response
+    assert response["Content-Length"] == str(len(TEXT))
+    assert "Accept-Encoding" in response["Vary"]
+    assert body(response) == TEXT
+
+    # Across a frame boundary, and with an Accept-Encoding a range does not go out encoded.
+    start, end = 64 * 1024 - 10, 3 * 64 * 1024 + 10
+    response = download(auth_client, file, HTTP_RANGE=f"bytes={start}-{end}", HTTP_ACCEPT_ENCODING="gzip")
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert "Content-Encoding" not in response
+    assert body(response) == TEXT[start:end + 1]
+
+    response = download(auth_client, file, HTTP_RANGE="bytes=0-1, 200000-200001")
+    assert b"Content-Range: bytes 200000-200001/" in body(response)
+
+
+@pytest.mark.django_db
+def test_clients_accepting_gzip_get_the_stored_bytes(auth_client, make_file):
+    file = make_file("log.txt", TEXT)
+
+    response = download(auth_client, file, HTTP_ACCEPT_ENCODING="br;q=1.0, gzip;q=0.5")
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response["Vary"]
+    assert response["Content-Length"] == str(file.blob.stored_size)
+    payload = b"".join(response.streaming_content) if response.streaming else response.content
+    assert len(payload) == file.blob.stored_size
+    assert gzip.decompress(payload) == TEXT
+
+    # Each representation has its own validator.
+    identity = download(auth_client, file)
+    assert identity["ETag"] != response["ETag"]
+    response = download(auth_client, file, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert "Accept-Encoding" in response["Vary"]
+
+    response = download(auth_client, file, HTTP_ACCEPT_ENCODING="gzip;q=0, *")
+    assert "Content-Encoding" not in response
+
+
+@pytest.mark.django_db
+def test_compressed_content_is_streamed_not_handed_to_the_proxy(auth_client, make_file, settings):
+    settings.DOWNLOAD_SENDFILE_MODE = "x-accel-redirect"
+    file = make_file("log.txt", TEXT)
+    response = download(auth_client, file)
+    assert "X-Accel-Redirect" not in response
+    assert body(response) == TEXT
+    assert Blob.objects.get().codec == "gzip"
@@ -0,0 +1,60 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.storage.models import Folder
+
+
+def grow(owner, parent, width, levels, make_file):
+    if levels == 0:
+        return
+    for index in range(width):
+        child = Folder.objects.create(name=f"{parent.name}-{index}", parent=parent, owner=owner)
+        make_file(f"{child.name}.txt", b"x", folder=child)
+        grow(owner, child, width, levels - 1, make_file)
+
+
+def dashboard_queries(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return response, len(queries)
+
+
+@pytest.mark.django_db
+def test_tree_mode_nests_everything(auth_client, create_user, make_file):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    grow(create_user, root, width=2, levels=2, make_file=make_file)
+
+    response = auth_client.get("/api/user/dashboard/?tree=1")
+    tree = response.data[0]
+    assert tree["name"] == "root"
+    assert [child["name"] for child in tree["subfolders"]] == ["root-0", "root-1"]
+    assert [child["name"] for child in tree["subfolders"][0]["subfolders"]] == ["root-0-0", "root-0-1"]
+    assert tree["subfolders"][0]["files"][0]["name"] == "root-0.txt"
+
+    response = auth_client.get("/api/user/dashboard/?tree=1&depth=1")
+    assert response.data[0]["subfolders"][0]["subfolders"] == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_tree_mode_query_count_does_not_grow(auth_client, create_user, make_file):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    grow(create_user, root, width=1, levels=1, make_file=make_file)
+    _, small = dashboard_queries(auth_client, "/api/user/dashboard/?tree=1")
+
+    grow(create_user, Folder.objects.get(name="root-0"), width=3, levels=3, make_file=make_file)
+    response, large = dashboard_queries(auth_client, "/api/user/dashboard/?tree=1")
+
+    assert Folder.objects.filter(owner=create_user).count() > 30
+    assert large == small == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_default_mode_query_count_is_constant(auth_client, create_user, make_file):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    grow(create_user, root, width=1, levels=1, make_file=make_file)
+    _, small = dashboard_queries(auth_client, "/api/user/dashboard/")
+    grow(create_user, root, width=4, levels=1, make_file=make_file)
+    _, large = dashboard_queries(auth_client, "/api/user/dashboard/")
+    assert large == small
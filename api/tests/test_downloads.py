@@ -0,0 +1,80 @@
+import pytest
+from django.test import override_settings
+from rest_framework import status
+
+from api.tests.helpers import body, download
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def stored_file(make_file):
+    return make_file("clip.mp4", CONTENT)
+
+
+@pytest.mark.django_db
+def test_full_download(auth_client, stored_file):
+    response = download(auth_client, stored_file)
+    assert response.status_code == status.HTTP_200_OK
+    assert body(response) == CONTENT
+    assert response["Content-Length"] == str(len(CONTENT))
+    assert response["Content-Type"] == "video/mp4"
+    assert response["ETag"].startswith('"')
+    assert "Last-Modified" in response
+
+
+@pytest.mark.django_db
+def test_single_range(auth_client, stored_file):
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=10-19")
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response["Content-Range"] == f"bytes 10-19/{len(CONTENT)}"
+    assert body(response) == CONTENT[10:20]
+
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=-5")
+    assert body(response) == CONTENT[-5:]
+
+
+@pytest.mark.django_db
+def test_multi_range(auth_client, stored_file):
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=0-1, 100-101")
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response["Content-Type"].startswith("multipart/byteranges; boundary=")
+    payload = body(response)
+    assert len(payload) == int(response["Content-Length"])
+    assert b"Content-Range: bytes 0-1/1024\r\n\r\n" + CONTENT[0:2] in payload
+    assert b"Content-Range: bytes 100-101/1024\r\n\r\n" + CONTENT[100:102] in payload
+
+
+@pytest.mark.django_db
+def test_unsatisfiable_range(auth_client, stored_file):
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=5000-")
+    assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    assert response["Content-Range"] == "bytes */1024"
+
+
+@pytest.mark.django_db
+def test_conditional_requests(auth_client, stored_file):
+    etag = download(auth_client, stored_file)["ETag"]
+    assert download(auth_client, stored_file, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+
+    response = download(auth_client, stored_file, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+    assert response.status_code == status.HTTP_200_OK
+    assert body(response) == CONTENT
+
+
+@pytest.mark.django_db
+@override_settings(DOWNLOAD_SENDFILE_MODE="x-accel-redirect", DOWNLOAD_ACCEL_REDIRECT_PREFIX="/protected/")
+def test_accel_redirect_mode(auth_client, stored_file):
+    response = download(auth_client, stored_file, HTTP_ACCEPT="video/mp4")
+    assert response.status_code == status.HTTP_200_OK
+    assert response["X-Accel-Redirect"] == f"/protected/{stored_file.file.name}"
+    assert response.content == b""
+
+
+@pytest.mark.django_db
+def test_download_of_foreign_file_is_404(other_client, stored_file):
+    assert download(other_client, stored_file).status_code == status.HTTP_404_NOT_FOUND
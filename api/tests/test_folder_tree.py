@@ -0,0 +1,95 @@
+import pytest
+from rest_framework import status
+
+from api.storage.models import Folder
+
+
+@pytest.fixture
+def chain(root, create_user):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    year = Folder.objects.create(name="2024", parent=docs, owner=create_user)
+    q1 = Folder.objects.create(name="q1", parent=year, owner=create_user)
+    return docs, year, q1
+
+
+@pytest.mark.django_db
+def test_paths_are_maintained_on_create(root, chain):
+    docs, year, q1 = chain
+    assert root.path == "/" and root.depth == 0
+    assert q1.path == f"/{root.pk}/{docs.pk}/{year.pk}/"
+    assert q1.depth == 3
+
+
+@pytest.mark.django_db
+def test_move_rebases_descendants(auth_client, root, chain, create_user):
+    docs, year, q1 = chain
+    archive = Folder.objects.create(name="archive", parent=root, owner=create_user)
+
+    response = auth_client.patch(f"/api/folder/{year.uuid}/", {"parent": str(archive.uuid)}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+
+    q1.refresh_from_db()
+    assert q1.path == f"/{root.pk}/{archive.pk}/{year.pk}/"
+    assert q1.depth == 3
+
+
+@pytest.mark.django_db
+def test_move_into_own_subtree_is_rejected(auth_client, chain):
+    docs, year, q1 = chain
+    response = auth_client.patch(f"/api/folder/{docs.uuid}/", {"parent": str(q1.uuid)}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    with pytest.raises(ValueError):
+        docs.parent = q1
+        docs.save()
+
+
+@pytest.mark.django_db
+def test_create_and_rename(auth_client, root):
+    response = auth_client.post("/api/folder/", {"name": "photos"}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["parent"] == root.uuid
+
+    response = auth_client.patch(f"/api/folder/{response.data['uuid']}/", {"name": "pictures"}, format="json")
+    assert response.data["name"] == "pictures"
+    assert Folder.objects.get(name="pictures").path == f"/{root.pk}/"
+
+
+@pytest.mark.django_db
+def test_ancestors_in_one_query(auth_client, chain, django_assert_max_num_queries):
+    docs, year, q1 = chain
+    response = auth_client.get(f"/api/folder/{q1.uuid}/ancestors/")
+    assert [item["name"] for item in response.data] == ["root", "docs", "2024"]
+
+    with django_assert_max_num_queries(2):
+        auth_client.get(f"/api/folder/{q1.uuid}/ancestors/")
+
+
+@pytest.mark.django_db
+def test_subtree_listing(auth_client, root, chain, make_file):
+    docs, year, q1 = chain
+    make_file("report.pdf", b"pdf", folder=q1)
+    make_file("outside.txt", b"txt", folder=root)
+
+    response = auth_client.get(f"/api/folder/{docs.uuid}/subtree/")
+    assert [item["name"] for item in response.data["folders"]] == ["2024", "q1"]
+    assert [item["name"] for item in response.data["files"]] == ["report.pdf"]
+
+    response = auth_client.get(f"/api/folder/{docs.uuid}/subtree/?depth=1")
+    assert [item["name"] for item in response.data["folders"]] == ["2024"]
+    assert response.data["files"] == []
+
+
+@pytest.mark.django_db
+def test_path_lookup(auth_client, chain, make_file):
+    docs, year, q1 = chain
+    make_file("report.pdf", b"pdf", folder=year)
+
+    response = auth_client.get("/api/path/docs/2024/report.pdf")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["type"] == "file"
+
+    response = auth_client.get("/api/path/docs/2024/q1/")
+    assert response.data["type"] == "folder"
+    assert response.data["uuid"] == str(q1.uuid)
+
+    assert auth_client.get("/api/path/docs/missing/report.pdf").status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,224 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from rest_framework import status
+
+from api.storage import gcs, trash
+from api.storage.backends import GoogleCloudStorage
+from api.storage.models import File, Folder
+from api.tests.fake_gcs import FakeGCSServer
+
+
+BUCKET = "drive"
+HMAC_ID = "GOOG1TESTKEY"
+HMAC_SECRET = "test-secret"
+
+
+@pytest.fixture
+def fake_gcs():
+    server = FakeGCSServer(BUCKET, hmac_secret=HMAC_SECRET).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    pool = gcs._pools.pop(server.endpoint, None)
+    if pool is not None:
+        pool.close()
+
+
+def storage_options(server, **options):
+    return {
+        "bucket_name": BUCKET, "endpoint": server.endpoint, "hmac_access_id": HMAC_ID, "hmac_secret": HMAC_SECRET,
+        "pool_size": 4, "upload_part_size": 1024, "upload_workers": 4, **options,
+    }
+
+
+@pytest.fixture
+def storage(fake_gcs):
+    return GoogleCloudStorage(**storage_options(fake_gcs))
+
+
+@pytest.fixture
+def default_gcs(settings, fake_gcs):
+    settings.STORAGES = {
+        **settings.STORAGES,
+        "default": {"BACKEND": "api.storage.backends.GoogleCloudStorage", "OPTIONS": storage_options(fake_gcs)},
+    }
+    return fake_gcs
+
+
+def fetch(url, headers=None):
+    with urlopen(Request(url, headers=headers or {})) as response:
+        return response.status, response.headers, response.read()
+
+
+def test_save_open_list_and_delete(storage, fake_gcs):
+    name = storage.save("notes/a.txt", ContentFile(b"hello world"))
+    assert name == "notes/a.txt"
+    assert storage.exists(name)
+    assert storage.size(name) == 11
+    assert storage.listdir("notes") == ([], ["a.txt"])
+    assert storage.listdir("") == (["notes"], [])
+    assert storage.get_modified_time(name).year == 2024
+
+    with storage.open(name, "rb") as handle:
+        handle.seek(6)
+        assert handle.read(5) == b"world"
+        handle.seek(0)
+        assert handle.read() == b"hello world"
+
+    storage.delete(name)
+    assert not storage.exists(name)
+    storage.delete(name)
+
+
+def test_requests_reuse_pooled_connections(storage, fake_gcs):
+    storage.save("a.txt", ContentFile(b"a"))
+
+    def check():
+        for _ in range(10):
+            assert storage.exists("a.txt")
+
+    threads = [threading.Thread(target=check) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_gcs.calls("GET")) == 81
+    assert fake_gcs.connections <= 4
+
+
+def test_transient_errors_are_retried(storage, fake_gcs):
+    fake_gcs.fail_next(503, 2)
+    storage.save("a.txt", ContentFile(b"abc"))
+    assert fake_gcs.objects["a.txt"] == b"abc"
+    # The existence check before the upload failed twice, then both went through.
+    assert len(fake_gcs.requests) == 4
+
+    requests = len(fake_gcs.requests)
+    assert not storage.exists("missing.txt")
+    assert len(fake_gcs.requests) == requests + 1
+
+
+def test_large_files_use_parallel_composite_uploads(storage, fake_gcs):
+    content = os.urandom(70 * 1024 + 5)
+    fake_gcs.upload_delay = 0.02
+
+    storage.save("blobs/big.bin", ContentFile(content))
+
+    assert fake_gcs.objects["blobs/big.bin"] == content
+    assert len(fake_gcs.calls("POST", "/upload/")) == 71
+    assert 1 < fake_gcs.max_uploads_in_flight <= 4
+    # 71 parts: three compose calls of at most 32 sources, then one of those three.
+    assert len([path for _, path in fake_gcs.calls("POST") if path.endswith("/compose")]) == 4
+    assert not [name for name in fake_gcs.objects if name.startswith("tmp/")]
+
+
+def test_failed_composite_upload_removes_its_parts(storage, fake_gcs):
+    fake_gcs.fail_next(400)
+    with pytest.raises(gcs.GCSError):
+        storage.save("big.bin", ContentFile(os.urandom(8 * 1024)))
+    assert fake_gcs.objects == {}
+
+
+def test_delete_many_uses_batch_requests(storage, fake_gcs):
+    names = [f"blobs/{index:03d}" for index in range(250)]
+    fake_gcs.objects.update({name: b"x" for name in names})
+
+    storage.delete_many([*names, "blobs/missing"])
+
+    assert fake_gcs.objects == {}
+    assert len(fake_gcs.calls("POST", "/batch/")) == 3
+    assert not fake_gcs.calls("DELETE")
+
+
+def test_signed_urls(storage, fake_gcs):
+    storage.save("docs/report 1.pdf", ContentFile(b"%PDF-report"))
+    url = storage.signed_url(
+        "docs/report 1.pdf", response_type="application/pdf", response_disposition='attachment; filename="r.pdf"',
+    )
+
+    code, headers, data = fetch(url, {"Range": "bytes=5-"})
+    assert (code, data) == (206, b"report")
+    assert headers["Content-Disposition"] == 'attachment; filename="r.pdf"'
+    assert headers["Content-Type"] == "application/pdf"
+
+    with pytest.raises(HTTPError) as tampered:
+        fetch(url.replace("report%201", "report%202"))
+    assert tampered.value.code == 403
+
+    expired = gcs.sign_url(
+        fake_gcs.endpoint, BUCKET, "docs/report 1.pdf", HMAC_ID, HMAC_SECRET, 60,
+        now=datetime.now(timezone.utc) - timedelta(minutes=5),
+    )
+    with pytest.raises(HTTPError) as late:
+        fetch(expired)
+    assert late.value.code == 403
+
+
+def test_without_hmac_keys_urls_are_not_signed(fake_gcs):
+    storage = GoogleCloudStorage(**storage_options(fake_gcs, hmac_access_id=None, hmac_secret=None))
+    assert storage.signed_url("docs/report.pdf") is None
+    assert storage.url("docs/report.pdf") == f"{fake_gcs.endpoint}/{BUCKET}/docs/report.pdf"
+
+
+@pytest.mark.django_db
+def test_chunked_upload_is_composed_in_place(auth_client, default_gcs, settings, django_capture_on_commit_callbacks):
+    settings.UPLOAD_MIN_CHUNK_SIZE = 1
+    session = auth_client.post("/api/upload/", {"name": "video.bin", "size": 10, "chunk_size": 4}, format="json").data
+    for index, data in enumerate([b"0123", b"4567", b"89"]):
+        response = auth_client.put(
+            f"/api/upload/{session['uuid']}/chunks/{index}/", data=data, content_type="application/octet-stream",
+        )
+        assert response.status_code == status.HTTP_200_OK
+    uploads_before = len(default_gcs.calls("POST", "/upload/"))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = auth_client.post(f"/api/upload/{session['uuid']}/commit/")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    file = File.objects.get(uuid=response.data["uuid"])
+    assert default_gcs.objects[file.blob.file.name] == b"0123456789"
+    assert len(default_gcs.calls("POST", "/upload/")) == uploads_before
+    assert not [name for name in default_gcs.objects if name.startswith("uploads/")]
+
+
+@pytest.mark.django_db
+def test_download_redirects_to_signed_url(auth_client, default_gcs, make_file, settings):
+    settings.DOWNLOAD_SENDFILE_MODE = "signed-url"
+    file = make_file("clip.mp4", b"0123456789")
+
+    response = auth_client.get(f"/api/file/{file.uuid}/download/")
+    assert response.status_code == status.HTTP_302_FOUND
+    assert response["ETag"] == f'"{file.blob_id}"'
+    code, headers, data = fetch(response["Location"], {"Range": "bytes=2-4"})
+    assert (code, data) == (206, b"234")
+    assert headers["Content-Type"] == "video/mp4"
+    assert headers["Content-Disposition"].startswith("attachment")
+
+    response = auth_client.get(f"/api/file/{file.uuid}/download/", HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+def test_purge_deletes_objects_in_batches(auth_client, create_user, default_gcs, make_file,
+                                          django_capture_on_commit_callbacks):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    for index in range(3):
+        make_file(f"{index}.txt", f"content {index}".encode(), folder=docs)
+    assert len(default_gcs.objects) == 3
+
+    entry = trash.trash_folder(docs)
+    auth_client.delete(f"/api/trash/{entry.uuid}/")
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("purge_trash", "--once")
+
+    assert default_gcs.objects == {}
+    assert default_gcs.calls("POST", "/batch/")
+    assert not default_gcs.calls("DELETE")
@@ -0,0 +1,113 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import pytest
+from django.test import RequestFactory
+from rest_framework import renderers, status
+
+from api.storage import rows
+from api.storage.models import File, Folder
+from api.storage.renderers import JSONRenderer
+from api.storage.serializers import FileSerializer, SubfolderSerializer
+
+
+@pytest.fixture
+def many_files(root, make_file):
+    return [make_file(f"file-{index:02d}.bin", b"x" * index, folder=root) for index in range(25)]
+
+
+def walk(client, url):
+    names, cursor = [], None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == status.HTTP_200_OK
+        names += [item["name"] for item in response.data["results"]]
+        cursor = response.data["next"]
+        if cursor is None:
+            return names
+
+
+@pytest.mark.django_db
+def test_cursor_walks_every_file_once(auth_client, root, many_files):
+    names = walk(auth_client, f"/api/folder/{root.uuid}/children/?type=files&page_size=7")
+    assert names == sorted(file.name for file in many_files)
+
+
+@pytest.mark.django_db
+def test_descending_size_ordering(auth_client, root, many_files):
+    names = walk(auth_client, f"/api/folder/{root.uuid}/children/?type=files&ordering=-size&page_size=10")
+    assert names == [file.name for file in reversed(many_files)]
+
+
+@pytest.mark.django_db
+def test_ties_are_broken_by_id(auth_client, root, make_file):
+    for _ in range(5):
+        make_file("same.txt", b"", folder=root)
+    names = walk(auth_client, f"/api/folder/{root.uuid}/children/?type=files&page_size=2")
+    assert len(names) == 5
+
+
+@pytest.mark.django_db
+def test_folder_listing_and_bad_params(auth_client, root, create_user):
+    for index in range(3):
+        Folder.objects.create(name=f"sub-{index}", parent=root, owner=create_user)
+    assert walk(auth_client, f"/api/folder/{root.uuid}/children/?type=folders&page_size=2") == ["sub-0", "sub-1", "sub-2"]
+
+    url = f"/api/folder/{root.uuid}/children/?type=folders"
+    assert auth_client.get(url + "&ordering=size").status_code == status.HTTP_400_BAD_REQUEST
+    assert auth_client.get(url + "&cursor=garbage").status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_folder_detail_has_counts_and_first_page(auth_client, root, many_files, settings):
+    settings.FOLDER_PAGE_SIZE = 10
+    response = auth_client.get(f"/api/folder/{root.uuid}/")
+    assert response.data["file_count"] == 25
+    assert len(response.data["files"]) == 10
+    assert response.data["files_next"] is not None
+    assert response.data["subfolder_count"] == 0
+
+    cursor = response.data["files_next"]
+    response = auth_client.get(f"/api/folder/{root.uuid}/children/?type=files&page_size=10&cursor={cursor}")
+    assert response.data["results"][0]["name"] == "file-10.bin"
+
+
+@pytest.mark.django_db
+def test_row_serializers_match_the_serializers(root, many_files, create_user):
+    Folder.objects.create(name="sub", parent=root, owner=create_user)
+    File.objects.create(name="empty.txt", folder=root, owner=create_user)
+    context = {"request": RequestFactory().get("/")}
+    for serializer_class, queryset in ((FileSerializer, root.files.all()), (SubfolderSerializer, root.subfolders.all())):
+        expected = serializer_class(queryset.order_by("pk"), many=True, context=context).data
+        data = rows.RowSerializer(serializer_class, context).data(rows.select(serializer_class, queryset.order_by("pk")))
+        assert json.loads(JSONRenderer().render(data)) == json.loads(JSONRenderer().render(expected))
+
+
+@pytest.mark.django_db
+def test_columnar_layout(auth_client, root, many_files):
+    response = auth_client.get(f"/api/folder/{root.uuid}/children/?type=files&page_size=5&layout=columns")
+    assert response.status_code == status.HTTP_200_OK
+    columns = response.data["results"]
+    assert list(columns) == list(FileSerializer().fields)
+    assert columns["name"] == [file.name for file in many_files[:5]]
+    assert columns["size"] == [file.size for file in many_files[:5]]
+
+    detail = auth_client.get(f"/api/folder/{root.uuid}/?layout=columns").data
+    assert detail["files"]["name"][:5] == columns["name"]
+    assert detail["subfolders"] == {name: [] for name in SubfolderSerializer().fields}
+    assert auth_client.get(f"/api/folder/{root.uuid}/?layout=table").status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_renderer_output_matches_drf():
+    data = {
+        "uuid": uuid.UUID(int=1),
+        "utc": datetime.datetime(2024, 5, 1, 12, 30, 15, 250, tzinfo=datetime.timezone.utc),
+        "offset": datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+        "date": datetime.date(2024, 5, 1),
+        "amount": decimal.Decimal("1.50"),
+        "text": "caf\u00e9 \u2028 line",
+        1: [None, True, 2**40, 1.5],
+    }
+    assert JSONRenderer().render(data) == renderers.JSONRenderer().render(data)
@@ -0,0 +1,92 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from api.storage.models import Folder
+
+
+@pytest.fixture(params=["locmem", "filebased"])
+def cache_backend(request, settings, tmp_path):
+    if request.param == "filebased":
+        settings.CACHES = {
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": str(tmp_path / "cache"),
+            }
+        }
+    return request.param
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unchanged_folder_returns_304_without_queries(cache_backend, auth_client, root, make_file):
+    make_file("a.txt", b"a", folder=root)
+    response = auth_client.get(f"/api/folder/{root.uuid}/")
+    etag = response["ETag"]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = auth_client.get(f"/api/folder/{root.uuid}/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert len(queries) == 0
+
+    with CaptureQueriesContext(connection) as queries:
+        response = auth_client.get(f"/api/folder/{root.uuid}/")
+    assert response.status_code == status.HTTP_200_OK
+    assert len(queries) == 0
+    assert response.data["files"][0]["name"] == "a.txt"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_writes_change_the_etag(cache_backend, auth_client, root, create_user, make_file):
+    etag = auth_client.get(f"/api/folder/{root.uuid}/")["ETag"]
+    file = make_file("new.txt", b"x", folder=root)
+    response = auth_client.get(f"/api/folder/{root.uuid}/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["name"] for item in response.data["files"]] == ["new.txt"]
+
+    etag = response["ETag"]
+    file.name = "renamed.txt"
+    file.save()
+    response = auth_client.get(f"/api/folder/{root.uuid}/", HTTP_IF_NONE_MATCH=etag)
+    assert response.data["files"][0]["name"] == "renamed.txt"
+
+    sub = Folder.objects.create(name="sub", parent=root, owner=create_user)
+    etag = auth_client.get(f"/api/folder/{sub.uuid}/")["ETag"]
+    file.folder = sub
+    file.save()
+    assert auth_client.get(f"/api/folder/{sub.uuid}/", HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+    assert auth_client.get(f"/api/folder/{root.uuid}/").data["file_count"] == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dashboard_tree_is_invalidated_by_deep_changes(auth_client, root, create_user):
+    child = Folder.objects.create(name="child", parent=root, owner=create_user)
+    etag = auth_client.get("/api/user/dashboard/?tree=1")["ETag"]
+    assert auth_client.get("/api/user/dashboard/?tree=1", HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    Folder.objects.create(name="grandchild", parent=child, owner=create_user)
+    response = auth_client.get("/api/user/dashboard/?tree=1", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data[0]["subfolders"][0]["subfolders"][0]["name"] == "grandchild"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cache_is_per_user(auth_client, other_client, root):
+    assert auth_client.get(f"/api/folder/{root.uuid}/").status_code == status.HTTP_200_OK
+    assert other_client.get(f"/api/folder/{root.uuid}/").status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db(transaction=True)
+def test_deep_changes_refresh_ancestor_totals(auth_client, root, create_user, make_file):
+    child = Folder.objects.create(name="child", parent=root, owner=create_user)
+    grandchild = Folder.objects.create(name="grandchild", parent=child, owner=create_user)
+    response = auth_client.get(f"/api/folder/{root.uuid}/")
+    etag = response["ETag"]
+    assert response.data["total_bytes"] == 0
+
+    make_file("deep.txt", b"0123456789a", folder=grandchild)
+    response = auth_client.get(f"/api/folder/{root.uuid}/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["total_bytes"] == 11
+    assert response.data["total_file_count"] == 1
+    assert response.data["subfolders"][0]["total_bytes"] == 11
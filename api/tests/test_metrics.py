@@ -0,0 +1,107 @@
+import os
+import re
+import time
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.metrics import profiler, recorder, registry
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+    registry.clear()
+
+
+def timings(response):
+    return {
+        name: (float(duration), desc)
+        for name, duration, desc in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response["Server-Timing"])
+    }
+
+
+def sample(text, line):
+    match = re.search(rf"^{re.escape(line)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else None
+
+
+@pytest.mark.django_db
+def test_server_timing_counts_queries_and_serialization(auth_client, create_user):
+    response = auth_client.get(f"/api/folder/{create_user.root_folder_uuid}/")
+    assert response.status_code == 200
+    timing = timings(response)
+    assert set(timing) == {"db", "serialize", "storage", "queue", "total"}
+    assert int(timing["db"][1].split()[0]) >= 1
+    assert timing["serialize"][0] > 0
+    assert timing["storage"][1] == "0 bytes"
+
+
+@pytest.mark.django_db
+def test_histograms_per_route(auth_client, client, create_user):
+    for _ in range(3):
+        auth_client.get(f"/api/folder/{create_user.root_folder_uuid}/")
+    auth_client.get("/api/user/dashboard/")
+
+    text = client.get("/metrics").content.decode()
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert sample(text, 'http_request_duration_seconds_count{route="folder-detail",method="GET"}') == 3
+    assert sample(text, 'http_request_duration_seconds_bucket{route="folder-detail",method="GET",le="+Inf"}') == 3
+    assert sample(text, 'http_requests_total{route="user_dashboard",method="GET",status="200"}') == 1
+    assert sample(text, 'http_request_db_queries_count{route="user_dashboard",method="GET"}') == 1
+
+
+@pytest.mark.django_db
+def test_streamed_storage_reads_are_recorded_when_the_body_is_done(auth_client, client, make_file):
+    # Random, so it is stored as is and the bytes read are the bytes sent.
+    content = os.urandom(5000)
+    file = make_file("a.bin", content)
+    response = auth_client.get(f"/api/file/{file.uuid}/download/")
+    assert "file-download" not in client.get("/metrics").content.decode()
+
+    assert b"".join(response.streaming_content) == content
+    text = client.get("/metrics").content.decode()
+    assert sample(text, 'http_request_storage_bytes_sum{route="file-download",method="GET"}') == 5000
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_views_are_measured(create_user, client):
+    headers = {"Authorization": f"Bearer {AccessToken.for_user(create_user)}"}
+    response = async_to_sync(AsyncClient().get)(f"/api/folder/{create_user.root_folder_uuid}/", headers=headers)
+    assert response.status_code == 200
+    assert int(timings(response)["db"][1].split()[0]) >= 1
+
+    text = client.get("/metrics").content.decode()
+    assert sample(text, 'http_request_duration_seconds_count{route="folder-detail",method="GET"}') == 1
+
+
+def test_metrics_token(client, settings):
+    settings.METRICS_TOKEN = "scrape-secret"
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code == 403
+    assert client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-secret").status_code == 200
+
+
+def slow_work():
+    time.sleep(0.2)
+
+
+def test_profiler_dumps_slow_requests(settings, tmp_path):
+    settings.METRICS_PROFILE_THRESHOLD_MS = 100
+    settings.METRICS_PROFILE_INTERVAL_MS = 2
+    settings.METRICS_PROFILE_DIR = str(tmp_path)
+
+    fast = recorder.RequestMetrics("GET")
+    profiler.start(fast)
+    assert profiler.finish(fast) is None
+
+    slow = recorder.RequestMetrics("GET")
+    slow.route = "folder-detail"
+    profiler.start(slow)
+    slow_work()
+    path = profiler.finish(slow)
+    assert "folder-detail" in path
+    lines = open(path).read().splitlines()
+    assert lines and all(re.fullmatch(r".+ \d+", line) for line in lines)
+    assert any("slow_work (test_metrics.py" in line.split(";")[-1] for line in lines)
@@ -0,0 +1,91 @@
+import pytest
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from api.replicas import routing
+from api.storage.models import File
+
+
+# A second connection to the test database stands in for the replica. As a
+# test mirror of default it is pointed at the test database when that is set
+# up, which happens after collection.
+connections.settings.setdefault(
+    "replica1", {**connections.settings["default"], "TEST": {**connections.settings["default"]["TEST"], "MIRROR": "default"}},
+)
+databases = pytest.mark.django_db(transaction=True, databases=["default", "replica1"])
+
+
+@pytest.fixture
+def replica(settings):
+    settings.DATABASE_REPLICAS = ["replica1"]
+    routing.monitor.reset()
+    yield connections["replica1"]
+    routing.monitor.reset()
+
+
+def queries_on(alias, client, url):
+    with CaptureQueriesContext(connections["default"]) as primary, CaptureQueriesContext(connections[alias]) as other:
+        response = client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    return len(primary.captured_queries), len(other.captured_queries)
+
+
+@databases
+def test_read_only_views_read_from_the_replica(auth_client, create_user, make_file, replica):
+    file = make_file("a.txt", b"a")
+    # Storing the file kept the owner on the primary; let the sticky window pass.
+    cache.delete(routing._sticky_key(create_user.pk))
+
+    for url in (f"/api/file/{file.uuid}/", f"/api/folder/{create_user.root_folder_uuid}/", "/api/user/default/"):
+        primary, other = queries_on("replica1", auth_client, url)
+        assert other and not primary, url
+
+    # Anything but the opted-in views keeps reading from the primary.
+    primary, other = queries_on("replica1", auth_client, f"/api/file/{file.uuid}/versions/")
+    assert primary and not other
+
+
+@databases
+def test_writers_read_their_writes_from_the_primary(auth_client, replica):
+    response = auth_client.post("/api/folder/", {"name": "docs"}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    url = f"/api/folder/{response.data['uuid']}/"
+
+    primary, other = queries_on("replica1", auth_client, url)
+    assert primary and not other
+
+    # Once the window has passed (and the listing is no longer cached), reads go to the replica.
+    cache.clear()
+    primary, other = queries_on("replica1", auth_client, url)
+    assert other and not primary
+
+
+@databases
+def test_lagging_or_unreachable_replicas_are_skipped(create_user, replica, settings, monkeypatch):
+    lags = {"replica1": 0.5}
+    monkeypatch.setattr(routing, "measure_lag", lambda alias: lags[alias])
+    assert routing.choose(create_user.pk) == "replica1"
+
+    lags["replica1"] = settings.DATABASE_REPLICA_MAX_LAG_SECONDS + 1
+    assert routing.choose(create_user.pk) == "replica1"  # Measured again only once the check interval passes.
+    routing.monitor.checked_at -= settings.DATABASE_REPLICA_LAG_CHECK_SECONDS
+    assert routing.choose(create_user.pk) == "default"
+
+    lags["replica1"] = None
+    routing.monitor.reset()
+    assert routing.choose(create_user.pk) == "default"
+
+
+@databases
+def test_instances_read_from_a_replica_are_saved_to_the_primary(make_file, replica):
+    file = make_file("a.txt", b"a")
+    with routing.reading_from("replica1"):
+        loaded = File.objects.get(pk=file.pk)
+    assert loaded._state.db == "replica1"
+
+    loaded.name = "b.txt"
+    with CaptureQueriesContext(connections["default"]) as primary:
+        loaded.save(update_fields=["name"])
+    assert any("UPDATE" in query["sql"] for query in primary.captured_queries)
@@ -0,0 +1,103 @@
+import pytest
+from django.core.management import call_command
+from rest_framework import status
+
+from api.storage.models import File, Folder, Usage
+from api.tests.helpers import rollup
+
+
+@pytest.fixture
+def tree(root, create_user):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    work = Folder.objects.create(name="work", parent=docs, owner=create_user)
+    music = Folder.objects.create(name="music", parent=root, owner=create_user)
+    return docs, work, music
+
+
+@pytest.mark.django_db
+def test_rollups_follow_creates_and_moves(root, tree, make_file, create_user):
+    docs, work, music = tree
+    make_file("a.txt", b"12345", folder=work)
+    make_file("b.txt", b"123", folder=docs)
+
+    assert rollup(root) == (8, 2, 3)
+    assert rollup(docs) == (8, 2, 1)
+    assert rollup(work) == (5, 1, 0)
+    assert rollup(create_user.usage) == (8, 2, 4)
+
+    work.parent = music
+    work.save()
+    assert rollup(docs) == (3, 1, 0)
+    assert rollup(music) == (5, 1, 1)
+    assert rollup(root) == (8, 2, 3)
+
+    file = File.objects.get(name="b.txt")
+    file.folder = music
+    file.save()
+    assert rollup(docs) == (0, 0, 0)
+    assert rollup(music) == (8, 2, 1)
+
+
+@pytest.mark.django_db
+def test_rollups_follow_deletes(root, tree, make_file, create_user):
+    docs, work, music = tree
+    make_file("a.txt", b"12345", folder=work)
+    make_file("b.txt", b"123", folder=music)
+
+    docs.delete()
+    assert rollup(root) == (3, 1, 1)
+    assert rollup(create_user.usage) == (3, 1, 2)
+
+    File.objects.get(name="b.txt").delete()
+    assert rollup(music) == (0, 0, 0)
+    assert rollup(create_user.usage) == (0, 0, 2)
+
+
+@pytest.mark.django_db
+def test_recompute_repairs_drift(root, tree, make_file, create_user):
+    docs, work, music = tree
+    make_file("a.txt", b"12345", folder=work)
+    Folder.objects.update(total_bytes=0, file_count=0, folder_count=0)
+    Usage.objects.update(total_bytes=99)
+
+    call_command("recompute_rollups", create_user.username)
+
+    assert rollup(root) == (5, 1, 3)
+    assert rollup(docs) == (5, 1, 1)
+    assert rollup(create_user.usage) == (5, 1, 4)
+
+
+@pytest.mark.django_db
+def test_saving_a_stale_user_keeps_usage(auth_client, create_user, make_file):
+    stale = type(create_user).objects.get(pk=create_user.pk)
+    make_file("a.txt", b"12345")
+
+    stale.first_name = "Ada"
+    stale.save()
+    assert rollup(create_user.usage) == (5, 1, 1)
+    response = auth_client.get("/api/user/default/")
+    assert (response.data["total_bytes"], response.data["file_count"], response.data["folder_count"]) == (5, 1, 1)
+
+
+@pytest.mark.django_db
+def test_quota_is_enforced(auth_client, create_user, make_file):
+    create_user.quota_bytes = 10
+    create_user.save()
+    make_file("a.txt", b"123456")
+
+    response = auth_client.post("/api/upload/", {"name": "big.bin", "size": 5}, format="json")
+    assert response.status_code == status.HTTP_507_INSUFFICIENT_STORAGE
+
+    response = auth_client.post("/api/upload/", {"name": "small.bin", "size": 4}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+
+
+@pytest.mark.django_db
+def test_folder_detail_exposes_rollups(auth_client, tree, make_file):
+    docs, work, music = tree
+    make_file("a.txt", b"12345", folder=work)
+
+    response = auth_client.get(f"/api/folder/{docs.uuid}/")
+    assert response.data["total_bytes"] == 5
+    assert response.data["total_file_count"] == 1
+    assert response.data["total_folder_count"] == 1
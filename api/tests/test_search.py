@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+from django.utils import timezone
+from rest_framework import status
+
+from api.storage.models import File, Folder
+
+
+@pytest.fixture(params=["memory", "database"])
+def search_backend(request, settings):
+    settings.SEARCH_BACKEND = request.param
+    return request.param
+
+
+@pytest.fixture
+def drive(create_user, make_file):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    reports = Folder.objects.create(name="Reports", parent=root, owner=create_user)
+    make_file("report.pdf", b"x" * 100, folder=reports)
+    make_file("Annual report 2024.pdf", b"x" * 5000, folder=reports)
+    make_file("monthly_report.docx", b"x" * 10)
+    make_file("sportreport.txt", b"x")
+    make_file("report", b"")
+    make_file("notes.txt", b"x")
+    return reports
+
+
+def names(response):
+    assert response.status_code == status.HTTP_200_OK, response.data
+    return [item["name"] for item in response.data["results"]]
+
+
+@pytest.mark.django_db
+def test_search_ranks_matches(auth_client, drive, search_backend):
+    response = auth_client.get("/api/search/", {"q": "report"})
+    assert names(response) == [
+        "report", "report.pdf", "Annual report 2024.pdf", "monthly_report.docx", "sportreport.txt",
+    ]
+
+
+@pytest.mark.django_db
+def test_search_filters(auth_client, drive, search_backend):
+    File.objects.filter(name="notes.txt").update(updated_at=timezone.now() - datetime.timedelta(days=10))
+    assert names(auth_client.get("/api/search/", {"q": "report", "ext": "pdf,.txt"})) == [
+        "report.pdf", "Annual report 2024.pdf", "sportreport.txt",
+    ]
+    assert names(auth_client.get("/api/search/", {"q": "report", "min_size": 50, "max_size": 1000})) == ["report.pdf"]
+
+    cutoff = (timezone.now() - datetime.timedelta(days=5)).isoformat()
+    assert names(auth_client.get("/api/search/", {"q": "no", "modified_before": cutoff})) == ["notes.txt"]
+    assert names(auth_client.get("/api/search/", {"q": "no", "modified_after": cutoff})) == []
+
+
+@pytest.mark.django_db
+def test_short_queries_match_prefixes_only(auth_client, drive, search_backend):
+    assert names(auth_client.get("/api/search/", {"q": "re"})) == ["report", "report.pdf"]
+
+
+@pytest.mark.django_db
+def test_search_pages_with_cursor(auth_client, drive, search_backend):
+    seen = []
+    params = {"q": "report", "page_size": 2}
+    while True:
+        response = auth_client.get("/api/search/", params)
+        seen += names(response)
+        if not response.data["next"]:
+            break
+        params["cursor"] = response.data["next"]
+    assert len(seen) == 5 and len(set(seen)) == 5
+
+    response = auth_client.get("/api/search/", {"q": "notes", "cursor": params["cursor"]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_search_folders_and_scoping(auth_client, other_client, drive, search_backend):
+    assert names(auth_client.get("/api/search/", {"q": "rep", "type": "folders"})) == ["Reports"]
+    assert names(other_client.get("/api/search/", {"q": "report"})) == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_memory_index_follows_changes(auth_client, drive, settings):
+    settings.SEARCH_BACKEND = "memory"
+    assert names(auth_client.get("/api/search/", {"q": "notes"})) == ["notes.txt"]
+    file = File.objects.get(name="notes.txt")
+    file.name = "minutes.txt"
+    file.save()
+    assert names(auth_client.get("/api/search/", {"q": "notes"})) == []
+    assert names(auth_client.get("/api/search/", {"q": "minutes"})) == ["minutes.txt"]
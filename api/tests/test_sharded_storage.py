@@ -0,0 +1,116 @@
+import os
+import re
+
+import pytest
+from django.core.files.base import ContentFile, File as DjangoFile
+from django.core.management import call_command
+from django.test import RequestFactory
+
+from api.storage import downloads
+from api.storage.backends import ShardedFileSystemStorage
+from api.storage.models import File, Folder, UploadSession
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return ShardedFileSystemStorage(location=str(tmp_path / "store"))
+
+
+class FailingContent(DjangoFile):
+    def __init__(self):
+        super().__init__(None, name="broken")
+
+    def chunks(self, chunk_size=None):
+        yield b"partial"
+        raise OSError("client went away")
+
+
+def leftovers(storage):
+    return [name for _, _, names in os.walk(storage.location) for name in names if name.endswith(".tmp")]
+
+
+def test_flat_names_are_sharded_and_sharded_names_kept(storage):
+    name = storage.save("files/Report.PDF", ContentFile(b"report"))
+    assert re.fullmatch(r"files/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.pdf", name)
+    assert storage.open(name).read() == b"report"
+
+    blob = "blobs/ab/cd/" + "ab" * 32
+    assert storage.save(blob, ContentFile(b"blob")) == blob
+    assert storage.save("uploads/12/34/1234abcd/000001", ContentFile(b"chunk")) == "uploads/12/34/1234abcd/000001"
+
+
+def test_writes_are_atomic_and_never_replace(storage):
+    blob = "blobs/ab/cd/" + "ab" * 32
+    storage.save(blob, ContentFile(b"first"))
+    second = storage.save(blob, ContentFile(b"second"))
+    assert second != blob
+    assert storage.open(blob).read() == b"first"
+
+    with pytest.raises(OSError):
+        storage.save("blobs/ef/01/" + "ef" * 32, FailingContent())
+    assert not storage.exists("blobs/ef/01/" + "ef" * 32)
+    assert leftovers(storage) == []
+
+
+@pytest.mark.parametrize("policy, syncs", [("none", 0), ("file", 1), ("full", 2)])
+def test_fsync_policy(storage, monkeypatch, policy, syncs):
+    calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: calls.append(fd) or real_fsync(fd))
+    storage._fsync = policy
+    storage.save("files/a.txt", ContentFile(b"a"))
+    assert len(calls) == syncs
+
+
+@pytest.mark.django_db
+def test_local_ranges_are_handed_to_sendfile(make_file):
+    content = bytes(range(256)) * 64
+    file = make_file("clip.mp4", content)
+    request = RequestFactory().get("/", HTTP_RANGE="bytes=1000-4999")
+
+    response = downloads.build_download_response(request, file)
+    assert response.status_code == 206
+    assert response["Content-Length"] == "4000"
+    source = response.file_to_stream
+    assert isinstance(source, downloads.FileRange)
+
+    # What gunicorn's sendfile() path does: Content-Length bytes from the descriptor's offset.
+    read_end, write_end = os.pipe()
+    try:
+        offset = os.lseek(source.fileno(), 0, os.SEEK_CUR)
+        assert os.sendfile(write_end, source.fileno(), offset, 4000) == 4000
+        assert os.read(read_end, 8192) == content[1000:5000]
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+        response.close()
+
+
+@pytest.mark.django_db
+def test_reshard_media_moves_flat_objects(create_user, media_root):
+    root = Folder.objects.get(uuid=create_user.root_folder_uuid)
+    os.makedirs(os.path.join(media_root, "files"))
+    with open(os.path.join(media_root, "files", "old.txt"), "wb") as handle:
+        handle.write(b"legacy")
+    original = File.objects.create(name="old.txt", folder=root, owner=create_user, file="files/old.txt", size=6)
+    copy = File.objects.create(name="copy.txt", folder=root, owner=create_user, file="files/old.txt", size=6)
+
+    session = UploadSession.objects.create(owner=create_user, folder=root, name="v.bin", size=4, chunk_size=4)
+    os.makedirs(os.path.join(media_root, "uploads", str(session.uuid)))
+    with open(os.path.join(media_root, "uploads", str(session.uuid), "000000"), "wb") as handle:
+        handle.write(b"abcd")
+
+    call_command("reshard_media", "--dry-run")
+    original.refresh_from_db()
+    assert original.file.name == "files/old.txt"
+
+    call_command("reshard_media")
+    original.refresh_from_db()
+    copy.refresh_from_db()
+    assert re.fullmatch(r"files/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.txt", original.file.name)
+    assert copy.file.name == original.file.name
+    with original.file.open("rb") as handle:
+        assert handle.read() == b"legacy"
+    assert not os.path.exists(os.path.join(media_root, "files", "old.txt"))
+    with open(os.path.join(media_root, session.chunk_name(0)), "rb") as handle:
+        assert handle.read() == b"abcd"
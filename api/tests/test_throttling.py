@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from rest_framework import status
+
+from api.throttling import fairqueue, state, throttles, transfers
+
+
+class Clock:
+    """Stands in for the time module: sleeping only moves the clock on."""
+
+    def __init__(self):
+        self.now = time.time()
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def rates(settings):
+    def set_rates(**rates):
+        settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": rates}
+    return set_rates
+
+
+def poll(ticket, user, cost=100):
+    return state.get_state().update(fairqueue.KEY, fairqueue._poll(ticket, user, cost, 1))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("store", ["memory", "cache"])
+def test_buckets_per_user_and_scope(auth_client, other_client, make_file, rates, settings, store):
+    settings.THROTTLE_STATE = store
+    rates(metadata="3/min", download="60/min", upload=None)
+    file = make_file("a.txt", b"a")
+
+    for _ in range(3):
+        assert auth_client.get(f"/api/file/{file.uuid}/").status_code == status.HTTP_200_OK
+    response = auth_client.get(f"/api/file/{file.uuid}/")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert 1 <= int(response["Retry-After"]) <= 20
+
+    # Downloads draw from their own bucket, and other users from theirs.
+    assert auth_client.get(f"/api/file/{file.uuid}/download/").status_code == status.HTTP_200_OK
+    assert other_client.get("/api/user/default/").status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_downloads_are_paced_to_the_users_bandwidth(auth_client, make_file, settings, monkeypatch):
+    settings.THROTTLE_BANDWIDTH = {"download": 1000}
+    settings.DOWNLOAD_CHUNK_SIZE = 500
+    clock = Clock()
+    monkeypatch.setattr(throttles, "time", clock)
+    monkeypatch.setattr(transfers, "time", clock)
+    file = make_file("a.bin", b"x" * 3000)
+
+    response = auth_client.get(f"/api/file/{file.uuid}/download/")
+    assert b"".join(response.streaming_content) == b"x" * 3000
+    # The first second's worth is the burst; the rest is slept off at 1000 bytes a second.
+    assert sum(clock.sleeps) == pytest.approx(2)
+    assert max(clock.sleeps) == pytest.approx(0.5)
+
+
+@pytest.mark.django_db
+def test_fair_queue_admits_light_users_before_a_backlog(settings):
+    settings.TRANSFER_SLOTS = 1
+    assert poll("a1", "heavy")
+    assert not any([poll("a2", "heavy"), poll("a3", "heavy"), poll("b1", "light")])
+
+    fairqueue.release("a1")
+    assert not poll("a2", "heavy")
+    assert poll("b1", "light")
+
+    fairqueue.release("b1")
+    assert not poll("a3", "heavy")
+    assert poll("a2", "heavy")
+
+
+@pytest.mark.django_db
+def test_transfers_wait_for_a_slot_then_give_up(auth_client, make_file, settings):
+    settings.TRANSFER_SLOTS = 1
+    settings.TRANSFER_QUEUE_SECONDS = 0.2
+    file = make_file("a.bin", b"x" * 100)
+    ticket = fairqueue.acquire("someone-else", 1)
+
+    response = auth_client.get(f"/api/file/{file.uuid}/download/")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response["Retry-After"] == "1"
+
+    fairqueue.release(ticket)
+    response = auth_client.get(f"/api/file/{file.uuid}/download/")
+    assert response.status_code == status.HTTP_200_OK
+    assert poll("probe", "someone-else") is False
+    response.close()
+    assert poll("probe", "someone-else")
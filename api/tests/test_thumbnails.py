@@ -0,0 +1,148 @@
+import base64
+import io
+
+import pytest
+from django.core.files.base import ContentFile
+from PIL import Image
+from rest_framework import status
+
+from api.storage import blobs, thumbnails
+from api.storage.models import Blob, Derivative
+
+
+def add_derivative(file, variant="small", data=b"\xff\xd8thumb"):
+    name = thumbnails.derivative_name(file.blob.sha256, variant, "image/jpeg")
+    blobs.get_storage().save(name, ContentFile(data))
+    return Derivative.objects.create(
+        blob=file.blob, variant=variant, status=Derivative.STATUS_READY, file=name,
+        content_type="image/jpeg", width=128, height=96, size=len(data),
+    )
+
+
+@pytest.mark.django_db
+def test_thumbnail_of_unrenderable_content_is_404(auth_client, make_file):
+    file = make_file("notes.txt", b"just text")
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert set(Derivative.objects.filter(blob=file.blob).values_list("status", flat=True)) == {
+        Derivative.STATUS_UNSUPPORTED,
+    }
+
+
+@pytest.mark.django_db
+def test_thumbnail_rejects_unknown_size(auth_client, make_file):
+    file = make_file("a.jpg", b"x")
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/?size=huge")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_thumbnail_is_served_with_immutable_caching(auth_client, make_file):
+    file = make_file("a.jpg", b"original")
+    add_derivative(file)
+
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/?size=small")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == b"\xff\xd8thumb"
+    assert response["Content-Type"] == "image/jpeg"
+    assert "immutable" in response["Cache-Control"]
+
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/?size=small", HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+def test_thumbnail_of_another_users_file_is_404(other_client, make_file):
+    file = make_file("a.jpg", b"original")
+    add_derivative(file)
+    assert other_client.get(f"/api/file/{file.uuid}/thumbnail/").status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_folder_thumbnails_inline_a_page(auth_client, create_user, make_file):
+    ready = make_file("a.jpg", b"original")
+    add_derivative(ready)
+    text = make_file("b.txt", b"text")
+
+    response = auth_client.get(f"/api/folder/{create_user.root_folder_uuid}/thumbnails/?size=small")
+    assert response.status_code == status.HTTP_200_OK
+    results = {item["uuid"]: item for item in response.data["results"]}
+    assert base64.b64decode(results[str(ready.uuid)]["data"]) == b"\xff\xd8thumb"
+    assert results[str(ready.uuid)]["width"] == 128
+    assert results[str(text.uuid)]["status"] == Derivative.STATUS_UNSUPPORTED
+
+
+@pytest.mark.django_db
+def test_files_with_equal_content_share_derivatives(auth_client, make_file):
+    first = make_file("a.jpg", b"same")
+    second = make_file("b.jpg", b"same")
+    add_derivative(first)
+    response = auth_client.get(f"/api/file/{second.uuid}/thumbnail/")
+    assert response.status_code == status.HTTP_200_OK
+    assert Derivative.objects.count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_derivatives_are_deleted_with_their_blob(make_file):
+    file = make_file("a.jpg", b"original")
+    derivative = add_derivative(file)
+    storage = blobs.get_storage()
+    assert storage.exists(derivative.file.name)
+
+    file.delete()
+    assert not Blob.objects.exists()
+    assert not Derivative.objects.exists()
+    assert not storage.exists(derivative.file.name)
+
+
+@pytest.mark.django_db
+def test_images_are_rendered_at_every_size(auth_client, make_file):
+    buffer = io.BytesIO()
+    Image.new("RGB", (1000, 500), "red").save(buffer, "JPEG")
+    file = make_file("photo.jpg", buffer.getvalue())
+
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/?size=medium")
+    assert response.status_code == status.HTTP_200_OK
+    assert Image.open(io.BytesIO(response.content)).size == (256, 128)
+    assert Derivative.objects.filter(blob=file.blob, status=Derivative.STATUS_READY).count() == 3
+
+
+@pytest.mark.django_db
+def test_pdf_preview_is_its_first_pages_image(auth_client, make_file):
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 800), "blue").save(buffer, "PDF")
+    file = make_file("scan.pdf", buffer.getvalue())
+
+    response = auth_client.get(f"/api/file/{file.uuid}/thumbnail/?size=small")
+    assert response.status_code == status.HTTP_200_OK
+    thumbnail = Image.open(io.BytesIO(response.content))
+    assert thumbnail.size == (64, 128)
+    assert thumbnail.getpixel((32, 64))[2] > 200
+
+
+@pytest.mark.django_db
+def test_unrenderable_sources_are_not_read_in_full(make_file, settings, monkeypatch):
+    settings.COMPRESSION_FRAME_SIZE = 64 * 1024
+    text = b"".join(b"line %d of a log file\n" % number for number in range(20000))
+    file = make_file("log.txt", text)
+    assert file.blob.codec == "gzip"
+    reads = []
+    open_blob = blobs.open_blob
+
+    def recording_open_blob(blob):
+        handle = open_blob(blob)
+        read = handle.read
+
+        def recording_read(size=-1):
+            reads.append(size)
+            return read(size)
+
+        handle.read = recording_read
+        return handle
+
+    monkeypatch.setattr(thumbnails, "open_blob", recording_open_blob)
+    thumbnails.generate(file.blob)
+    assert reads == [16]
+    assert set(Derivative.objects.filter(blob=file.blob).values_list("status", flat=True)) == {
+        Derivative.STATUS_UNSUPPORTED,
+    }
@@ -0,0 +1,122 @@
+import importlib
+from datetime import timedelta
+
+import pytest
+from django.apps import apps
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+
+from api.storage import blobs, trash
+from api.storage.models import Blob, File, Folder, TrashEntry
+from api.tests.helpers import rollup
+
+
+@pytest.fixture
+def folders(root, create_user):
+    docs = Folder.objects.create(name="docs", parent=root, owner=create_user)
+    work = Folder.objects.create(name="work", parent=docs, owner=create_user)
+    return docs, work
+
+
+@pytest.mark.django_db
+def test_delete_folder_moves_tree_to_trash(auth_client, root, folders, make_file):
+    docs, work = folders
+    file = make_file("a.txt", b"hello", folder=work)
+
+    response = auth_client.delete(f"/api/folder/{docs.uuid}/")
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data["total_files"] == 1
+    assert response.data["total_folders"] == 2
+
+    assert auth_client.get(f"/api/folder/{work.uuid}/").status_code == status.HTTP_404_NOT_FOUND
+    assert auth_client.get(f"/api/file/{file.uuid}/").status_code == status.HTTP_404_NOT_FOUND
+    assert auth_client.get("/api/path/docs").status_code == status.HTTP_404_NOT_FOUND
+    assert rollup(root) == (0, 0, 0)
+
+    entry = auth_client.get("/api/trash/").data[0]
+    assert auth_client.post(f"/api/trash/{entry['uuid']}/restore/").status_code == status.HTTP_204_NO_CONTENT
+    assert auth_client.get(f"/api/file/{file.uuid}/").status_code == status.HTTP_200_OK
+    assert rollup(root) == (5, 1, 2)
+    assert not TrashEntry.objects.exists()
+
+
+@pytest.mark.django_db
+def test_trashing_a_parent_absorbs_earlier_entries(root, folders, make_file):
+    docs, work = folders
+    file = make_file("a.txt", b"hello", folder=work)
+    make_file("b.txt", b"abc", folder=docs)
+
+    trash.trash_file(file)
+    trash.trash_folder(work)
+    assert rollup(root) == (3, 1, 1)
+
+    entry = trash.trash_folder(docs)
+    assert TrashEntry.objects.get() == entry
+    assert (entry.total_bytes, entry.total_files, entry.total_folders) == (8, 2, 2)
+    assert rollup(root) == (0, 0, 0)
+
+    trash.restore(entry)
+    assert rollup(root) == (8, 2, 2)
+    assert rollup(docs) == (8, 2, 1)
+    assert rollup(work) == (5, 1, 0)
+
+
+@pytest.mark.django_db
+def test_root_folder_cannot_be_deleted(auth_client, root):
+    assert auth_client.delete(f"/api/folder/{root.uuid}/").status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db(transaction=True)
+def test_purge_worker_reclaims_storage(auth_client, create_user, root, folders, make_file):
+    docs, work = folders
+    make_file("a.txt", b"hello", folder=work)
+    make_file("b.txt", b"world", folder=work)
+    kept = make_file("c.txt", b"hello", folder=root)
+    unique_blob = File.objects.get(name="b.txt").blob
+    storage = blobs.get_storage()
+
+    entry = trash.trash_folder(docs)
+    call_command("purge_trash", "--once")
+    entry.refresh_from_db()
+    assert entry.status == TrashEntry.STATUS_TRASHED
+
+    response = auth_client.delete(f"/api/trash/{entry.uuid}/")
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    call_command("purge_trash", "--once", "--batch-size", "1")
+
+    entry.refresh_from_db()
+    assert entry.status == TrashEntry.STATUS_PURGED
+    assert (entry.purged_files, entry.purged_folders, entry.purged_bytes) == (2, 2, 10)
+    assert auth_client.get(f"/api/trash/{entry.uuid}/").data["progress"] == 1.0
+    assert not Folder.all_objects.filter(pk__in=[docs.pk, work.pk]).exists()
+    assert not Blob.objects.filter(pk=unique_blob.pk).exists()
+    assert not storage.exists(unique_blob.file.name)
+    assert Blob.objects.get(pk=kept.blob_id).ref_count == 1
+    assert rollup(create_user.usage) == (5, 1, 1)
+
+
+@pytest.mark.django_db
+def test_purging_entry_cannot_be_restored(auth_client, folders):
+    docs, work = folders
+    entry = trash.trash_folder(docs)
+    TrashEntry.objects.filter(pk=entry.pk).update(status=TrashEntry.STATUS_PURGING)
+    assert auth_client.post(f"/api/trash/{entry.uuid}/restore/").status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.django_db
+def test_orphans_are_trashed_for_the_retention_period(auth_client, root, make_file, settings):
+    settings.TRASH_RETENTION_DAYS = 30
+    file = make_file("orphan.txt", b"keep me")
+    File.objects.filter(pk=file.pk).update(folder=None)
+    call_command("recompute_rollups")
+    assert rollup(root)[:2] == (0, 0)
+
+    importlib.import_module("api.storage.migrations.0009_trash").trash_orphans(apps, None)
+    entry = TrashEntry.objects.get(item_uuid=file.uuid)
+    assert entry.purge_after > timezone.now() + timedelta(days=29)
+    assert trash.claim_due() is None
+
+    assert auth_client.post(f"/api/trash/{entry.uuid}/restore/").status_code == status.HTTP_204_NO_CONTENT
+    assert File.objects.get(pk=file.pk).folder_id == root.pk
+    assert rollup(root)[:2] == (len(b"keep me"), 1)
@@ -0,0 +1,94 @@
+import pytest
+from rest_framework import status
+
+from api.storage.models import File
+
+
+@pytest.fixture(autouse=True)
+def tiny_chunks(settings):
+    settings.UPLOAD_MIN_CHUNK_SIZE = 1
+
+
+@pytest.fixture
+def session(auth_client):
+    response = auth_client.post("/api/upload/", {"name": "video.bin", "size": 10, "chunk_size": 4}, format="json")
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.data
+
+
+def put_chunk(client, session, index, data):
+    return client.put(
+        f"/api/upload/{session['uuid']}/chunks/{index}/", data=data, content_type="application/octet-stream"
+    )
+
+
+@pytest.mark.django_db
+def test_create_session(session):
+    assert session["chunk_count"] == 3
+    assert session["missing_chunks"] == [0, 1, 2]
+    assert session["offset"] == 0
+
+
+@pytest.mark.django_db
+def test_chunks_out_of_order_and_commit(auth_client, session, create_user):
+    assert put_chunk(auth_client, session, 2, b"89").status_code == status.HTTP_200_OK
+    assert put_chunk(auth_client, session, 0, b"0123").status_code == status.HTTP_200_OK
+
+    response = auth_client.get(f"/api/upload/{session['uuid']}/")
+    assert response.data["received_chunks"] == [0, 2]
+    assert response.data["offset"] == 4
+
+    response = auth_client.post(f"/api/upload/{session['uuid']}/commit/")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert [int(index) for index in response.data["missing_chunks"]] == [1]
+
+    assert put_chunk(auth_client, session, 1, b"4567").status_code == status.HTTP_200_OK
+    response = auth_client.post(f"/api/upload/{session['uuid']}/commit/")
+    assert response.status_code == status.HTTP_201_CREATED
+
+    file = File.objects.get(uuid=response.data["uuid"])
+    assert file.owner == create_user
+    assert file.folder.uuid == create_user.root_folder_uuid
+    with file.file.open("rb") as fh:
+        assert fh.read() == b"0123456789"
+
+
+@pytest.mark.django_db
+def test_chunk_with_wrong_size_is_rejected(auth_client, session):
+    response = put_chunk(auth_client, session, 0, b"012345")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = auth_client.get(f"/api/upload/{session['uuid']}/")
+    assert response.data["received_chunks"] == []
+
+
+@pytest.mark.django_db
+def test_commit_twice_is_rejected(auth_client):
+    session = auth_client.post("/api/upload/", {"name": "a.txt", "size": 3}, format="json").data
+    put_chunk(auth_client, session, 0, b"abc")
+    assert auth_client.post(f"/api/upload/{session['uuid']}/commit/").status_code == status.HTTP_201_CREATED
+    assert auth_client.post(f"/api/upload/{session['uuid']}/commit/").status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_sessions_are_bounded(auth_client, settings):
+    settings.UPLOAD_MIN_CHUNK_SIZE = 1024
+    settings.UPLOAD_MAX_CHUNKS = 100
+    settings.UPLOAD_MISSING_CHUNKS_LIMIT = 10
+
+    def create(**data):
+        return auth_client.post("/api/upload/", {"name": "big.bin", **data}, format="json")
+
+    assert create(size=10**12, chunk_size=1).status_code == status.HTTP_400_BAD_REQUEST
+    assert create(size=10**12, chunk_size=1024).status_code == status.HTTP_400_BAD_REQUEST
+    # A small upload may be one chunk smaller than the minimum.
+    assert create(size=10, chunk_size=10).status_code == status.HTTP_201_CREATED
+
+    session = create(size=100 * 1024, chunk_size=1024).data
+    assert session["chunk_count"] == 100
+    assert session["missing_chunks"] == list(range(10))
+    put_chunk(auth_client, session, 0, b"x" * 1024)
+    put_chunk(auth_client, session, 1, b"x" * 1024)
+    put_chunk(auth_client, session, 3, b"x" * 1024)
+    response = auth_client.get(f"/api/upload/{session['uuid']}/")
+    assert response.data["offset"] == 2 * 1024
+    assert response.data["missing_chunks"] == [2, *range(4, 13)]
@@ -0,0 +1,221 @@
+import hashlib
+import io
+import random
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework import status
+
+from api.storage import chunking, trash
+from api.storage.models import Blob, ChunkUpload, File, FileVersion, Usage
+
+
+User = get_user_model()
+PARAMS = chunking.Params(min_size=256, avg_size=1024, max_size=4096)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(settings):
+    settings.VERSION_CHUNK_MIN_SIZE = PARAMS.min_size
+    settings.VERSION_CHUNK_AVG_SIZE = PARAMS.avg_size
+    settings.VERSION_CHUNK_MAX_SIZE = PARAMS.max_size
+
+
+def content(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def upload_version(client, file, data, expected=status.HTTP_201_CREATED):
+    """What a client does: diff the manifest, send the missing chunks, commit."""
+    chunks = list(chunking.split(io.BytesIO(data), PARAMS))
+    manifest = [{"sha256": hashlib.sha256(chunk).hexdigest(), "size": len(chunk)} for chunk in chunks]
+    diff = client.post(f"/api/file/{file.uuid}/versions/diff/", {"chunks": manifest}, format="json")
+    assert diff.status_code == status.HTTP_200_OK
+    assert diff.data["chunking"]["max_size"] == PARAMS.max_size
+    sent = 0
+    for chunk in chunks:
+        sha256 = hashlib.sha256(chunk).hexdigest()
+        if sha256 in diff.data["missing"]:
+            response = client.put(
+                f"/api/file/{file.uuid}/versions/chunks/{sha256}/", data=chunk, content_type="application/octet-stream",
+            )
+            assert response.status_code == status.HTTP_200_OK
+            diff.data["missing"].remove(sha256)
+            sent += 1
+    response = client.post(f"/api/file/{file.uuid}/versions/", {"chunks": manifest}, format="json")
+    assert response.status_code == expected
+    return response.data, sent, len(chunks)
+
+
+def download(client, file, **params):
+    response = client.get(f"/api/file/{file.uuid}/download/", params)
+    assert response.status_code == status.HTTP_200_OK
+    return b"".join(response.streaming_content)
+
+
+def test_chunker_only_cuts_around_an_edit():
+    data = content(200 * 1024)
+    edited = data[:100000] + b"edited" + data[100010:]
+    before = chunking.manifest(io.BytesIO(data), PARAMS)
+    after = chunking.manifest(io.BytesIO(edited), PARAMS)
+    assert all(PARAMS.min_size <= chunk["size"] <= PARAMS.max_size for chunk in before[:-1])
+    changed = [chunk for chunk in after if chunk not in before]
+    assert 1 <= len(changed) <= 2
+
+
+@pytest.mark.django_db
+def test_edits_upload_only_changed_chunks(auth_client, make_file):
+    original = content(64 * 1024)
+    file = make_file("notes.txt", original)
+
+    version, sent, total = upload_version(auth_client, file, original + b"appended")
+    assert version["number"] == 2 and version["chunked"]
+    # Version 1 was uploaded whole, so the first chunked version sends everything.
+    assert sent == total
+
+    edited = original[:30000] + b"EDIT" + original[30004:] + b"appended"
+    version, sent, total = upload_version(auth_client, file, edited)
+    assert version["number"] == 3
+    assert sent <= 2 < total
+
+    file.refresh_from_db()
+    assert file.size == len(edited)
+    assert download(auth_client, file) == edited
+    assert download(auth_client, file, version=1) == original
+
+    response = auth_client.get(f"/api/file/{file.uuid}/download/", HTTP_RANGE="bytes=29998-30005")
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert b"".join(response.streaming_content) == edited[29998:30006]
+
+    listed = auth_client.get(f"/api/file/{file.uuid}/versions/").data
+    assert [entry["number"] for entry in listed] == [3, 2, 1]
+    manifest = auth_client.get(f"/api/file/{file.uuid}/versions/3/").data["chunks"]
+    assert sum(chunk["size"] for chunk in manifest) == len(edited)
+
+
+@pytest.mark.django_db
+def test_commit_requires_every_chunk(auth_client, make_file):
+    file = make_file("a.bin", b"old")
+    chunks = [{"sha256": hashlib.sha256(part).hexdigest(), "size": len(part)} for part in (b"a" * 300, b"b" * 300)]
+
+    response = auth_client.post(f"/api/file/{file.uuid}/versions/", {"chunks": chunks}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["missing"] == [chunk["sha256"] for chunk in chunks]
+
+    response = auth_client.put(
+        f"/api/file/{file.uuid}/versions/chunks/{chunks[0]['sha256']}/", data=b"c" * 300,
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert not FileVersion.objects.exists()
+
+
+@pytest.mark.django_db
+def test_chunks_of_other_users_must_be_sent(auth_client, other_client, make_file, create_user):
+    data = content(20 * 1024, seed=1)
+    theirs = make_file("theirs.bin", b"old", owner=User.objects.get(username="otheruser"))
+    upload_version(other_client, theirs, data)
+
+    mine = make_file("mine.bin", b"old")
+    manifest = chunking.manifest(io.BytesIO(data), PARAMS)
+    diff = auth_client.post(f"/api/file/{mine.uuid}/versions/diff/", {"chunks": manifest}, format="json")
+    assert diff.data["missing"] == [chunk["sha256"] for chunk in manifest]
+    response = auth_client.post(f"/api/file/{mine.uuid}/versions/", {"chunks": manifest}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = auth_client.post(f"/api/file/{mine.uuid}/versions/", {"chunks": manifest[:1]}, format="json")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Sending them proves the content; the chunks stored already are shared.
+    stored = Blob.objects.count()
+    version, sent, total = upload_version(auth_client, mine, data)
+    assert sent == total
+    assert Blob.objects.count() == stored
+    assert download(auth_client, mine) == data
+    assert not ChunkUpload.objects.exists()
+
+
+@pytest.mark.django_db
+def test_restore_and_prune_move_references_only(auth_client, make_file, django_capture_on_commit_callbacks):
+    original = content(16 * 1024, seed=1)
+    file = make_file("doc.bin", original)
+    upload_version(auth_client, file, content(16 * 1024, seed=2))
+    blob_count = Blob.objects.count()
+
+    response = auth_client.post(f"/api/file/{file.uuid}/versions/1/restore/")
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.data["number"] == 3
+    assert download(auth_client, file) == original
+    assert Blob.objects.count() == blob_count
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = auth_client.post(f"/api/file/{file.uuid}/versions/prune/", {"keep": 1}, format="json")
+    assert response.data == {"deleted": 2}
+    # Version 2's chunked blob and all of its chunks were only held by that version.
+    assert list(Blob.objects.values_list("sha256", flat=True)) == [File.objects.get(pk=file.pk).blob_id]
+    assert Blob.objects.get().ref_count == 2
+
+
+@pytest.mark.django_db
+def test_older_versions_count_toward_the_quota(auth_client, create_user, make_file):
+    User.objects.filter(pk=create_user.pk).update(quota_bytes=20 * 1024)
+    file = make_file("doc.bin", content(8 * 1024, seed=5))
+    upload_version(auth_client, file, content(8 * 1024, seed=6))
+    assert Usage.objects.get(owner=create_user).total_bytes == 16 * 1024
+
+    # Overwriting would keep the first two versions and store a third.
+    upload_version(auth_client, file, content(8 * 1024, seed=7), expected=status.HTTP_507_INSUFFICIENT_STORAGE)
+    response = auth_client.post(f"/api/file/{file.uuid}/versions/1/restore/")
+    assert response.status_code == status.HTTP_507_INSUFFICIENT_STORAGE
+
+    auth_client.post(f"/api/file/{file.uuid}/versions/prune/", {"keep": 1}, format="json")
+    assert Usage.objects.get(owner=create_user).total_bytes == 8 * 1024
+    upload_version(auth_client, file, content(8 * 1024, seed=7))
+
+    Usage.objects.update(total_bytes=0)
+    call_command("recompute_rollups", create_user.username)
+    assert Usage.objects.get(owner=create_user).total_bytes == 16 * 1024
+
+    file.refresh_from_db()
+    file.delete()
+    assert Usage.objects.get(owner=create_user).total_bytes == 0
+
+
+@pytest.mark.django_db
+def test_purge_releases_every_version(auth_client, make_file, django_capture_on_commit_callbacks):
+    file = make_file("doc.bin", content(8 * 1024, seed=3))
+    upload_version(auth_client, file, content(8 * 1024, seed=4))
+
+    entry = trash.trash_file(file)
+    auth_client.delete(f"/api/trash/{entry.uuid}/")
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command("purge_trash", "--once")
+    assert not Blob.objects.exists()
+    assert Usage.objects.values_list("total_bytes", flat=True).get() == 0
+
+
+@pytest.mark.django_db
+def test_unused_chunks_are_collected(auth_client, make_file):
+    file = make_file("a.bin", b"old")
+    chunk = b"x" * 300
+    sha256 = hashlib.sha256(chunk).hexdigest()
+    auth_client.put(
+        f"/api/file/{file.uuid}/versions/chunks/{sha256}/", data=chunk, content_type="application/octet-stream",
+    )
+
+    call_command("prune_versions", "--unused-hours", "0")
+    assert not Blob.objects.filter(pk=sha256).exists()
+    assert Blob.objects.filter(pk=file.blob_id).exists()
+
+
+@pytest.mark.django_db
+def test_compressed_chunks_read_back(auth_client, make_file, settings):
+    settings.COMPRESSION_MIN_SIZE = 0
+    text = b"".join(b"row %d,%d\n" % (number, number * 7 % 13) for number in range(8000))
+    file = make_file("table.csv", b"v1")
+
+    upload_version(auth_client, file, text)
+    assert Blob.objects.filter(chunked=False, codec="gzip").exists()
+    assert download(auth_client, file) == text
+    response = auth_client.get(f"/api/file/{file.uuid}/download/", HTTP_RANGE="bytes=5000-20000")
+    assert b"".join(response.streaming_content) == text[5000:20001]
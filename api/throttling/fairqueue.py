@@ -0,0 +1,163 @@
+"""
+A weighted fair queue of transfer slots.
+
+At most TRANSFER_SLOTS uploads and downloads hold a slot at once; others
+wait in a start-time fair queue over users. A request moving `cost` bytes
+for a user of weight `w` gets the start tag max(V, the user's last finish
+tag) and the finish tag start + cost / w. Free slots go to waiting requests
+in order of finish tag, and the queue's virtual time V moves to the start
+tag of each request admitted. A user with a long backlog only pushes their
+own tags further ahead, so another user's next request is admitted before
+most of that backlog; with one user it is plain FIFO.
+
+The queue is a single value in the throttling state, so every process
+sharing the state shares the slots. Waiters poll it every POLL_SECONDS and
+admit whoever is first for a free slot. A waiter that stops polling, or an
+admission nobody claims, lapses after STALE_SECONDS; a slot not renewed
+within TRANSFER_SLOT_LEASE_SECONDS (its process died mid-transfer) is freed.
+"""
+import asyncio
+import math
+import time
+import uuid
+
+from django.conf import settings
+from rest_framework import exceptions
+
+from api.metrics import recorder
+from api.throttling.state import get_state
+
+
+KEY = 'transfers:queue'
+POLL_SECONDS = 0.05
+STALE_SECONDS = 5
+
+
+class SlotsBusy(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Too many transfers in progress, try again later.'
+    default_code = 'slots_busy'
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler.
+        self.wait = math.ceil(wait)
+
+
+def slots():
+    return getattr(settings, 'TRANSFER_SLOTS', 0)
+
+
+def _queue_seconds():
+    return getattr(settings, 'TRANSFER_QUEUE_SECONDS', 30)
+
+
+def lease_seconds():
+    return getattr(settings, 'TRANSFER_SLOT_LEASE_SECONDS', 300)
+
+
+def _fresh(queue, now):
+    """The queue without lapsed entries, and without finish tags that no longer put anyone behind."""
+    queue = queue or {'vtime': 0.0, 'seq': 0, 'finish': {}, 'waiting': {}, 'active': {}}
+    queue['active'] = {ticket: slot for ticket, slot in queue['active'].items() if slot[0] > now}
+    queue['waiting'] = {ticket: entry for ticket, entry in queue['waiting'].items() if entry[3] > now}
+    queue['finish'] = {user: tag for user, tag in queue['finish'].items() if tag > queue['vtime']}
+    return queue
+
+
+def _admit(queue, now):
+    while queue['waiting'] and len(queue['active']) < slots():
+        ticket = min(queue['waiting'], key=lambda ticket: queue['waiting'][ticket][1:3])
+        start = queue['waiting'].pop(ticket)[0]
+        queue['vtime'] = max(queue['vtime'], start)
+        # Claimed, and leased for the transfer, at the owner's next poll.
+        queue['active'][ticket] = (now + STALE_SECONDS, False)
+
+
+def _poll(ticket, user, cost, weight):
+    def poll(queue):
+        now = time.time()
+        queue = _fresh(queue, now)
+        if ticket not in queue['waiting'] and ticket not in queue['active']:
+            start = max(queue['vtime'], queue['finish'].get(user, 0.0))
+            queue['finish'][user] = start + cost / weight
+            queue['seq'] += 1
+            queue['waiting'][ticket] = (start, queue['finish'][user], queue['seq'], now + STALE_SECONDS)
+        _admit(queue, now)
+        admitted = ticket in queue['active']
+        if admitted:
+            queue['active'][ticket] = (now + lease_seconds(), True)
+        else:
+            queue['waiting'][ticket] = (*queue['waiting'][ticket][:3], now + STALE_SECONDS)
+        return queue, lease_seconds() + STALE_SECONDS, admitted
+    return poll
+
+
+def _leave(ticket):
+    def leave(queue):
+        now = time.time()
+        queue = _fresh(queue, now)
+        queue['active'].pop(ticket, None)
+        queue['waiting'].pop(ticket, None)
+        _admit(queue, now)
+        return queue, lease_seconds() + STALE_SECONDS, None
+    return leave
+
+
+def _renew(ticket):
+    def renew(queue):
+        now = time.time()
+        queue = _fresh(queue, now)
+        if ticket in queue['active']:
+            queue['active'][ticket] = (now + lease_seconds(), True)
+        return queue, lease_seconds() + STALE_SECONDS, None
+    return renew
+
+
+def acquire(user, cost, weight=1):
+    """
+    Wait for a slot for `cost` bytes of `user`'s transfers and return its
+    ticket, or None when slots are unlimited. Raises SlotsBusy after
+    TRANSFER_QUEUE_SECONDS.
+    """
+    if not slots():
+        return None
+    state, ticket, user = get_state(), uuid.uuid4().hex, str(user)
+    deadline = time.monotonic() + _queue_seconds()
+    with recorder.timed('queue'):
+        while not state.update(KEY, _poll(ticket, user, max(cost, 1), weight)):
+            if time.monotonic() >= deadline:
+                state.update(KEY, _leave(ticket))
+                raise SlotsBusy(_queue_seconds())
+            time.sleep(POLL_SECONDS)
+    return ticket
+
+
+async def aacquire(user, cost, weight=1):
+    if not slots():
+        return None
+    state, ticket, user = get_state(), uuid.uuid4().hex, str(user)
+    deadline = time.monotonic() + _queue_seconds()
+    with recorder.timed('queue'):
+        while not await state.aupdate(KEY, _poll(ticket, user, max(cost, 1), weight)):
+            if time.monotonic() >= deadline:
+                await state.aupdate(KEY, _leave(ticket))
+                raise SlotsBusy(_queue_seconds())
+            await asyncio.sleep(POLL_SECONDS)
+    return ticket
+
+
+def release(ticket):
+    get_state().update(KEY, _leave(ticket))
+
+
+async def arelease(ticket):
+    await get_state().aupdate(KEY, _leave(ticket))
+
+
+def renew(ticket):
+    get_state().update(KEY, _renew(ticket))
+
+
+async def arenew(ticket):
+    await get_state().aupdate(KEY, _renew(ticket))
@@ -0,0 +1,94 @@
+"""
+Where throttling state lives.
+
+Token buckets and the transfer queue keep small values under string keys
+and change them through update(key, function): `function` gets the current
+value (None when there is none) and returns the new value, the seconds it
+should be kept and a result for the caller, all atomically with respect to
+other updates of that key. THROTTLE_STATE picks the store:
+
+- 'memory' (the default) keeps the values in the process, which is enough
+  for a single node but gives every process its own limits;
+- 'cache' keeps them in the THROTTLE_CACHE_ALIAS cache, so that all nodes
+  sharing it (memcached, redis) share the limits. Updates take a short lock
+  made with cache.add(), which those backends perform atomically;
+- a dotted path to a class with the same interface.
+"""
+import functools
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class MemoryState:
+    """Values held by this process. Expired keys are dropped once the store grows."""
+    SWEEP_SIZE = 10000
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, function):
+        with self._lock:
+            now = time.time()
+            value, expires = self._values.get(key, (None, 0))
+            value, timeout, result = function(value if expires > now else None)
+            self._values[key] = (value, now + timeout)
+            if len(self._values) > self.SWEEP_SIZE:
+                self._values = {key: entry for key, entry in self._values.items() if entry[1] > now}
+            return result
+
+    async def aupdate(self, key, function):
+        # Never waits on anything but the lock, which is only held for the update itself.
+        return self.update(key, function)
+
+
+class CacheState:
+    """Values held in a Django cache shared by every node."""
+    LOCK_SECONDS = 1
+    LOCK_POLL_SECONDS = 0.001
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def update(self, key, function):
+        cache = self.cache
+        lock = f"{key}:lock"
+        # A holder that died leaves the lock to expire after LOCK_SECONDS.
+        while not cache.add(lock, 1, self.LOCK_SECONDS):
+            time.sleep(self.LOCK_POLL_SECONDS)
+        try:
+            value, timeout, result = function(cache.get(key))
+            cache.set(key, value, max(1, math.ceil(timeout)))
+            return result
+        finally:
+            cache.delete(lock)
+
+    async def aupdate(self, key, function):
+        return await sync_to_async(self.update, thread_sensitive=False)(key, function)
+
+
+STORES = {'memory': MemoryState, 'cache': CacheState}
+
+
+@functools.cache
+def _store(name):
+    return STORES[name]() if name in STORES else import_string(name)()
+
+
+def get_state():
+    return _store(getattr(settings, 'THROTTLE_STATE', 'memory'))
+
+
+def clear():
+    """Forget the stores, and with them all state kept in the process (tests)."""
+    _store.cache_clear()
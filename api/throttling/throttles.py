@@ -0,0 +1,97 @@
+"""
+Per-user token buckets.
+
+Every user, or client address before authentication, has a bucket per
+scope of endpoints: 'metadata' (the default), 'upload' and 'download'.
+Views pick their scope with `throttle_scope`, an @action argument for
+actions. A scope's rate in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], e.g.
+'3000/min', refills its buckets at 50 requests a second and lets them hold
+a minute's worth: a client may burst up to 3000 requests, then keeps to the
+average. Unlike DRF's own throttles no request history is kept, only the
+level and when it was last changed.
+
+The buckets of transfer bandwidth (api.throttling.transfers) go into debt
+instead of refusing, and the stream waits until it is repaid.
+"""
+import time
+
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from api.throttling.state import get_state
+
+
+DEFAULT_SCOPE = 'metadata'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'count/period' as (tokens per second, bucket size); None means no limit."""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period[0]], int(count)
+
+
+def scope_rate(scope):
+    return parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+
+
+def _take(cost, rate, capacity, debt):
+    def take(value):
+        now = time.time()
+        level, stamp = value or (capacity, now)
+        level = min(capacity, level + (now - stamp) * rate)
+        if level >= cost or debt:
+            level -= cost
+            wait = max(0.0, -level / rate)
+        else:
+            wait = (cost - level) / rate
+        # Kept until the bucket is full again; after that, no value means the same.
+        return (level, now), (capacity - level) / rate + 1, wait
+    return take
+
+
+def take(key, rate, capacity, cost=1, debt=False):
+    """
+    Take `cost` tokens from the bucket under `key` and return 0, or the
+    seconds until there are enough of them, taking none. With `debt` the
+    tokens are always taken and the seconds are until the debt is repaid.
+    """
+    return get_state().update(key, _take(cost, rate, capacity, debt))
+
+
+async def atake(key, rate, capacity, cost=1, debt=False):
+    return await get_state().aupdate(key, _take(cost, rate, capacity, debt))
+
+
+def _key(scope, ident):
+    return f"throttle:{scope}:{ident}"
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """A bucket per user (or client address) and the view's `throttle_scope`."""
+
+    def allow_request(self, request, view):
+        self.delay = None
+        scope = getattr(view, 'throttle_scope', None) or DEFAULT_SCOPE
+        limit = scope_rate(scope)
+        if limit is None:
+            return True
+        user = request.user
+        ident = user.pk if user is not None and user.is_authenticated else f"address:{self.get_ident(request)}"
+        self.delay = take(_key(scope, ident), *limit)
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+async def athrottle(user, scope=DEFAULT_SCOPE):
+    """The same check for the native async views, which only serve authenticated users."""
+    limit = scope_rate(scope)
+    if limit is not None:
+        delay = await atake(_key(scope, user.pk), *limit)
+        if delay:
+            raise exceptions.Throttled(delay)
@@ -0,0 +1,186 @@
+"""
+Uploads and downloads: a slot in the fair queue and shaped bandwidth.
+
+A Transfer is one upload chunk or download of one user. It holds a slot
+(api.throttling.fairqueue) while its bytes move, and it paces them to the
+user's share of THROTTLE_BANDWIDTH: each direction has a bucket of bytes
+per user, shared by all of the user's transfers, which streams draw from
+block by block and sleep off when it runs dry. Under ASGI the sleeping is
+done on the event loop, so a shaped download holds no thread either.
+
+Downloads served by the web server (X-Accel-Redirect, X-Sendfile) or
+redirected to the storage are not shaped here; nginx is told the user's
+rate through X-Accel-Limit-Rate. Responses sent with sendfile() from a
+local file keep their slot until they are closed but are only shaped when
+a rate is set, in which case they are streamed instead.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from api.metrics import recorder
+from api.throttling import fairqueue, throttles
+
+
+def bandwidth(direction):
+    """The bytes per second each user may move in `direction`, or None for no limit."""
+    return getattr(settings, 'THROTTLE_BANDWIDTH', {}).get(direction)
+
+
+def content_length(request):
+    return int(request.META.get('CONTENT_LENGTH') or 0)
+
+
+def weight(user):
+    return getattr(settings, 'TRANSFER_STAFF_WEIGHT', 1) if user.is_staff else 1
+
+
+class ShapedReader:
+    """A request stream read no faster than the transfer's bandwidth."""
+
+    def __init__(self, stream, transfer):
+        self.stream = stream
+        self.transfer = transfer
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.transfer.pace(len(data))
+        return data
+
+
+def discard(response):
+    """
+    Release the file or iterator of a response that will not be sent. Not
+    response.close(): that also sends request_finished, which closes the
+    request's database connection while the view is still running.
+    """
+    closers, response._resource_closers = response._resource_closers, []
+    for closer in closers:
+        closer()
+
+
+class Transfer:
+    def __init__(self, user, direction):
+        self.user = user
+        self.direction = direction
+        self.rate = bandwidth(direction)
+        self.ticket = None
+        self.renewed = 0.0
+
+    @property
+    def shaped(self):
+        return self.rate is not None
+
+    def _bucket(self):
+        # One second's worth of burst; a block larger than that just waits longer.
+        return f"bandwidth:{self.direction}:{self.user.pk}", self.rate, self.rate
+
+    def _should_renew(self):
+        if self.ticket is None or time.monotonic() - self.renewed < fairqueue.lease_seconds() / 2:
+            return False
+        self.renewed = time.monotonic()
+        return True
+
+    def acquire(self, size):
+        self.ticket = fairqueue.acquire(self.user.pk, size, weight(self.user))
+        self.renewed = time.monotonic()
+
+    async def aacquire(self, size):
+        self.ticket = await fairqueue.aacquire(self.user.pk, size, weight(self.user))
+        self.renewed = time.monotonic()
+
+    def release(self):
+        ticket, self.ticket = self.ticket, None
+        if ticket is not None:
+            fairqueue.release(ticket)
+
+    async def arelease(self):
+        ticket, self.ticket = self.ticket, None
+        if ticket is not None:
+            await fairqueue.arelease(ticket)
+
+    @contextmanager
+    def slot(self, size):
+        self.acquire(size)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, size):
+        await self.aacquire(size)
+        try:
+            yield self
+        finally:
+            await self.arelease()
+
+    def pace(self, size):
+        """Account for `size` bytes moved: sleep off any bandwidth debt and keep the slot leased."""
+        if self.shaped and size:
+            delay = throttles.take(*self._bucket(), cost=size, debt=True)
+            if delay:
+                with recorder.timed('queue'):
+                    time.sleep(delay)
+        if self._should_renew():
+            fairqueue.renew(self.ticket)
+
+    async def apace(self, size):
+        if self.shaped and size:
+            delay = await throttles.atake(*self._bucket(), cost=size, debt=True)
+            if delay:
+                with recorder.timed('queue'):
+                    await asyncio.sleep(delay)
+        if self._should_renew():
+            await fairqueue.arenew(self.ticket)
+
+    def reader(self, stream):
+        return ShapedReader(stream, self) if self.shaped and stream is not None else stream
+
+    def iterate(self, iterator):
+        iterator = iter(iterator)
+        try:
+            for block in iterator:
+                self.pace(len(block))
+                yield block
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    async def aiterate(self, iterator):
+        try:
+            async for block in iterator:
+                await self.apace(len(block))
+                yield block
+        finally:
+            await iterator.aclose()
+
+    def admit(self, request, response):
+        """
+        Hold a slot for the content a download response streams, until the
+        response is closed. Raises SlotsBusy when none is free in time.
+        """
+        if not response.streaming or request.method == 'HEAD':
+            return response
+        try:
+            self.acquire(int(response.get('Content-Length', 0)))
+        except fairqueue.SlotsBusy:
+            discard(response)
+            raise
+        response._resource_closers.append(self.release)
+        return response
+
+    async def aadmit(self, request, response):
+        if not response.streaming or request.method == 'HEAD':
+            return response
+        try:
+            await self.aacquire(int(response.get('Content-Length', 0)))
+        except fairqueue.SlotsBusy:
+            discard(response)
+            raise
+        # Closed from sync code: the ASGI handler calls close() through sync_to_async.
+        response._resource_closers.append(self.release)
+        return response
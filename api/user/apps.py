@@ -7,5 +7,4 @@ class UserConfig(AppConfig):
 
     def ready(self):
         # Import your signal handlers or other initialization code here.
-        # import api.user.signals
-        pass
+        import api.user.signals  # noqa: F401
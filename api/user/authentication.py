@@ -0,0 +1,254 @@
+"""
+JWT authentication without a user query per request.
+
+CachedJWTAuthentication trusts the signed user id in the access token and
+builds the user from a small per-process cache of the fields authorization
+needs (active/staff flags, username, root folder). Every other field is
+deferred and loaded from the database only if something reads it. Entries
+live for AUTH_USER_CACHE_SECONDS and are dropped as soon as the user is
+saved or deleted in this process; other processes pick the change up when
+their entry expires.
+
+Plain async views (api.storage.async_views) call aauthenticate(), which
+uses the same cache and the async ORM on a miss.
+
+CachedTokenRefreshSerializer uses the same cache on the refresh endpoint. It
+checks refresh tokens against an in-memory set of blacklisted JTIs that is
+synced incrementally from the blacklist table. The authoritative check is
+blacklisting the rotated token: the blacklist row is unique per token, so a
+replay that the set has not seen yet still fails there.
+
+Set AUTH_VERIFY_USER_IN_DB to go back to loading the user from the database
+on every request and refresh.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+
+User = get_user_model()
+
+CACHED_FIELDS = ('uuid', 'username', 'is_active', 'is_staff', 'is_superuser', 'root_folder_uuid')
+
+_lock = threading.Lock()
+_users = OrderedDict()
+
+
+def verify_in_db():
+    return getattr(settings, 'AUTH_VERIFY_USER_IN_DB', False)
+
+
+def _ttl():
+    return getattr(settings, 'AUTH_USER_CACHE_SECONDS', 30)
+
+
+def _max_users():
+    return getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000)
+
+
+def forget_user(user_id):
+    with _lock:
+        _users.pop(str(user_id), None)
+
+
+def clear():
+    with _lock:
+        _users.clear()
+    blacklist.clear()
+
+
+def _lookup(user_id):
+    with _lock:
+        cached = _users.get(str(user_id))
+        if cached is not None and cached[0] > time.monotonic():
+            _users.move_to_end(str(user_id))
+            return cached[1]
+    return None
+
+
+def _store(user_id, state):
+    if state is not None:
+        with _lock:
+            _users[str(user_id)] = (time.monotonic() + _ttl(), state)
+            _users.move_to_end(str(user_id))
+            while len(_users) > _max_users():
+                _users.popitem(last=False)
+    return state
+
+
+def _state_query(user_id):
+    return User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(*CACHED_FIELDS)
+
+
+def _build(state):
+    if state is None:
+        return None
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in state]
+    return User.from_db('default', fields, [state[name] for name in fields])
+
+
+def cached_user(user_id):
+    """A User carrying only the cached fields; the rest load from the database on first access."""
+    return _build(_lookup(user_id) or _store(user_id, _state_query(user_id).first()))
+
+
+async def acached_user(user_id):
+    return _build(_lookup(user_id) or _store(user_id, await _state_query(user_id).afirst()))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        # Revocation by password change needs the password hash from the row.
+        if verify_in_db() or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as exc:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from exc
+        return self._check(cached_user(user_id))
+
+    def _check(self, user):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    async def aauthenticate(self, request):
+        """authenticate() for plain async views; the user row is only read on a cache miss."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if verify_in_db() or api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(self.get_user)(validated_token), validated_token
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as exc:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from exc
+        return self._check(await acached_user(user_id)), validated_token
+
+
+class BlacklistCache:
+    """Blacklisted JTIs, synced from the database at most every AUTH_BLACKLIST_SYNC_SECONDS."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.jtis = {}
+            self.last_id = 0
+            self.synced_at = None
+
+    def add(self, jti, expires_at):
+        with self.lock:
+            self.jtis[jti] = expires_at
+
+    def sync(self):
+        rows = list(
+            BlacklistedToken.objects.filter(id__gt=self.last_id, token__expires_at__gt=timezone.now())
+            .order_by('id').values_list('id', 'token__jti', 'token__expires_at')
+        )
+        now = timezone.now()
+        with self.lock:
+            for row_id, jti, expires_at in rows:
+                self.jtis[jti] = expires_at
+                self.last_id = max(self.last_id, row_id)
+            # Expired tokens are rejected by their signature check anyway.
+            self.jtis = {jti: expires_at for jti, expires_at in self.jtis.items() if expires_at > now}
+            self.synced_at = time.monotonic()
+
+    def __contains__(self, jti):
+        interval = getattr(settings, 'AUTH_BLACKLIST_SYNC_SECONDS', 5)
+        if self.synced_at is None or time.monotonic() - self.synced_at >= interval:
+            self.sync()
+        return jti in self.jtis
+
+
+blacklist = BlacklistCache()
+
+
+class CachedRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        if verify_in_db():
+            return super().check_blacklist()
+        if self.payload[api_settings.JTI_CLAIM] in blacklist:
+            raise TokenError(_("Token is blacklisted"))
+
+    def _outstanding(self):
+        token, _ = OutstandingToken.objects.get_or_create(
+            jti=self.payload[api_settings.JTI_CLAIM],
+            defaults={
+                'user_id': self.payload.get(api_settings.USER_ID_CLAIM),
+                'created_at': self.current_time,
+                'token': str(self),
+                'expires_at': datetime_from_epoch(self.payload['exp']),
+            },
+        )
+        return token
+
+    def blacklist(self):
+        """Blacklist this token; raises TokenError if it already was, even if the cached set had missed it."""
+        if verify_in_db():
+            return super().blacklist()
+        outstanding = self._outstanding()
+        try:
+            # No savepoint: a failure aborts the refresh and its transaction anyway.
+            return BlacklistedToken.objects.create(token=outstanding)
+        except IntegrityError as exc:
+            raise TokenError(_("Token is blacklisted")) from exc
+
+    def outstand(self):
+        if verify_in_db():
+            return super().outstand()
+        return OutstandingToken.objects.create(
+            user_id=self.payload.get(api_settings.USER_ID_CLAIM),
+            jti=self.payload[api_settings.JTI_CLAIM],
+            created_at=self.current_time,
+            token=str(self),
+            expires_at=datetime_from_epoch(self.payload['exp']),
+        )
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+    def validate(self, attrs):
+        if verify_in_db():
+            return super().validate(attrs)
+        refresh = self.token_class(attrs['refresh'])
+        user = cached_user(refresh.payload.get(api_settings.USER_ID_CLAIM))
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            with transaction.atomic():
+                if api_settings.BLACKLIST_AFTER_ROTATION:
+                    refresh.blacklist()
+                refresh.set_jti()
+                refresh.set_exp()
+                refresh.set_iat()
+                refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
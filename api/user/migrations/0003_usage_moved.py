@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """The counters now live on storage.Usage, which 0018 copied them to."""
+
+    dependencies = [
+        ('user', '0002_rollups'),
+        ('storage', '0018_usage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='file_count',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='folder_count',
+        ),
+        migrations.RemoveField(
+            model_name='customuser',
+            name='total_bytes',
+        ),
+    ]
@@ -7,6 +7,8 @@ from django.contrib.auth.models import AbstractUser
 class CustomUser(AbstractUser):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     root_folder_uuid = models.UUIDField(null=True, blank=True, editable=False, verbose_name="root_folder_uuid")
+    # Null falls back to settings.DEFAULT_USER_QUOTA_BYTES (itself null for unlimited).
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.username
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from api.storage.models import Folder
+from api.user import authentication
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_root_folder(sender, instance, created, **kwargs):
+    if created:
+        root_folder = Folder.objects.create(name='root', owner=instance)
+        User.objects.filter(pk=instance.pk).update(root_folder_uuid=root_folder.uuid)
+        instance.root_folder_uuid = root_folder.uuid
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    authentication.forget_user(instance.pk)
+    transaction.on_commit(lambda: authentication.forget_user(instance.pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def remember_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        token = instance.token
+        transaction.on_commit(lambda: authentication.blacklist.add(token.jti, token.expires_at))
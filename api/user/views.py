@@ -3,15 +3,16 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 
+from api.replicas.routing import replica_reads
+from api.storage import listing_cache, tree
 from api.storage.models import File, Folder
-from api.storage.serializers import RegisterSerializer, FileSerializer, FolderSerializer, UserSerializer
+from api.storage.serializers import RegisterSerializer, FileSerializer, FolderNodeSerializer, FolderSerializer, UserSerializer
 
 
 
@@ -19,16 +20,18 @@ User = get_user_model()
 
 
 class UserViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('usage')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "uuid"
 
+    @replica_reads
     def retrieve(self, request, uuid=None):
         if uuid == "default":
-            user = request.user
+            # request.user only carries what authentication needs.
+            user = self.get_queryset().get(pk=request.user.pk)
         else:
-            user = get_object_or_404(User, uuid=uuid)
+            user = get_object_or_404(self.get_queryset(), uuid=uuid)
         serializer = self.get_serializer(user)
         return Response(serializer.data)
 
@@ -56,17 +59,43 @@ class RegisterView(generics.CreateAPIView):
 
 
 class UserDashboardView(generics.ListAPIView):
+    """
+    The user's root folder. With `?tree=1` the whole folder tree is returned
+    nested (optionally cut off at `?depth=N`), built from two flat queries.
+    """
     serializer_class = FolderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         # Return only the folders belonging to the logged-in user
         return Folder.objects.filter(uuid=self.request.user.root_folder_uuid).order_by('created_at')
-    
-    
-@receiver(post_save, sender=User)
-def create_root_folder(sender, instance, created, **kwargs):
-    if created:
-        root_folder = Folder.objects.create(name='root', owner=instance)
-        User.objects.filter(pk=instance.pk).update(root_folder_uuid=root_folder.uuid)
 
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('tree') not in ('1', 'true'):
+            root_uuid = request.user.root_folder_uuid
+            return listing_cache.cached_response(
+                request,
+                f"dashboard:{root_uuid}",
+                listing_cache.folder_version(root_uuid),
+                lambda: super(UserDashboardView, self).list(request, *args, **kwargs).data,
+            )
+        depth = request.query_params.get('depth')
+        if depth is not None and not depth.isdigit():
+            raise ValidationError({'depth': ['Expected a non-negative integer.']})
+        return listing_cache.cached_response(
+            request,
+            "dashboard-tree",
+            listing_cache.tree_version(request.user.pk),
+            lambda: self.build_tree(request, int(depth) if depth is not None else None),
+        )
+
+    def build_tree(self, request, max_depth):
+        context = self.get_serializer_context()
+        root = tree.build_tree(
+            request.user,
+            max_depth=max_depth,
+            serialize_folder=lambda folder: FolderNodeSerializer(folder, context=context).data,
+            serialize_files=lambda files: FileSerializer(files, many=True, context=context).data,
+        )
+        return [root] if root is not None else []
@@ -0,0 +1,83 @@
+"""
+Requests per second through JWT authentication, with the user loaded from
+the database on every request (AUTH_VERIFY_USER_IN_DB) and from the
+per-process cache, plus refresh-token rotations per second.
+
+    python benchmarks/auth.py --requests 2000
+
+Runs in-process against a throwaway test database (see harness), so the
+numbers compare the two paths rather than a deployment.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import harness  # noqa: E402
+
+
+def measure(label, count, call):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    started = time.perf_counter()
+    for _ in range(count):
+        call()
+    elapsed = time.perf_counter() - started
+    with CaptureQueriesContext(connection) as queries:
+        call()
+    result = {'requests_per_second': round(count / elapsed), 'queries': len(queries)}
+    print(f"{label:<32} {result['requests_per_second']:>7} req/s  {result['queries']} queries/req")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    harness.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--refreshes', type=int, default=300)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    options = parser.parse_args()
+    harness.setup(options)
+
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    from api.user import authentication
+
+    results = {}
+    with harness.test_database(options):
+        get_user_model().objects.filter(username='bench').delete()
+        get_user_model().objects.create_user(username='bench', password='bench-password-1')
+        client = Client()
+        tokens = client.post('/api/user/login/', {'username': 'bench', 'password': 'bench-password-1'}).json()
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {tokens['access']}"}
+
+        def request():
+            assert client.get('/api/changes/', **headers).status_code == 200
+
+        refresh = [tokens['refresh']]
+
+        def rotate():
+            response = client.post('/api/user/token-refresh/', {'refresh': refresh[0]})
+            assert response.status_code == 200
+            refresh[0] = response.json()['refresh']
+
+        for verify in (True, False):
+            label = 'database' if verify else 'cached'
+            with override_settings(AUTH_VERIFY_USER_IN_DB=verify):
+                authentication.clear()
+                request()
+                results[f"changes_{label}"] = measure(f"GET /api/changes/ ({label})", options.requests, request)
+                results[f"refresh_{label}"] = measure(f"token refresh ({label})", options.refreshes, rotate)
+        environment = harness.environment()
+
+    if options.output:
+        harness.write_json(options.output, {'environment': environment, 'scenarios': results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Latency, queries and memory per endpoint over a generated drive.
+
+    python benchmarks/endpoints.py --sqlite --keepdb --output benchmarks/results/base.json
+    python benchmarks/endpoints.py --sqlite --keepdb --compare benchmarks/results/base.json
+
+Each scenario is requested --repeat times with a real JWT through the test
+client after --warmup requests, and reports p50/p95/p99 latency, queries
+per request, response size, the Python allocation peak of one request
+(tracemalloc) and the process's peak RSS after the scenario. With --cold
+every cache is cleared before each request, so cached listings are rebuilt.
+
+Results are written as JSON together with the commit and environment they
+were measured on. --compare reads an earlier result and exits with status 1
+when a scenario's p95 grew by more than --threshold percent or it makes
+more queries than before.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import generate, harness  # noqa: E402
+
+
+SCENARIOS = {
+    'dashboard': lambda t: '/api/user/dashboard/',
+    'dashboard_tree': lambda t: '/api/user/dashboard/?tree=1&depth=2',
+    'folder_root': lambda t: f"/api/folder/{t['root']}/",
+    'folder_wide': lambda t: f"/api/folder/{t['wide']}/",
+    'folder_deep': lambda t: f"/api/folder/{t['deep']}/",
+    'children_wide_by_size': lambda t: f"/api/folder/{t['wide']}/children/?ordering=-size&page_size=200",
+    'ancestors_deep': lambda t: f"/api/folder/{t['deep']}/ancestors/",
+    'subtree_branch': lambda t: f"/api/folder/{t['branch']}/subtree/?depth=1",
+    'file_detail': lambda t: f"/api/file/{t['file']}/",
+    'file_download': lambda t: f"/api/file/{t['file']}/download/",
+    'search_prefix': lambda t: '/api/search/?q=invoice',
+    'search_substring': lambda t: '/api/search/?q=port',
+    'changes': lambda t: '/api/changes/',
+}
+
+
+def targets(user):
+    """The uuids the scenarios request, looked up from the drive so kept databases work too."""
+    from django.db.models import Count
+
+    from api.storage.models import File, Folder
+
+    folders = Folder.objects.filter(owner=user)
+    wide = (
+        File.objects.filter(owner=user).values('folder__uuid').annotate(files=Count('id'))
+        .order_by('-files').first()['folder__uuid']
+    )
+    return {
+        'root': user.root_folder_uuid,
+        'wide': wide,
+        'deep': folders.order_by('-depth', 'pk').values_list('uuid', flat=True).first(),
+        'branch': folders.filter(depth=1).exclude(uuid=wide).order_by('pk').values_list('uuid', flat=True).first(),
+        'file': File.objects.filter(owner=user).order_by('pk').values_list('uuid', flat=True).first(),
+    }
+
+
+def fetch(client, url, headers):
+    response = client.get(url, **headers)
+    assert response.status_code == 200, (url, response.status_code)
+    if response.streaming:
+        return sum(len(part) for part in response.streaming_content)
+    return len(response.content)
+
+
+def reset_caches(cold):
+    from django.core.cache import caches
+
+    from api.user import authentication
+
+    if cold:
+        for cache in caches.all():
+            cache.clear()
+        authentication.clear()
+
+
+def run_scenario(client, url, headers, options):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    for _ in range(options.warmup):
+        reset_caches(options.cold)
+        fetch(client, url, headers)
+    latencies = []
+    for _ in range(options.repeat):
+        reset_caches(options.cold)
+        started = time.perf_counter()
+        size = fetch(client, url, headers)
+        latencies.append(time.perf_counter() - started)
+
+    reset_caches(options.cold)
+    with CaptureQueriesContext(connection) as queries:
+        fetch(client, url, headers)
+    # Read now: the next request clears the log the context reads from.
+    query_count = len(queries)
+    reset_caches(options.cold)
+    tracemalloc.start()
+    fetch(client, url, headers)
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'url': url,
+        'latency': harness.latency_summary(latencies),
+        'queries': query_count,
+        'response_bytes': size,
+        'peak_alloc_kib': round(peak_alloc / 1024, 1),
+        'peak_rss_mib': harness.peak_rss_mib(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print scenario-by-scenario changes against `baseline`; returns whether anything regressed."""
+    regressed = False
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        p95, old_p95 = result['latency']['p95_ms'], before['latency']['p95_ms']
+        change = (p95 - old_p95) / old_p95 * 100 if old_p95 else 0.0
+        flags = []
+        if change > threshold:
+            flags.append(f"p95 +{change:.0f}%")
+        if result['queries'] > before['queries']:
+            flags.append(f"queries {before['queries']} -> {result['queries']}")
+        regressed = regressed or bool(flags)
+        print(f"{name:<24} p95 {old_p95:>9.2f} -> {p95:>9.2f} ms ({change:+.0f}%)  {'  '.join(flags) or 'ok'}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    harness.add_arguments(parser)
+    generate.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--cold', action='store_true', help="clear caches before every request")
+    parser.add_argument('--only', action='append', choices=sorted(SCENARIOS), help="run just these scenarios")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=20.0, help="allowed p95 growth in percent")
+    options = parser.parse_args()
+    harness.setup(options)
+
+    from django.test import Client
+
+    with harness.test_database(options):
+        user = generate.ensure_drive(options)[0]
+        client = Client()
+        tokens = client.post('/api/user/login/', {'username': user.username, 'password': generate.PASSWORD}).json()
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {tokens['access']}"}
+        found = targets(user)
+
+        results = {}
+        for name in options.only or SCENARIOS:
+            results[name] = result = run_scenario(client, SCENARIOS[name](found), headers, options)
+            latency = result['latency']
+            print(
+                f"{name:<24} p50 {latency['p50_ms']:>9.2f}  p95 {latency['p95_ms']:>9.2f}  "
+                f"p99 {latency['p99_ms']:>9.2f} ms  {result['queries']:>3} queries  "
+                f"{result['peak_alloc_kib']:>9.1f} KiB alloc  rss {result['peak_rss_mib']} MiB"
+            )
+        drive = {
+            'users': generate.bench_users().count(),
+            'folders': user.folders.count(),
+            'files': user.files.count(),
+        }
+        report = {
+            'environment': harness.environment(),
+            'options': {key: value for key, value in vars(options).items() if key not in ('output', 'compare')},
+            'drive': drive,
+            'scenarios': results,
+        }
+
+    if options.output:
+        harness.write_json(options.output, report)
+    if options.compare:
+        baseline = json.loads(Path(options.compare).read_text())
+        print(f"\nAgainst {options.compare} ({baseline['environment'].get('commit')}):")
+        if compare(results, baseline['scenarios'], options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Synthetic drives for benchmarks: users with a balanced folder tree, one
+deep chain of folders and one very wide folder, filled with File rows.
+
+    python benchmarks/generate.py --sqlite --keepdb --depth 4 --breadth 8 --files 250
+
+Rows are written with bulk_create, so signals do not run: paths and depths
+are set here, blob reference counts and rollups are fixed up at the end.
+Files share a small pool of real blobs so downloads work. Everything is
+derived from --seed, so the same options always build the same drive.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import harness  # noqa: E402
+
+
+PASSWORD = 'bench-password-1'
+WORDS = (
+    'annual', 'report', 'invoice', 'holiday', 'photo', 'draft', 'budget', 'meeting', 'notes', 'scan',
+    'contract', 'summary', 'backup', 'design', 'final', 'review', 'project', 'family', 'receipt', 'plan',
+)
+EXTENSIONS = ('pdf', 'jpg', 'png', 'txt', 'docx', 'xlsx', 'zip', 'mp4', 'csv', 'md')
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--depth', type=int, default=3, help="levels of the balanced tree below the root")
+    parser.add_argument('--breadth', type=int, default=6, help="subfolders per folder in the balanced tree")
+    parser.add_argument('--files', type=int, default=40, help="files per folder in the balanced tree")
+    parser.add_argument('--chain', type=int, default=40, help="depth of the single deep chain of folders")
+    parser.add_argument('--wide', type=int, default=5000, help="files in the single wide folder")
+    parser.add_argument('--blobs', type=int, default=32, help="distinct contents the files share")
+    parser.add_argument('--blob-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def file_name(rng, index):
+    return f"{rng.choice(WORDS)} {rng.choice(WORDS)} {index}.{rng.choice(EXTENSIONS)}"
+
+
+class Generator:
+    def __init__(self, options, batch_size=5000):
+        self.options = options
+        self.batch_size = batch_size
+        self.rng = random.Random(options.seed)
+        self.blobs = []
+        self.folders = 0
+        self.files = 0
+
+    def make_blobs(self):
+        from django.core.files.base import ContentFile
+
+        from api.storage import blobs
+
+        for index in range(self.options.blobs):
+            content = random.Random(f"{self.options.seed}:{index}").randbytes(self.options.blob_size)
+            self.blobs.append(blobs.store_content(ContentFile(content, name=f"bench-{index}")))
+
+    def add_folders(self, user, parents, count, name):
+        """`count` children under each of `parents`, created level-wise so their paths can be set."""
+        from api.storage.models import Folder
+
+        children = [
+            Folder(
+                name=f"{name} {index}", parent_id=parent.uuid, owner=user,
+                path=parent.subtree_prefix, depth=parent.depth + 1,
+            )
+            for parent in parents for index in range(count)
+        ]
+        created = Folder.objects.bulk_create(children, batch_size=self.batch_size)
+        self.folders += len(created)
+        return created
+
+    def add_files(self, user, folders, count):
+        from api.storage.models import File
+
+        pending = []
+        for folder in folders:
+            for index in range(count):
+                blob = self.blobs[self.rng.randrange(len(self.blobs))]
+                pending.append(File(
+                    name=file_name(self.rng, index), folder=folder, owner=user,
+                    blob=blob, size=blob.size, file=blob.file.name,
+                ))
+                if len(pending) >= self.batch_size:
+                    self.files += len(File.objects.bulk_create(pending))
+                    pending = []
+        if pending:
+            self.files += len(File.objects.bulk_create(pending))
+
+    def add_user(self, index):
+        from django.contrib.auth import get_user_model
+
+        from api.storage.models import Folder
+
+        user = get_user_model().objects.create_user(username=f"bench-{index}", password=PASSWORD)
+        root = Folder.objects.get(uuid=user.root_folder_uuid)
+        options = self.options
+
+        level = [root]
+        self.add_files(user, level, options.files)
+        for depth in range(options.depth):
+            level = self.add_folders(user, level, options.breadth, f"level {depth + 1}")
+            self.add_files(user, level, options.files)
+
+        parent = root
+        for depth in range(options.chain):
+            parent = self.add_folders(user, [parent], 1, f"deep {depth + 1}")[0]
+        self.add_files(user, [parent], min(options.files, 10))
+
+        wide = self.add_folders(user, [root], 1, "wide")
+        self.add_files(user, wide, options.wide)
+        return user
+
+    def run(self):
+        from django.contrib.auth import get_user_model
+        from django.db import transaction
+        from django.db.models import Count
+
+        from api.storage import rollups
+        from api.storage.models import Blob, File
+
+        self.make_blobs()
+        users = []
+        for index in range(self.options.users):
+            with transaction.atomic():
+                users.append(self.add_user(index))
+        counts = File.all_objects.filter(blob__in=self.blobs).values('blob_id').annotate(refs=Count('id'))
+        for row in counts:
+            Blob.objects.filter(pk=row['blob_id']).update(ref_count=row['refs'])
+        rollups.recompute(get_user_model().objects.filter(pk__in=[user.pk for user in users]))
+        return users
+
+
+def bench_users():
+    from django.contrib.auth import get_user_model
+
+    return get_user_model().objects.filter(username__startswith='bench-').order_by('username')
+
+
+def ensure_drive(options):
+    """Generate the drive unless a kept database already has one; returns its users."""
+    users = list(bench_users())
+    if users:
+        print(f"Reusing the {len(users)} generated users in the kept database; drop --keepdb to rebuild.")
+        return users
+    started = time.perf_counter()
+    generator = Generator(options)
+    users = generator.run()
+    print(
+        f"Generated {len(users)} users, {generator.folders} folders and {generator.files} files "
+        f"in {time.perf_counter() - started:.1f}s."
+    )
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    harness.add_arguments(parser)
+    add_arguments(parser)
+    options = parser.parse_args()
+    harness.setup(options)
+    with harness.test_database(options):
+        ensure_drive(options)
+
+
+if __name__ == '__main__':
+    main()
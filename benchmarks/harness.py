@@ -0,0 +1,116 @@
+"""
+Shared plumbing for the benchmark scripts.
+
+Scripts call setup() with their parsed options before importing anything
+from Django, then run inside test_database(). That is a throwaway test
+database of the configured backend (a local Postgres), or with --sqlite a
+SQLite file next to this module. With --keepdb the database and the blob
+files survive the run, so a large generated drive is only built once.
+"""
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def add_arguments(parser):
+    parser.add_argument('--sqlite', action='store_true', help="use a local SQLite file instead of DATABASES")
+    parser.add_argument('--keepdb', action='store_true', help="keep the database and blob files for the next run")
+
+
+def setup(options):
+    if options.sqlite:
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.sqlite_settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(options):
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+
+    # DEBUG would log every query, the generator's bulk inserts included.
+    setup_test_environment(debug=False)
+    if options.keepdb:
+        media_root = ROOT / 'benchmarks' / '.bench-media'
+        media_root.mkdir(exist_ok=True)
+    else:
+        media_root = Path(tempfile.mkdtemp(prefix='bench-media-'))
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options.keepdb)
+    try:
+        with override_settings(MEDIA_ROOT=str(media_root), THUMBNAIL_WORKERS=0, THUMBNAIL_ON_UPLOAD=False):
+            yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options.keepdb)
+        if not options.keepdb:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values`, e.g. fraction=0.95."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def latency_summary(seconds):
+    """p50/p95/p99, mean and max of request durations, in milliseconds."""
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(seconds, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 3),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3),
+        'max_ms': round(max(seconds) * 1000, 3),
+    }
+
+
+def peak_rss_mib():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def environment():
+    """What the numbers were measured on, so runs of different commits can be lined up."""
+    from django import get_version
+    from django.db import connection
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
+
+
+def write_json(path, data):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + '\n')
@@ -0,0 +1,190 @@
+"""
+Many concurrent slow downloads through the ASGI application on one worker.
+
+    python benchmarks/slow_downloads.py --clients 1000 --size 1048576 --delay 0.5
+
+Every client downloads the same file and takes `--delay` seconds to accept
+each body chunk (DOWNLOAD_CHUNK_SIZE). Each mode runs in its own process
+against a throwaway test database (see harness) and reports wall time, time to first byte,
+the peak number of threads, how many of them were doing work rather than
+parked in an executor, and the growth of peak RSS. Django's adapter for sync
+middleware gives every in-flight request a thread of its own either way; what
+differs is whether it has anything to do.
+
+  async  the native async download view (api.storage.async_views)
+  sync   the DRF view with a plain iterator body, as before the async views
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import harness  # noqa: E402
+
+
+async def download(application, url, token, delay, result):
+    started = time.perf_counter()
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            result['ttfb'] = time.perf_counter() - started
+        elif message['type'] == 'http.response.body':
+            result['bytes'] = result.get('bytes', 0) + len(message.get('body', b''))
+            if message.get('body'):
+                await asyncio.sleep(delay)
+            if not message.get('more_body'):
+                finished.set()
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': url, 'raw_path': url.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 40000), 'server': ('testserver', 80),
+    }
+    await application(scope, receive, send)
+    result['total'] = time.perf_counter() - started
+
+
+def busy_threads():
+    """Threads other than this one that are not parked waiting for executor work."""
+    busy = 0
+    for ident, frame in sys._current_frames().items():
+        if ident == threading.get_ident():
+            continue
+        # An idle executor thread sits in _worker, blocked in the C queue get().
+        if frame.f_code.co_name != '_worker':
+            busy += 1
+    return busy
+
+
+async def run_clients(application, url, token, options):
+    peak_threads = threading.active_count()
+    peak_busy = 0
+    done = False
+
+    async def sample():
+        nonlocal peak_threads, peak_busy
+        while not done:
+            peak_threads = max(peak_threads, threading.active_count())
+            peak_busy = max(peak_busy, busy_threads())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    results = [{} for _ in range(options.clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(download(application, url, token, options.delay, result) for result in results))
+    wall = time.perf_counter() - started
+    done = True
+    await sampler
+    return results, wall, peak_threads, peak_busy
+
+
+def run_mode(options):
+    harness.setup(options)
+
+    from django.contrib.auth import get_user_model
+    from django.core.files.base import ContentFile
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api.storage import blobs, downloads
+    from api.storage.models import File, Folder
+    from config.asgi import application
+
+    if options.mode == 'sync':
+        downloads.is_asgi = lambda request: False
+
+    with harness.test_database(options):
+        user = get_user_model().objects.create_user(username='bench', password='bench-password-1')
+        folder = Folder.objects.get(uuid=user.root_folder_uuid)
+        content = ContentFile(os.urandom(options.size))
+        file = blobs.attach(File(name='bench.bin', folder=folder, owner=user), blobs.store_content(content))
+        file.save()
+        token = str(AccessToken.for_user(user))
+        url = f'/api/file/{file.uuid}/download/'
+
+        # Warm up imports, the URL resolver and the user cache.
+        warm = {}
+        asyncio.run(download(application, url, token, 0, warm))
+        assert warm['status'] == 200 and warm['bytes'] == options.size, warm
+
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results, wall, peak_threads, peak_busy = asyncio.run(run_clients(application, url, token, options))
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        environment = harness.environment()
+
+    failed = [result for result in results if result.get('status') != 200 or result.get('bytes') != options.size]
+    ttfb = [result['ttfb'] for result in results if 'ttfb' in result]
+    return {
+        'mode': options.mode,
+        'clients': options.clients,
+        'failed': len(failed),
+        'wall_seconds': round(wall, 2),
+        'ttfb_p50': round(statistics.median(ttfb), 3),
+        'ttfb_p99': round(harness.percentile(ttfb, 0.99), 3),
+        'peak_threads': peak_threads,
+        'peak_busy_threads': peak_busy,
+        'rss_growth_mib': round((peak_rss - baseline) / 1024, 1),
+        'environment': environment,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sqlite', action='store_true', help="use a local SQLite file instead of DATABASES")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=1024 * 1024, help="file size in bytes")
+    parser.add_argument('--delay', type=float, default=0.5, help="seconds each client takes per chunk")
+    parser.add_argument('--mode', choices=['async', 'sync'], action='append')
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    # Each child builds its own database; there is nothing worth keeping.
+    options.keepdb = False
+
+    if options.child:
+        options.mode = options.mode[0]
+        print(json.dumps(run_mode(options)))
+        return
+
+    results = {}
+    for mode in options.mode or ['async', 'sync']:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--mode', mode, '--clients', str(options.clients),
+             '--size', str(options.size), '--delay', str(options.delay), *(['--sqlite'] if options.sqlite else [])],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = results[mode] = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{result['mode']:<6} {result['clients']} clients  {result['failed']} failed  "
+            f"wall {result['wall_seconds']}s  ttfb p50 {result['ttfb_p50']}s p99 {result['ttfb_p99']}s  "
+            f"threads {result['peak_threads']} (busy {result['peak_busy_threads']})  rss +{result['rss_growth_mib']} MiB"
+        )
+    if options.output:
+        environment = next(iter(results.values())).pop('environment')
+        for result in results.values():
+            result.pop('environment', None)
+        harness.write_json(options.output, {'environment': environment, 'scenarios': results})
+
+
+if __name__ == '__main__':
+    main()
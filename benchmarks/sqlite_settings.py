@@ -0,0 +1,16 @@
+"""The project settings on a local SQLite file, for benchmarks run with --sqlite."""
+import os
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import BASE_DIR
+
+
+SQLITE_PATH = os.environ.get('BENCH_SQLITE_PATH', str(BASE_DIR / 'benchmarks' / '.bench.sqlite3'))
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SQLITE_PATH,
+        'TEST': {'NAME': SQLITE_PATH},
+    }
+}
@@ -25,6 +25,159 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Local files are sharded into MEDIA_ROOT/<dir>/ab/cd/ (api.storage.sharded)
+# and written atomically; MEDIA_FSYNC is 'none', 'file' or 'full'.
+MEDIA_FSYNC = os.environ.get('MEDIA_FSYNC', 'file')
+
+# Setting GCS_BUCKET_NAME stores files in Google Cloud Storage (api.storage.gcs)
+# instead of MEDIA_ROOT. GCS_API_ENDPOINT points it at fake-gcs-server locally;
+# GCS_PUBLIC_ENDPOINT is the address browsers reach signed URLs on, when it
+# differs. With an HMAC key, DOWNLOAD_SENDFILE_MODE='signed-url' redirects
+# downloads to GCS so the bytes bypass Django.
+GCS_BUCKET_NAME = os.environ.get('GCS_BUCKET_NAME') or None
+GCS_API_ENDPOINT = os.environ.get('GCS_API_ENDPOINT') or None
+GCS_PUBLIC_ENDPOINT = os.environ.get('GCS_PUBLIC_ENDPOINT') or None
+GCS_ACCESS_TOKEN = os.environ.get('GCS_ACCESS_TOKEN') or None
+GCS_HMAC_ACCESS_ID = os.environ.get('GCS_HMAC_ACCESS_ID') or None
+GCS_HMAC_SECRET = os.environ.get('GCS_HMAC_SECRET') or None
+GCS_SIGNED_URL_SECONDS = int(os.environ.get('GCS_SIGNED_URL_SECONDS', 300))
+GCS_POOL_SIZE = int(os.environ.get('GCS_POOL_SIZE', 16))
+GCS_UPLOAD_PART_SIZE = int(os.environ.get('GCS_UPLOAD_PART_SIZE', 16 * 1024 * 1024))
+GCS_UPLOAD_WORKERS = int(os.environ.get('GCS_UPLOAD_WORKERS', 8))
+GCS_READ_BLOCK_SIZE = int(os.environ.get('GCS_READ_BLOCK_SIZE', 4 * 1024 * 1024))
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.backends.GoogleCloudStorage' if GCS_BUCKET_NAME
+        else 'api.storage.backends.ShardedFileSystemStorage',
+    },
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Storage quota for users without their own quota_bytes; unset means unlimited.
+DEFAULT_USER_QUOTA_BYTES = int(os.environ['DEFAULT_USER_QUOTA_BYTES']) if os.environ.get('DEFAULT_USER_QUOTA_BYTES') else None
+
+# Resumable uploads: chunks are written straight to storage, one object per chunk.
+# Sessions report at most UPLOAD_MISSING_CHUNKS_LIMIT of the chunks still missing.
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_MIN_CHUNK_SIZE = int(os.environ.get('UPLOAD_MIN_CHUNK_SIZE', 256 * 1024))
+UPLOAD_MAX_CHUNK_SIZE = int(os.environ.get('UPLOAD_MAX_CHUNK_SIZE', 64 * 1024 * 1024))
+UPLOAD_MAX_CHUNKS = int(os.environ.get('UPLOAD_MAX_CHUNKS', 10000))
+UPLOAD_MISSING_CHUNKS_LIMIT = int(os.environ.get('UPLOAD_MISSING_CHUNKS_LIMIT', 1000))
+
+# File versions are uploaded as content-defined chunks of these sizes (see
+# api.storage.chunking); changing them only makes new versions share fewer
+# chunks with old ones. `manage.py prune_versions` keeps VERSION_KEEP per file.
+VERSION_CHUNK_MIN_SIZE = int(os.environ.get('VERSION_CHUNK_MIN_SIZE', 256 * 1024))
+VERSION_CHUNK_AVG_SIZE = int(os.environ.get('VERSION_CHUNK_AVG_SIZE', 1024 * 1024))
+VERSION_CHUNK_MAX_SIZE = int(os.environ.get('VERSION_CHUNK_MAX_SIZE', 4 * 1024 * 1024))
+VERSION_MAX_CHUNKS = int(os.environ.get('VERSION_MAX_CHUNKS', 100000))
+VERSION_KEEP = int(os.environ.get('VERSION_KEEP', 50))
+
+# Downloads are streamed in blocks of this size. Behind nginx/Apache set
+# DOWNLOAD_SENDFILE_MODE to 'x-accel-redirect' or 'x-sendfile' so the proxy
+# serves the bytes (and ranges) itself; nginx needs an `internal` location
+# for DOWNLOAD_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT. 'signed-url'
+# redirects to the storage instead, where it can sign URLs (GCS).
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 256 * 1024))
+DOWNLOAD_SENDFILE_MODE = os.environ.get('DOWNLOAD_SENDFILE_MODE') or None
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get('DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# New blobs of compressible content are stored as gzip in independently
+# decodable frames (see api.storage.compression), skipping small content,
+# known compressed formats and samples above COMPRESSION_MAX_ENTROPY bits
+# per byte. Compressed content is never handed to the sendfile modes above.
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 4096))
+COMPRESSION_MAX_ENTROPY = float(os.environ.get('COMPRESSION_MAX_ENTROPY', 7.0))
+COMPRESSION_FRAME_SIZE = int(os.environ.get('COMPRESSION_FRAME_SIZE', 256 * 1024))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+
+# Folder listings are keyset paginated; the folder detail embeds the first page.
+FOLDER_PAGE_SIZE = int(os.environ.get('FOLDER_PAGE_SIZE', 100))
+FOLDER_MAX_PAGE_SIZE = int(os.environ.get('FOLDER_MAX_PAGE_SIZE', 1000))
+
+# Upper bound on files plus folders in one batch move/copy/delete request.
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+
+# Thumbnails are rendered per blob by a pool of THUMBNAIL_WORKERS processes
+# (0 renders inline) with Pillow, and PDF previews read with pypdf.
+THUMBNAIL_SIZES = {'small': 128, 'medium': 256, 'large': 512}
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_ON_UPLOAD = os.environ.get('THUMBNAIL_ON_UPLOAD', '1') == '1'
+THUMBNAIL_WAIT_SECONDS = float(os.environ.get('THUMBNAIL_WAIT_SECONDS', 2))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get('THUMBNAIL_MAX_SOURCE_BYTES', 64 * 1024 * 1024))
+THUMBNAIL_CACHE_SECONDS = 365 * 24 * 3600
+
+# Change journal for delta sync: entries older than CHANGES_RETENTION_DAYS
+# are dropped by `manage.py compact_changes`; clients polling with an older
+# cursor are told to resync in full.
+CHANGES_RETENTION_DAYS = int(os.environ.get('CHANGES_RETENTION_DAYS', 30))
+CHANGES_PAGE_SIZE = int(os.environ.get('CHANGES_PAGE_SIZE', 500))
+CHANGES_MAX_PAGE_SIZE = int(os.environ.get('CHANGES_MAX_PAGE_SIZE', 1000))
+
+# Search runs on the database's trigram indexes under PostgreSQL and on an
+# in-process per-user index elsewhere; set SEARCH_BACKEND to 'database' or
+# 'memory' to force one. SEARCH_MEMORY_INDEXES caps how many users' indexes
+# a process keeps.
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or None
+SEARCH_MEMORY_INDEXES = int(os.environ.get('SEARCH_MEMORY_INDEXES', 32))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 50))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 200))
+
+# Deleted items stay in the trash this long before `manage.py purge_trash`
+# removes them; the worker deletes at most TRASH_PURGE_BATCH_SIZE rows per transaction.
+TRASH_RETENTION_DAYS = int(os.environ.get('TRASH_RETENTION_DAYS', 30))
+TRASH_PURGE_BATCH_SIZE = int(os.environ.get('TRASH_PURGE_BATCH_SIZE', 500))
+
+# Folder and dashboard responses are cached per folder version and served
+# with ETags. Local memory works for a single process; point CACHE_BACKEND at
+# a shared backend (file based, memcached, redis) when running several.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'hacky-cloud-drive'),
+    }
+}
+LISTING_CACHE_ALIAS = 'default'
+LISTING_CACHE_TIMEOUT = int(os.environ.get('LISTING_CACHE_TIMEOUT', 300))
+
+# Per-user load limits (api.throttling). Every user has a token bucket per
+# scope of endpoints, refilled at the scope's rate in DEFAULT_THROTTLE_RATES
+# and holding one period's worth as burst. THROTTLE_BANDWIDTH caps a user's
+# bytes per second in each direction (unset: unlimited); streams over it are
+# slowed down rather than refused. At most TRANSFER_SLOTS uploads and
+# downloads run at once (0: unlimited); the rest wait in a weighted fair
+# queue for up to TRANSFER_QUEUE_SECONDS and are then answered 503.
+# THROTTLE_STATE 'memory' keeps all of this per process; 'cache' shares it
+# between nodes through the THROTTLE_CACHE_ALIAS cache (memcached, redis).
+THROTTLE_RATES = {
+    'metadata': os.environ.get('THROTTLE_METADATA_RATE', '3000/min'),
+    'upload': os.environ.get('THROTTLE_UPLOAD_RATE', '1200/min'),
+    'download': os.environ.get('THROTTLE_DOWNLOAD_RATE', '1200/min'),
+}
+THROTTLE_BANDWIDTH = {
+    'upload': int(os.environ['THROTTLE_UPLOAD_BYTES_PER_SECOND']) if os.environ.get('THROTTLE_UPLOAD_BYTES_PER_SECOND') else None,
+    'download': int(os.environ['THROTTLE_DOWNLOAD_BYTES_PER_SECOND']) if os.environ.get('THROTTLE_DOWNLOAD_BYTES_PER_SECOND') else None,
+}
+THROTTLE_STATE = os.environ.get('THROTTLE_STATE', 'memory')
+THROTTLE_CACHE_ALIAS = 'default'
+TRANSFER_SLOTS = int(os.environ.get('TRANSFER_SLOTS', 64))
+TRANSFER_QUEUE_SECONDS = float(os.environ.get('TRANSFER_QUEUE_SECONDS', 30))
+TRANSFER_SLOT_LEASE_SECONDS = int(os.environ.get('TRANSFER_SLOT_LEASE_SECONDS', 300))
+# Staff transfers count this many times over in the fair queue.
+TRANSFER_STAFF_WEIGHT = float(os.environ.get('TRANSFER_STAFF_WEIGHT', 1))
+
+# Request metrics: Server-Timing headers on every response and per-route
+# Prometheus histograms at /metrics, which requires METRICS_TOKEN as a bearer
+# token when set. METRICS_PROFILE_THRESHOLD_MS turns on the sampling profiler:
+# requests slower than that leave folded stacks in METRICS_PROFILE_DIR.
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+METRICS_PROFILE_THRESHOLD_MS = float(os.environ['METRICS_PROFILE_THRESHOLD_MS']) if os.environ.get('METRICS_PROFILE_THRESHOLD_MS') else None
+METRICS_PROFILE_INTERVAL_MS = float(os.environ.get('METRICS_PROFILE_INTERVAL_MS', 5))
+METRICS_PROFILE_DIR = os.environ.get('METRICS_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -50,22 +203,32 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt.token_blacklist',
     "drf_spectacular",
     "api",
+    "api.metrics.apps.MetricsConfig",
     "api.storage.apps.StorageConfig",
     "api.user.apps.UserConfig",
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.user.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
         #'rest_framework.permissions.IsAuthenticated',  # default: require auth on all endpoints (can override per-view)
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.storage.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.throttles.TokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': THROTTLE_RATES,
 }
 
 MIDDLEWARE = [
+    'api.metrics.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +237,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'api.replicas.middleware.StickyPrimaryMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -111,6 +275,28 @@ DATABASES = {
     }
 }
 
+# Read replicas, as DB_REPLICAS=host[:port][/name],... (a second database on
+# the local server stands in for one). Read-only views read from a replica
+# less than DATABASE_REPLICA_MAX_LAG_SECONDS behind; for
+# DATABASE_REPLICA_STICKY_SECONDS after a user writes, their reads stay on
+# the primary. See api/replicas/routing.py.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), start=1):
+    address, _, name = replica.strip().partition('/')
+    host, _, port = address.partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host or DATABASES['default']['HOST'],
+        'PORT': port or DATABASES['default']['PORT'],
+        'NAME': name or DATABASES['default']['NAME'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['api.replicas.routing.ReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 10))
+DATABASE_REPLICA_MAX_LAG_SECONDS = float(os.environ.get('DATABASE_REPLICA_MAX_LAG_SECONDS', 5))
+DATABASE_REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('DATABASE_REPLICA_LAG_CHECK_SECONDS', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -136,8 +322,16 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_REFRESH_SERIALIZER': 'api.user.authentication.CachedTokenRefreshSerializer',
 }
 
+# Authenticated requests build the user from the token and a per-process
+# cache instead of loading it (see api.user.authentication). Set
+# AUTH_VERIFY_USER_IN_DB=1 to load and check the user row on every request.
+AUTH_VERIFY_USER_IN_DB = os.environ.get('AUTH_VERIFY_USER_IN_DB', '0') == '1'
+AUTH_USER_CACHE_SECONDS = int(os.environ.get('AUTH_USER_CACHE_SECONDS', 30))
+AUTH_BLACKLIST_SYNC_SECONDS = int(os.environ.get('AUTH_BLACKLIST_SYNC_SECONDS', 5))
+
 AUTH_USER_MODEL = 'user.CustomUser'
 
 # Internationalization